@@ -0,0 +1,507 @@
+"""
+CMPortal AcroForm Reader
+Reads the form fields of a PDF without building a full PdfReader field tree.
+
+The reader follows the cross-reference tables to the catalog's /AcroForm, then
+parses only the field dictionaries it walks, each one on first use. Object
+parsing uses a compiled tokenizer over the file bytes instead of PyPDF2's
+byte-at-a-time stream reads. Field order, names and values match
+PdfReader.get_fields() exactly (values are built with PyPDF2's own object types).
+Anything outside the plain layout this reader handles (cross-reference streams,
+encryption, damaged offsets, unusual syntax) is read with PyPDF2 instead.
+
+Micro-benchmark against PyPDF2 (from the repository root):
+    python -m dashboard.tools.cmportal.core.cmportal_acroform [form.pdf ...]
+"""
+
+import io
+import os
+import re
+import sys
+import time
+import logging
+from binascii import unhexlify
+from collections import namedtuple
+
+from PyPDF2 import PdfReader
+from PyPDF2.constants import FieldDictionaryAttributes, CheckboxRadioButtonAttributes
+from PyPDF2.generic import (
+    ArrayObject, BooleanObject, DictionaryObject, FloatObject, NameObject, NullObject, NumberObject,
+    create_string_object
+)
+
+logger = logging.getLogger(__name__)
+
+# Keys that make a dictionary a field for get_fields(), and the ones returned per field
+FIELD_ATTRIBUTES = tuple(FieldDictionaryAttributes.attributes_dict()) + tuple(CheckboxRadioButtonAttributes.attributes_dict())
+FIELD_VALUE_KEYS = ('/FT', '/V')
+# Dictionary entries the field walk reads; others (appearance streams, widget geometry) are skipped unparsed
+WALK_KEYS = frozenset(('/AcroForm', '/Fields', '/Kids', '/T', '/TM') + FIELD_VALUE_KEYS)
+
+# Whitespace accepted in every context by PyPDF2's parser, and comments
+_SPACE = rb'(?:[ \t\r\n]|%[^\r\n]*)*'
+
+_TOKEN = re.compile(_SPACE + rb'''(?:
+      (?P<ref>(?P<num>\d+)[ \t\r\n]+(?P<gen>\d+)[ \t\r\n]+R)(?![a-zA-Z])
+    | (?P<number>[+\-.0-9][+,\-.0-9]*)
+    | (?P<name>/[^\s()<>\[\]{}/%]*)
+    | (?P<dict_open><<)
+    | (?P<dict_close>>>)
+    | (?P<hex><)
+    | (?P<array_open>\[)
+    | (?P<array_close>\])
+    | (?P<string>\()
+    | (?P<true>true)
+    | (?P<false>false)
+    | (?P<null>null|(?=endobj))
+)''', re.VERBOSE)
+
+_STRING_SPECIAL = re.compile(rb'[()\\]')
+_SKIP_PLAIN = re.compile(rb'[^()<>\[\]%]*')
+_COMMENT = re.compile(rb'%[^\r\n]*')
+_HEX_DIGITS = re.compile(rb'[0-9A-Fa-f]*')
+_HEX_SPACE = re.compile(rb'[ \n\r\t\x00]')
+_OBJECT_HEADER = re.compile(_SPACE + rb'(\d+)[ \t\r\n]+(\d+)[ \t\r\n]+obj')
+_STARTXREF = re.compile(rb'startxref[ \t\r\n]*(\d+)[ \t\r\n]*%%EOF')
+_XREF_SUBSECTION = re.compile(rb'[ \t\r\n\x00]*(\d+)[ \t\r\n\x00]+(\d+)[ \t\r\n\x00]*')
+_XREF_ENTRY = re.compile(rb'(\d{10}) (\d{5}) ([nf])[ \r\n]{1,2}')
+_TRAILER = re.compile(rb'[ \t\r\n\x00]*trailer')
+
+# Literal string escapes, as PyPDF2 decodes them
+_ESCAPES = {
+    b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f', b'c': rb'\c',
+    b'(': b'(', b')': b')', b'/': b'/', b'\\': b'\\', b' ': b' ', b'%': b'%',
+    b'<': b'<', b'>': b'>', b'[': b'[', b']': b']', b'#': b'#', b'_': b'_', b'&': b'&', b'$': b'$'
+}
+
+_Ref = namedtuple('_Ref', ['num', 'gen'])
+_Number = namedtuple('_Number', ['token'])
+_SKIPPED = object()   # Placeholder for a dictionary value that was not parsed
+
+
+class UnsupportedPdf(Exception):
+    """The PDF uses a feature this reader leaves to PyPDF2"""
+
+
+def _decode_name(raw):
+    """Name token (without the slash) as PyPDF2's NameObject text"""
+    if b'#' in raw:
+        i = raw.find(b'#')
+        while i >= 0:
+            try:
+                raw = raw[:i] + unhexlify(raw[i + 1:i + 3]) + raw[i + 3:]
+                i = raw.find(b'#', i + 1)
+            except ValueError:
+                i += 1
+    try:
+        return '/' + raw.decode('utf-8')
+    except UnicodeDecodeError:
+        raise UnsupportedPdf('non UTF-8 name')
+
+def _read_literal(buf, pos):
+    """Literal string starting after its '(' -> (bytes, end position)"""
+    out = bytearray()
+    depth = 1
+    while True:
+        m = _STRING_SPECIAL.search(buf, pos)
+        if m is None:
+            raise UnsupportedPdf('unterminated string')
+        i = m.start()
+        out += buf[pos:i]
+        c = buf[i:i + 1]
+        pos = i + 1
+        if c == b'(':
+            depth += 1
+            out += c
+        elif c == b')':
+            depth -= 1
+            if depth == 0:
+                return bytes(out), pos
+            out += c
+        else:
+            escaped = buf[pos:pos + 1]
+            pos += 1
+            if escaped in _ESCAPES:
+                out += _ESCAPES[escaped]
+            elif b'0' <= escaped <= b'7' and escaped:
+                digits = escaped
+                while len(digits) < 3 and b'0' <= buf[pos:pos + 1] <= b'7' and buf[pos:pos + 1]:
+                    digits += buf[pos:pos + 1]
+                    pos += 1
+                code = int(digits, 8)
+                out += bytes((code,)) if code < 256 else chr(code).encode('utf-8')
+            elif escaped in (b'\n', b'\r'):
+                # Escaped line break: dropped, together with the second byte of a two-byte EOL
+                if buf[pos:pos + 1] in (b'\n', b'\r'):
+                    pos += 1
+            elif escaped and escaped < b'\x80':
+                out += escaped
+            else:
+                raise UnsupportedPdf('unsupported string escape')
+
+def _read_hex(buf, pos):
+    """Hex string starting after its '<' -> (bytes, end position)"""
+    end = buf.find(b'>', pos)
+    if end < 0:
+        raise UnsupportedPdf('unterminated hex string')
+    digits = _HEX_SPACE.sub(b'', buf[pos:end])
+    if _HEX_DIGITS.fullmatch(digits) is None:
+        raise UnsupportedPdf('invalid hex string')
+    if len(digits) % 2:
+        digits += b'0'
+    return unhexlify(digits), end + 1
+
+def _skip_value(buf, pos):
+    """End position of the object at pos, found by jumping between delimiters"""
+    m = _TOKEN.match(buf, pos)
+    if m is None:
+        raise UnsupportedPdf(f'unexpected token at byte {pos}')
+    kind = m.lastgroup
+    pos = m.end()
+    if kind == 'string':
+        return _read_literal(buf, pos)[1]
+    if kind == 'hex':
+        return _read_hex(buf, pos)[1]
+    if kind not in ('dict_open', 'array_open'):
+        return pos
+    depth = 1
+    while depth:
+        pos = _SKIP_PLAIN.match(buf, pos).end()
+        c = buf[pos:pos + 1]
+        if c == b'(':
+            pos = _read_literal(buf, pos + 1)[1]
+        elif c == b'<':
+            if buf[pos + 1:pos + 2] == b'<':
+                depth += 1
+                pos += 2
+            else:
+                pos = _read_hex(buf, pos + 1)[1]
+        elif c == b'>':
+            if buf[pos + 1:pos + 2] != b'>':
+                raise UnsupportedPdf(f'stray > at byte {pos}')
+            depth -= 1
+            pos += 2
+        elif c == b'[':
+            depth += 1
+            pos += 1
+        elif c == b']':
+            depth -= 1
+            pos += 1
+        elif c == b'%':
+            pos = _COMMENT.match(buf, pos).end()
+        else:
+            raise UnsupportedPdf('unterminated object')
+    return pos
+
+def parse_object(buf, pos, keep=None):
+    """
+    One PDF object at pos -> (value, end position).
+
+    Names become str, strings bytes, numbers _Number tokens, references _Ref, and
+    dictionaries/arrays dict/list; stream data after a dictionary is not read.
+    When keep is given and the object is a dictionary, values of its keys not in
+    keep are skipped without parsing (the key maps to a placeholder).
+    """
+    stack = []   # [container, pending dictionary key]
+    while True:
+        m = _TOKEN.match(buf, pos)
+        if m is None:
+            raise UnsupportedPdf(f'unexpected token at byte {pos}')
+        kind = m.lastgroup
+        pos = m.end()
+        if kind == 'dict_open':
+            stack.append([{}, None])
+            continue
+        if kind == 'array_open':
+            stack.append([[], None])
+            continue
+        if kind == 'dict_close':
+            if not stack or type(stack[-1][0]) is not dict or stack[-1][1] is not None:
+                raise UnsupportedPdf(f'unbalanced dictionary at byte {pos}')
+            value = stack.pop()[0]
+        elif kind == 'array_close':
+            if not stack or type(stack[-1][0]) is not list:
+                raise UnsupportedPdf(f'unbalanced array at byte {pos}')
+            value = stack.pop()[0]
+        elif kind == 'name':
+            value = _decode_name(m.group('name')[1:])
+        elif kind == 'ref':
+            # PyPDF2 only recognises a reference within a 20-byte look-ahead
+            if m.end('ref') - m.start('ref') >= 20:
+                raise UnsupportedPdf(f'long reference at byte {pos}')
+            value = _Ref(int(m.group('num')), int(m.group('gen')))
+        elif kind == 'number':
+            value = _Number(m.group('number'))
+        elif kind == 'string':
+            value, pos = _read_literal(buf, pos)
+        elif kind == 'hex':
+            value, pos = _read_hex(buf, pos)
+        elif kind == 'null' and stack and not m.group('null'):
+            raise UnsupportedPdf(f'endobj inside an object at byte {pos}')
+        else:
+            value = {'true': True, 'false': False, 'null': None}[kind]
+
+        if not stack:
+            return value, pos
+        container, key = stack[-1]
+        if type(container) is list:
+            container.append(value)
+        elif key is None:
+            if type(value) is not str:
+                raise UnsupportedPdf(f'dictionary key is not a name at byte {pos}')
+            if keep is not None and len(stack) == 1 and value not in keep:
+                if value in container:
+                    raise UnsupportedPdf(f'duplicate dictionary key {value}')
+                pos = _skip_value(buf, pos)
+                container[value] = _SKIPPED
+                continue
+            stack[-1][1] = value
+        else:
+            if key in container:
+                raise UnsupportedPdf(f'duplicate dictionary key {key}')
+            container[key] = value
+            stack[-1][1] = None
+
+def to_pdf_object(value):
+    """Parsed value as the PyPDF2 object get_fields() would hold"""
+    if type(value) is bytes:
+        return create_string_object(value)
+    if type(value) is str:
+        return NameObject(value)
+    if type(value) is _Number:
+        token = value.token
+        return FloatObject(token.decode('latin-1')) if b'.' in token else NumberObject(token)
+    if type(value) is bool:
+        return BooleanObject(value)
+    if value is None:
+        return NullObject()
+    if type(value) is list:
+        return ArrayObject(to_pdf_object(item) for item in value)
+    if type(value) is dict:
+        return DictionaryObject({NameObject(key): to_pdf_object(item) for key, item in value.items()})
+    raise UnsupportedPdf('indirect reference inside a field value')
+
+
+class AcroFormReader:
+    """
+    Lazy reader for the form fields of one PDF held in memory.
+
+    Only classic cross-reference tables (including incremental updates) are read;
+    objects are parsed when first resolved and cached, and the dictionaries walked
+    for fields keep only WALK_KEYS values. Raises UnsupportedPdf for
+    anything it does not handle exactly like PyPDF2.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.xref = {}       # (num, gen) -> offset, or None for a free entry
+        self.trailer = {}
+        self._objects = {}
+        self._read_xref()
+
+    def _read_xref(self):
+        buf = self.data
+        matches = list(_STARTXREF.finditer(buf, max(0, len(buf) - 2048)))
+        if not matches:
+            raise UnsupportedPdf('startxref not found')
+        offset = int(matches[-1].group(1))
+        if buf[offset - 1:offset] not in (b'\r', b'\n', b' ', b'\t') or offset == 0:
+            raise UnsupportedPdf('startxref does not point after whitespace')
+
+        seen = set()
+        while True:
+            if buf[offset:offset + 1] in (b'\r', b'\n'):
+                offset += 1
+            if buf[offset:offset + 4] != b'xref' or offset in seen:
+                raise UnsupportedPdf('no cross-reference table at startxref')
+            seen.add(offset)
+            pos = offset + 4
+            while True:
+                m = _XREF_SUBSECTION.match(buf, pos)
+                if m is None:
+                    raise UnsupportedPdf('bad cross-reference subsection')
+                start, count = int(m.group(1)), int(m.group(2))
+                pos = m.end()
+                for num in range(start, start + count):
+                    entry = _XREF_ENTRY.match(buf, pos)
+                    if entry is None:
+                        raise UnsupportedPdf('bad cross-reference entry')
+                    pos = entry.end()
+                    key = (num, int(entry.group(2)))
+                    if key not in self.xref:
+                        self.xref[key] = int(entry.group(1)) if entry.group(3) == b'n' else None
+                trailer = _TRAILER.match(buf, pos)
+                if trailer is not None:
+                    pos = trailer.end()
+                    break
+
+            section, _ = parse_object(buf, pos)
+            if type(section) is not dict or '/XRefStm' in section:
+                raise UnsupportedPdf('unsupported trailer')
+            for key, value in section.items():
+                self.trailer.setdefault(key, value)
+            if '/Prev' not in section:
+                break
+            prev = section['/Prev']
+            if type(prev) is not _Number or not prev.token.isdigit() or int(prev.token) == 0:
+                raise UnsupportedPdf('unsupported /Prev')
+            offset = int(prev.token)
+
+        if '/Encrypt' in self.trailer:
+            raise UnsupportedPdf('encrypted')
+
+    def resolve(self, value, keep=None):
+        """
+        Follow an indirect reference (other values are returned unchanged). With keep,
+        a dictionary is parsed with only those keys' values (see parse_object).
+        """
+        if type(value) is not _Ref:
+            return value
+        cache_key = (value, keep)
+        if cache_key in self._objects:
+            return self._objects[cache_key]
+        if value not in self.xref:
+            raise UnsupportedPdf(f'object {value.num} {value.gen} missing from the cross-reference table')
+        offset = self.xref[value]
+        if offset is None:
+            obj = None
+        else:
+            m = _OBJECT_HEADER.match(self.data, offset)
+            if m is None or (int(m.group(1)), int(m.group(2))) != value:
+                raise UnsupportedPdf(f'object {value.num} {value.gen} is not at its offset')
+            obj, _ = parse_object(self.data, m.end(), keep)
+        self._objects[cache_key] = obj
+        return obj
+
+    def _dict(self, value):
+        value = self.resolve(value, WALK_KEYS)
+        if type(value) is not dict:
+            raise UnsupportedPdf('expected a dictionary')
+        return value
+
+    def _array(self, value):
+        value = self.resolve(value)
+        if type(value) is not list:
+            raise UnsupportedPdf('expected an array')
+        return value
+
+    def fields(self):
+        """
+        Form fields in get_fields() order: {name: {'/FT': ..., '/V': ...}}, with each
+        key present only when the field dictionary itself has it, or None without /AcroForm
+        """
+        catalog = self._dict(self.trailer.get('/Root'))
+        if '/AcroForm' not in catalog:
+            return None
+        fields = {}
+        self._collect(self._dict(catalog['/AcroForm']), fields)
+        return fields
+
+    # The three methods below mirror PdfReader.get_fields/_check_kids/_build_field,
+    # including visiting a kid's own kids twice, so duplicate names resolve the same way
+    def _collect(self, tree, fields):
+        self._check_kids(tree, fields)
+        if any(attr in tree for attr in FIELD_ATTRIBUTES):
+            self._build_field(tree, fields)
+        if '/Fields' in tree:
+            for field in self._array(tree['/Fields']):
+                self._build_field(self._dict(field), fields)
+
+    def _check_kids(self, tree, fields):
+        if '/Kids' in tree:
+            for kid in self._array(tree['/Kids']):
+                self._collect(self._dict(kid), fields)
+
+    def _build_field(self, field, fields):
+        self._check_kids(field, fields)
+        if '/TM' in field:
+            name = field['/TM']
+        elif '/T' in field:
+            name = field['/T']
+        else:
+            return
+        fields[to_pdf_object(self.resolve(name))] = {
+            key: to_pdf_object(self.resolve(field[key])) for key in FIELD_VALUE_KEYS if key in field
+        }
+
+
+def _read_source(source):
+    """File bytes of a path or a seekable binary stream (the whole stream, as PdfReader reads it)"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return f.read()
+    if isinstance(source, io.BytesIO):
+        return source.getvalue()
+    source.seek(0)
+    return source.read()
+
+def _pypdf2_fields(data):
+    fields = PdfReader(io.BytesIO(data)).get_fields()
+    if fields is None:
+        return None
+    return {name: {key: field[key] for key in FIELD_VALUE_KEYS if key in field} for name, field in fields.items()}
+
+def read_form_fields(source):
+    """
+    Form field types and values of a PDF.
+
+    Args:
+        source: PDF path or binary stream
+
+    Returns:
+        {field name: {'/FT': type, '/V': value}} in PdfReader.get_fields() order (each
+        key only when the field sets it), or None when the PDF has no form
+    """
+    data = _read_source(source)
+    try:
+        return AcroFormReader(data).fields()
+    except Exception as e:
+        logger.debug(f'Reading form fields with PyPDF2: {e}')
+        return _pypdf2_fields(data)
+
+
+# ----- Micro-benchmark -----
+def _same_fields(fast, reference):
+    """Equal field order, names, values and value types"""
+    if fast is None or reference is None:
+        return fast is reference
+    if list(fast) != list(reference):
+        return False
+    return all(
+        fast[name].keys() == reference[name].keys()
+        and all(type(fast[name][key]) is type(reference[name][key]) and fast[name][key] == reference[name][key]
+                for key in fast[name])
+        for name in fast
+    )
+
+def benchmark(paths, repeat=20):
+    """Per-file timings of read_form_fields against PdfReader(...).get_fields()"""
+    results = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        fast = AcroFormReader(data).fields()
+        same = _same_fields(fast, _pypdf2_fields(data))
+
+        timings = {}
+        for label, read in (('pypdf2', lambda: PdfReader(io.BytesIO(data)).get_fields()),
+                            ('acroform', lambda: AcroFormReader(data).fields())):
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                read()
+                best = min(best, time.perf_counter() - start)
+            timings[label] = best
+        results.append({'path': path, 'fields': len(fast or {}), 'same': same, **timings})
+    return results
+
+
+if __name__ == '__main__':
+    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    default_paths = [os.path.join(BASE_DIR, 'static', 'datasets', name)
+                     for name in ('CMPortal_Protocol_Form.pdf', 'CMPortal_Data_Form.pdf')]
+
+    for result in benchmark(sys.argv[1:] or default_paths):
+        print(f'{os.path.basename(result["path"])}: {result["fields"]} fields, '
+              f'identical={result["same"]}, PyPDF2 {result["pypdf2"] * 1000:.2f} ms, '
+              f'AcroFormReader {result["acroform"] * 1000:.2f} ms '
+              f'({result["pypdf2"] / result["acroform"]:.1f}x)')
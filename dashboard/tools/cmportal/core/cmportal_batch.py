@@ -0,0 +1,402 @@
+"""
+CMPortal Batch Benchmarking
+Scores many protocol/data PDF pairs offline, with the same extraction and maturity
+scoring as /api/submit_benchmark. PDFs are parsed across all cores by a
+PdfExtractionPool (one isolated process per file, with its timeout, memory limit
+and content cache), and rows stream to a CSV file or a Parquet dataset directory
+as pairs finish. A re-run skips pairs already scored in the output, so an interrupted
+batch resumes where it stopped; pairs that failed (missing files, timeouts, bad
+forms) are dropped from the output and retried.
+
+Pairs come from a directory (<name>_protocol.pdf next to <name>_data.pdf, searched
+recursively) or from a manifest CSV with protocol and data columns (and an optional
+name column; relative paths are resolved against the manifest's directory).
+
+Run (from the repository root):
+    python -m dashboard.tools.cmportal.core.cmportal_batch submissions/ -o results.csv
+    python -m dashboard.tools.cmportal.core.cmportal_batch --manifest pairs.csv -o results.parquet
+"""
+
+import os
+import csv
+import sys
+import time
+import logging
+import argparse
+import statistics
+from collections import deque, namedtuple
+from concurrent.futures import Future, wait
+
+from dashboard.tools.cmportal.core.cmportal_config import (
+    DATASET_PATHS, PDF_TIMEOUT_SECONDS, PDF_MEMORY_LIMIT, PDF_CACHE_PATH, PDF_CACHE_MEMORY_BUDGET,
+    PDF_CACHE_DISK_BUDGET, PDF_CACHE_TTL_SECONDS
+)
+from dashboard.tools.cmportal.core.cmportal_extraction import PdfExtractionPool, ExtractionCache
+from dashboard.tools.cmportal.core.cmportal_utils import process_maturity_indicators, MATURITY_INDICATORS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+BenchmarkPair = namedtuple('BenchmarkPair', ['name', 'protocol_path', 'data_path'])
+
+# Output columns and their Parquet types; each indicator adds a quantile and a flag column
+# (flags as in process_maturity_indicators: 0 predicted, 1 measured, 3/4 beyond the ranges)
+RESULT_COLUMNS = [
+    ('name', 'string'), ('protocol_file', 'string'), ('data_file', 'string'),
+    ('status', 'string'), ('error', 'string'), ('protocol_name', 'string')
+]
+for _indicator in MATURITY_INDICATORS:
+    RESULT_COLUMNS += [(f'{_indicator} - Quantile', 'string'), (f'{_indicator} - Flag', 'int64')]
+RESULT_COLUMNS += [('bytes', 'int64'), ('parse_seconds', 'float64'), ('score_seconds', 'float64')]
+RESULT_COLUMN_NAMES = [name for name, _ in RESULT_COLUMNS]
+
+
+# ----- Pair discovery -----
+def find_pairs(directory, protocol_suffix='_protocol', data_suffix='_data'):
+    """
+    Protocol/data pairs under directory, matched by file name.
+
+    Returns:
+        (pairs, unmatched): BenchmarkPairs named by their path relative to directory
+        (without the suffix), sorted by name, and the PDF paths that have no partner
+    """
+    protocols, data = {}, {}
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            stem, extension = os.path.splitext(filename)
+            if extension.lower() != '.pdf':
+                continue
+            path = os.path.join(root, filename)
+            relative_stem = os.path.relpath(os.path.join(root, stem), directory)
+            if stem.lower().endswith(protocol_suffix.lower()):
+                protocols[relative_stem[:-len(protocol_suffix)]] = path
+            elif stem.lower().endswith(data_suffix.lower()):
+                data[relative_stem[:-len(data_suffix)]] = path
+
+    pairs = [BenchmarkPair(name, protocols[name], data[name]) for name in sorted(protocols.keys() & data.keys())]
+    unmatched = sorted(path for name, path in list(protocols.items()) + list(data.items())
+                       if name not in protocols or name not in data)
+    return pairs, unmatched
+
+def read_manifest(manifest_path):
+    """BenchmarkPairs listed in a manifest CSV (protocol, data and optional name columns)"""
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    pairs = []
+    with open(manifest_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        missing = {'protocol', 'data'} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f'Manifest {manifest_path} has no {", ".join(sorted(missing))} column')
+        for row in reader:
+            protocol_path = os.path.join(base, row['protocol'])
+            data_path = os.path.join(base, row['data'])
+            name = (row.get('name') or '').strip() or os.path.splitext(row['protocol'])[0]
+            pairs.append(BenchmarkPair(name, protocol_path, data_path))
+    return pairs
+
+
+# ----- Result writers -----
+class CsvResultWriter:
+    """
+    Appends result rows to a CSV file, flushing after each one. Error rows of an
+    earlier run are removed on open, so those pairs are retried.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            self._drop_partial_line()
+            with open(path, newline='', encoding='utf-8') as f:
+                reader = csv.DictReader(f)
+                if reader.fieldnames != RESULT_COLUMN_NAMES:
+                    raise ValueError(f'{path} was written with different columns; use a new output file')
+                rows = list(reader)
+            scored = [row for row in rows if row['status'] == 'ok']
+            if len(scored) < len(rows):
+                self._rewrite(scored)
+            self.done = {row['name'] for row in scored}
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=RESULT_COLUMN_NAMES)
+        if not exists:
+            self._writer.writeheader()
+
+    def _drop_partial_line(self):
+        """Cut a row left half-written by an interrupted run"""
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def _rewrite(self, rows):
+        with open(self.path + '.tmp', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_COLUMN_NAMES)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(self.path + '.tmp', self.path)
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+        self.done.add(row['name'])
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResultWriter:
+    """
+    Writes result rows to a Parquet dataset directory, one part file per batch_size
+    rows (read back with pandas.read_parquet(path)). Parts are written to a temporary
+    name and renamed, so an interrupted run loses at most its unwritten batch.
+    Error rows of an earlier run are filtered out of their parts on open, so those
+    pairs are retried.
+    """
+    def __init__(self, path, batch_size=50):
+        if pq is None:
+            raise RuntimeError('Parquet output requires the pyarrow package')
+        self.path = path
+        self.batch_size = batch_size
+        self.schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in RESULT_COLUMNS])
+        self._rows = []
+        os.makedirs(path, exist_ok=True)
+        parts = sorted(name for name in os.listdir(path) if name.startswith('part-') and name.endswith('.parquet'))
+        self._next_part = max((int(part[5:-8]) for part in parts), default=-1) + 1
+        self.done = set()
+        for part in parts:
+            part_path = os.path.join(path, part)
+            statuses = pq.read_table(part_path, columns=['status']).column('status').to_pylist()
+            if any(status != 'ok' for status in statuses):
+                table = pq.read_table(part_path)
+                table = table.filter(pa.array([status == 'ok' for status in statuses]))
+                pq.write_table(table, part_path + '.tmp')
+                os.replace(part_path + '.tmp', part_path)
+            self.done.update(pq.read_table(part_path, columns=['name']).column('name').to_pylist())
+
+    def write(self, row):
+        self._rows.append(row)
+        self.done.add(row['name'])
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        table = pa.Table.from_pylist(self._rows, schema=self.schema)
+        part_path = os.path.join(self.path, f'part-{self._next_part:05d}.parquet')
+        pq.write_table(table, part_path + '.tmp')
+        os.replace(part_path + '.tmp', part_path)
+        self._next_part += 1
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+
+def open_result_writer(path, batch_size=50):
+    """CSV writer for a .csv path, Parquet dataset writer for a .parquet path"""
+    if path.lower().endswith('.parquet'):
+        return ParquetResultWriter(path, batch_size)
+    return CsvResultWriter(path)
+
+
+# ----- Scoring -----
+def score_pair(pair, user_data, protocol_features, target_feature_dict):
+    """Result row for one pair from its extracted data (parse timing is filled in by the caller)"""
+    row = dict.fromkeys(RESULT_COLUMN_NAMES)
+    row.update(name=pair.name, protocol_file=pair.protocol_path, data_file=pair.data_path, status='ok', error='')
+    start = time.perf_counter()
+    protocol_name, results_by_indicator = process_maturity_indicators(user_data, protocol_features, target_feature_dict)
+    row['score_seconds'] = time.perf_counter() - start
+    row['protocol_name'] = protocol_name
+    for indicator, (quantile, flag) in results_by_indicator.items():
+        row[f'{indicator} - Quantile'] = quantile
+        row[f'{indicator} - Flag'] = flag
+    return row
+
+def failed_row(pair, error):
+    row = dict.fromkeys(RESULT_COLUMN_NAMES)
+    row.update(name=pair.name, protocol_file=pair.protocol_path, data_file=pair.data_path,
+               status='error', error=str(error))
+    return row
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def _submit(submit, *args):
+    """
+    A pool job, or an already failed Future when submitting raises (with the cache on,
+    the file is hashed at submission, so a missing or unreadable file fails here)
+    """
+    try:
+        return submit(*args)
+    except Exception as e:
+        future = Future()
+        future.set_exception(e)
+        return future
+
+def _finish_time(future, finished):
+    future.add_done_callback(lambda _: finished.append(time.perf_counter()))
+
+
+def run_batch(pairs, writer, pool, progress_every=10):
+    """
+    Benchmark every pair not already in writer.done and write one row per pair.
+    A pair that cannot be read or scored gets an error row; the run goes on.
+
+    About max_workers/2 pairs are in flight at once, so both PDFs of a pair parse
+    concurrently and parse_seconds is the pair's own latency, not time spent queued.
+
+    Returns:
+        Summary dict (counts, wall time, throughput and per-pair timings)
+    """
+    from dashboard.tools.cmportal.core.cmportal_data_manager import get_target_feature_dict, get_candidates
+
+    target_feature_dict = get_target_feature_dict(DATASET_PATHS['odds_filepath'])
+    candidates = get_candidates()
+
+    todo = [pair for pair in pairs if pair.name not in writer.done]
+    skipped = len(pairs) - len(todo)
+    if skipped:
+        logger.info(f'Skipping {skipped} pairs already in the output')
+
+    window = max(1, pool.max_workers // 2)
+    queue = deque(todo)
+    in_flight = deque()
+    rows = []
+    total_bytes = 0
+    start = time.perf_counter()
+
+    def dispatch():
+        pair = queue.popleft()
+        finished = []
+        data_job = _submit(pool.submit_user_data, pair.data_path)
+        features_job = _submit(pool.submit_protocol_features, pair.protocol_path, candidates)
+        started = time.perf_counter()
+        _finish_time(data_job, finished)
+        _finish_time(features_job, finished)
+        in_flight.append((pair, started, finished, data_job, features_job))
+
+    while queue and len(in_flight) < window:
+        dispatch()
+    while in_flight:
+        pair, started, finished, data_job, features_job = in_flight.popleft()
+        wait([data_job, features_job])
+        try:
+            row = score_pair(pair, data_job.result(), features_job.result(), target_feature_dict)
+        except Exception as e:
+            row = failed_row(pair, e)
+        row['bytes'] = _file_size(pair.protocol_path) + _file_size(pair.data_path)
+        row['parse_seconds'] = max(finished, default=started) - started
+        writer.write(row)
+        rows.append(row)
+        total_bytes += row['bytes']
+
+        if row['status'] != 'ok':
+            logger.warning(f'{pair.name}: {row["error"]}')
+        if len(rows) % progress_every == 0 or len(rows) == len(todo):
+            elapsed = time.perf_counter() - start
+            logger.info(f'{len(rows)}/{len(todo)} pairs ({len(rows) / elapsed:.2f} pairs/s)')
+        if queue:
+            dispatch()
+
+    elapsed = time.perf_counter() - start
+    return summarize(rows, skipped, elapsed, total_bytes)
+
+def summarize(rows, skipped, elapsed, total_bytes):
+    parse_times = sorted(row['parse_seconds'] for row in rows)
+    ok = sum(row['status'] == 'ok' for row in rows)
+    summary = {
+        'pairs': len(rows),
+        'ok': ok,
+        'failed': len(rows) - ok,
+        'skipped': skipped,
+        'wall_seconds': elapsed,
+        'pairs_per_second': len(rows) / elapsed if elapsed else 0.0,
+        'files_per_second': 2 * len(rows) / elapsed if elapsed else 0.0,
+        'megabytes_per_second': total_bytes / (1024 * 1024) / elapsed if elapsed else 0.0,
+        'slowest': sorted(rows, key=lambda row: row['parse_seconds'], reverse=True)[:5],
+        'failures': [row for row in rows if row['status'] != 'ok']
+    }
+    if parse_times:
+        summary['parse_seconds'] = {
+            'median': statistics.median(parse_times),
+            'p95': parse_times[min(len(parse_times) - 1, int(0.95 * len(parse_times)))],
+            'max': parse_times[-1]
+        }
+    return summary
+
+def format_summary(summary):
+    lines = [f'Benchmarked {summary["pairs"]} pairs ({summary["ok"]} ok, {summary["failed"]} failed), '
+             f'skipped {summary["skipped"]} already written']
+    if summary['pairs']:
+        lines.append(f'Wall time {summary["wall_seconds"]:.1f} s: {summary["pairs_per_second"]:.2f} pairs/s, '
+                     f'{summary["files_per_second"]:.2f} files/s, {summary["megabytes_per_second"]:.2f} MB/s')
+        timings = summary['parse_seconds']
+        lines.append(f'Per pair: median {timings["median"]:.3f} s, p95 {timings["p95"]:.3f} s, max {timings["max"]:.3f} s')
+        lines.append('Slowest: ' + ', '.join(f'{row["name"]} ({row["parse_seconds"]:.3f} s)' for row in summary['slowest']))
+    for row in summary['failures']:
+        lines.append(f'Failed: {row["name"]}: {row["error"]}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark protocol/data PDF pairs offline')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('directory', nargs='?', help='Folder of <name>_protocol.pdf / <name>_data.pdf pairs')
+    source.add_argument('--manifest', help='CSV with protocol, data and optional name columns')
+    parser.add_argument('-o', '--output', required=True, help='Results .csv file or .parquet dataset directory')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='PDFs parsed at once (default: CPU count)')
+    parser.add_argument('--timeout', type=float, default=PDF_TIMEOUT_SECONDS, help='Seconds allowed per PDF')
+    parser.add_argument('--protocol-suffix', default='_protocol')
+    parser.add_argument('--data-suffix', default='_data')
+    parser.add_argument('--batch-size', type=int, default=50, help='Rows per Parquet part file')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or store cached extraction results')
+    args = parser.parse_args(argv)
+    if args.output.lower().endswith('.parquet') and pq is None:
+        parser.error('Parquet output requires the pyarrow package')
+
+    if args.manifest:
+        pairs = read_manifest(args.manifest)
+    else:
+        pairs, unmatched = find_pairs(args.directory, args.protocol_suffix, args.data_suffix)
+        for path in unmatched:
+            logger.warning(f'No partner for {path}')
+
+    names = [pair.name for pair in pairs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        parser.error(f'Duplicate pair names: {", ".join(duplicates)}')
+    logger.info(f'Found {len(pairs)} pairs')
+
+    cache = None
+    if not args.no_cache:
+        cache = ExtractionCache(PDF_CACHE_PATH, PDF_CACHE_MEMORY_BUDGET, PDF_CACHE_DISK_BUDGET, PDF_CACHE_TTL_SECONDS)
+    pool = PdfExtractionPool(max_workers=max(1, args.workers), timeout=args.timeout,
+                             memory_limit=PDF_MEMORY_LIMIT, cache=cache)
+
+    writer = open_result_writer(args.output, args.batch_size)
+    try:
+        summary = run_batch(pairs, writer, pool)
+    finally:
+        writer.close()
+    print(format_summary(summary))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    # Mirror app.py's import path so the data manager's `import config` resolves
+    BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+    sys.path.insert(0, BASE_DIR)
+    sys.path.insert(0, os.path.join(BASE_DIR, 'core'))
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    sys.exit(main())
@@ -9,6 +9,7 @@ import os
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 DATASETS_DIR = os.path.join(BASE_DIR, 'tools', 'cmportal', 'static', 'datasets')
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'tools', 'cmportal', 'uploads')
+CACHE_DIR = os.path.join(BASE_DIR, 'tools', 'cmportal', 'cache')
 
 # Dataset file paths - USE ORIGINAL KEY NAMES
 DATASET_PATHS = {
@@ -22,9 +23,76 @@ DATASET_PATHS = {
     'selected_vars_filepath': os.path.join(DATASETS_DIR, '2_SelectedVariables_12Dec25.csv')
 }
 
+# Compiled binary snapshot of DATASET_PATHS (see cmportal_snapshot.py)
+SNAPSHOT_PATH = os.path.join(CACHE_DIR, 'cmportal_datasets.snapshot')
+
 # Upload settings
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024
 ALLOWED_EXTENSIONS = {'csv', 'txt'}
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
\ No newline at end of file
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+# Viewer API page sizes (/api/viewer with query parameters)
+VIEWER_DEFAULT_LIMIT = 50
+VIEWER_MAX_LIMIT = 10000
+
+# Search page sizes (/api/submit_features with page/page_size/top_k)
+SEARCH_DEFAULT_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 1000
+
+# Largest number of queries accepted by /api/batch_search
+BATCH_MAX_QUERIES = 1000
+
+# Neighbour counts for /api/similar_protocols
+SIMILAR_DEFAULT_K = 10
+SIMILAR_MAX_K = 100
+
+# Suggestion counts for /api/suggest
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+# Dataset cache settings (see DatasetCache in cmportal_data_manager.py)
+CACHE_MEMORY_BUDGET = int(os.environ.get('CMPORTAL_CACHE_BUDGET_MB', 192)) * 1024 * 1024
+CACHE_TTL_SECONDS = int(os.environ.get('CMPORTAL_CACHE_TTL_SECONDS', 6 * 60 * 60))
+CACHE_PINNED_DATASETS = {'packed_binary', 'cleaned_df', 'categories_dict', 'target_feature_dict', 'enrichment_store',
+                         'viewer_index', 'benchmark_results', 'indicator_distributions'}
+
+# Serialized /api/submit_features results (see SearchResultCache in cmportal_data_manager.py)
+SEARCH_CACHE_MEMORY_BUDGET = int(os.environ.get('CMPORTAL_SEARCH_CACHE_MB', 32)) * 1024 * 1024
+
+# Uploaded PDFs stay in memory up to this size per file before spilling to UPLOAD_FOLDER,
+# on the endpoints that accept them (see CMPortalRequest in cmportal_extraction.py)
+UPLOAD_SPOOL_SIZE = int(os.environ.get('CMPORTAL_UPLOAD_SPOOL_MB', 4)) * 1024 * 1024
+PDF_UPLOAD_ENDPOINTS = {'submit_benchmark', 'submit_benchmark_job', 'similar_protocols'}
+
+# Uploaded PDF extraction (see PdfExtractionPool in cmportal_extraction.py): concurrent
+# worker processes, and the time and extra memory each file may use before it is killed
+PDF_WORKERS = int(os.environ.get('CMPORTAL_PDF_WORKERS', min(4, os.cpu_count() or 1)))
+PDF_TIMEOUT_SECONDS = float(os.environ.get('CMPORTAL_PDF_TIMEOUT_SECONDS', 30))
+PDF_MEMORY_LIMIT = int(os.environ.get('CMPORTAL_PDF_MEMORY_MB', 512)) * 1024 * 1024
+
+# Content-addressed cache of PDF extraction results (see ExtractionCache in cmportal_extraction.py):
+# an in-process LRU plus an SQLite file shared by all workers
+PDF_CACHE_PATH = os.environ.get('CMPORTAL_PDF_CACHE_PATH', os.path.join(CACHE_DIR, 'pdf_extractions.sqlite3'))
+PDF_CACHE_MEMORY_BUDGET = int(os.environ.get('CMPORTAL_PDF_CACHE_MB', 8)) * 1024 * 1024
+PDF_CACHE_DISK_BUDGET = int(os.environ.get('CMPORTAL_PDF_CACHE_DISK_MB', 64)) * 1024 * 1024
+PDF_CACHE_TTL_SECONDS = int(os.environ.get('CMPORTAL_PDF_CACHE_TTL_SECONDS', 30 * 24 * 60 * 60))
+
+# Background benchmark jobs (see BenchmarkJobQueue in cmportal_jobs.py): concurrent jobs per
+# worker, how long finished jobs are kept, and the job store ('sqlite', shared by all workers, or 'memory')
+BENCHMARK_JOB_WORKERS = int(os.environ.get('CMPORTAL_BENCHMARK_JOB_WORKERS', 2))
+BENCHMARK_JOB_TTL_SECONDS = int(os.environ.get('CMPORTAL_BENCHMARK_JOB_TTL_SECONDS', 60 * 60))
+BENCHMARK_JOB_STORE = os.environ.get('CMPORTAL_BENCHMARK_JOB_STORE', 'sqlite')
+BENCHMARK_JOB_STORE_PATH = os.environ.get('CMPORTAL_BENCHMARK_JOB_STORE_PATH', os.path.join(CACHE_DIR, 'benchmark_jobs.sqlite3'))
+# A queued or running job whose worker has not refreshed it for this long is marked failed
+BENCHMARK_JOB_STALE_SECONDS = int(os.environ.get('CMPORTAL_BENCHMARK_JOB_STALE_SECONDS', 30))
+
+# Nearest database protocols returned per submitted value (see IndicatorDistributions in cmportal_utils.py)
+BENCHMARK_NEAREST_PROTOCOLS = int(os.environ.get('CMPORTAL_BENCHMARK_NEAREST', 3))
+
+# Load every dataset when the worker starts instead of on first use
+PRELOAD_DATASETS = os.environ.get('CMPORTAL_PRELOAD', '') == '1'
+
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get('CMPORTAL_ADMIN_TOKEN', '')
@@ -1,32 +1,351 @@
 import os
 import csv
+import sys
+import time
+import threading
 import pandas as pd
 import numpy as np
 import gc
+import re
+import bisect
+import heapq
 import logging
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import Future
 
 # Import configuration with paths
 import config
+from dashboard.tools.cmportal.core.cmportal_config import (
+    DATASET_PATHS, SNAPSHOT_PATH, CACHE_MEMORY_BUDGET, CACHE_TTL_SECONDS, CACHE_PINNED_DATASETS,
+    SEARCH_CACHE_MEMORY_BUDGET
+)
+from dashboard.tools.cmportal.core.cmportal_snapshot import (
+    Snapshot, SnapshotWriter, file_sha256, sources_hash, is_mapped
+)
 
 # Setup a basic logger for use outside Flask context
 logger = logging.getLogger(__name__)
 
-# ----- Global dataframe holders -----
-# Initialize variables that will be used later for lazy loading
-_binary_df = None
-_cleaned_df = None
-_odds_enrichments_df = None
-_categories_dict = None
-_target_feature_dict = None
-viewer_data = None
-viewer_columns = None
-enrichment_data = None
-enrichment_columns = None
-_causal_categories_dict = None
+# ----- Dataset cache -----
+def estimate_size(obj, _seen=None):
+    """Rough in-memory size of a cached object in bytes"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    
+    # Arrays mapped from the dataset snapshot live in the shared page cache, not in this process
+    if isinstance(obj, pd.DataFrame):
+        if len(set(obj.dtypes)) == 1 and obj.dtypes.iloc[0].kind in 'biuf' and is_mapped(obj.to_numpy()):
+            return int(obj.index.memory_usage() + obj.columns.memory_usage(deep=True))
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    if isinstance(obj, np.ndarray):
+        return 0 if is_mapped(obj) else int(obj.nbytes)
+    
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += estimate_size(vars(obj), _seen)
+    return size
+
+
+class DatasetCache:
+    """
+    Owns every lazily loaded CMPortal dataset.
+    
+    Entries are evicted least-recently-used first when the estimated total size
+    exceeds the memory budget, or once they have not been used for ttl seconds.
+    Pinned entries are never evicted automatically; only clear(include_pinned=True)
+    drops them. Nothing is evicted on request teardown.
+    
+    Loads are single-flight: concurrent misses on the same key share one loader
+    call (the first thread loads, the rest wait on its Future), and the duration
+    of each load is recorded per key.
+    """
+    def __init__(self, memory_budget, ttl=None, pinned=()):
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self._pinned = set(pinned)
+        self._entries = OrderedDict()   # key -> [value, size, last_access]
+        self._lock = threading.RLock()
+        self._inflight = {}             # key -> Future of the running load
+        self.load_seconds = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(key, entry, time.monotonic()):
+                self._evict(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry[2] = time.monotonic()
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = estimate_size(value)
+        with self._lock:
+            self._entries[key] = [value, size, time.monotonic()]
+            self._entries.move_to_end(key)
+            self._enforce_budget(keep=key)
+        return value
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for key, loading it once on a miss even under concurrency"""
+        with self._lock:
+            value = self.get(key)
+            if value is not None:
+                return value
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._inflight[key] = Future()
+        
+        if not is_owner:
+            return future.result()
+        
+        try:
+            start = time.perf_counter()
+            value = loader()
+            self.load_seconds[key] = round(time.perf_counter() - start, 4)
+            if value is not None:
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def invalidate(self, key, expected=None):
+        """Drop key; with expected, only if it still holds that exact object"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (expected is None or entry[0] is expected):
+                del self._entries[key]
+
+    def pin(self, key):
+        with self._lock:
+            self._pinned.add(key)
+
+    def unpin(self, key):
+        with self._lock:
+            self._pinned.discard(key)
+            self._enforce_budget()
+
+    def evict_expired(self):
+        """Drop entries past their TTL; returns the number evicted"""
+        with self._lock:
+            now = time.monotonic()
+            expired = [k for k, e in self._entries.items() if self._expired(k, e, now)]
+            for key in expired:
+                self._evict(key)
+            return len(expired)
+
+    def clear(self, include_pinned=False):
+        """Admin eviction of all (optionally also pinned) entries"""
+        with self._lock:
+            for key in list(self._entries):
+                if include_pinned or key not in self._pinned:
+                    self._evict(key)
+        gc.collect()
+
+    @property
+    def total_size(self):
+        return sum(e[1] for e in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'memory_budget': self.memory_budget,
+                'total_size': self.total_size,
+                'load_seconds': dict(self.load_seconds),
+                'entries': {
+                    key: {'size': e[1], 'pinned': key in self._pinned}
+                    for key, e in self._entries.items()
+                }
+            }
+
+    def _expired(self, key, entry, now):
+        return bool(self.ttl) and key not in self._pinned and now - entry[2] > self.ttl
+
+    def _evict(self, key):
+        del self._entries[key]
+        self.evictions += 1
+        logger.info(f'Evicted cached dataset: {key}')
+
+    def _enforce_budget(self, keep=None):
+        self.evict_expired()
+        total = self.total_size
+        for key in list(self._entries):
+            if total <= self.memory_budget:
+                break
+            if key in self._pinned or key == keep:
+                continue
+            total -= self._entries[key][1]
+            self._evict(key)
+
+
+_dataset_cache = DatasetCache(CACHE_MEMORY_BUDGET, CACHE_TTL_SECONDS, CACHE_PINNED_DATASETS)
+
+def get_dataset_cache():
+    """Return the process-wide dataset cache (for stats and admin eviction)"""
+    return _dataset_cache
+
+# ----- Compiled dataset snapshot -----
+_snapshot = None
+_snapshot_checked = False
+_snapshot_lock = threading.Lock()
+_dataset_version = None
+_version_sources = None   # {DATASET_PATHS key: (mtime_ns, size)} _dataset_version was computed from
+_version_lock = threading.Lock()
+
+# (snapshot frame name, DATASET_PATHS key, pd.read_csv kwargs)
+_SNAPSHOT_FRAMES = [
+    ('binary_df', 'binary_filepath', {'low_memory': False}),
+    ('cleaned_df', 'cleaned_database_filepath', {}),
+    ('odds_enrichments_df', 'odds_filepath', {'low_memory': False}),
+    ('enrichment_df', 'enrich_filepath', {'low_memory': False}),
+    ('feature_categories_df', 'feature_categories_filepath', {'low_memory': False}),
+    ('causal_feature_categories_df', 'causal_feature_categories_filepath', {'low_memory': False}),
+]
+
+def get_snapshot():
+    """Memory-map the compiled dataset snapshot once per process; None if missing or stale"""
+    global _snapshot, _snapshot_checked
+    
+    if not _snapshot_checked:
+        with _snapshot_lock:
+            if not _snapshot_checked:
+                _snapshot = Snapshot.open(SNAPSHOT_PATH, DATASET_PATHS)
+                _snapshot_checked = True
+    
+    return _snapshot
+
+def _source_stats():
+    stats = {}
+    for key, path in DATASET_PATHS.items():
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stats[key] = (st.st_mtime_ns, st.st_size)
+    return stats
+
+def get_dataset_version():
+    """
+    Content hash of the source CSVs, identifying the loaded dataset version.
+    
+    The sources are stat'ed on every call (the same mtime/size check the snapshot
+    uses). When one changed on disk the version is recomputed; if it differs, the
+    snapshot is re-validated and every cached dataset, pinned ones included, is
+    dropped. Datasets loaded from then on, search cache keys and response ETags
+    all belong to the new version.
+    """
+    global _dataset_version, _version_sources, _snapshot_checked
+    
+    stats = _source_stats()
+    if stats == _version_sources:
+        return _dataset_version
+    with _version_lock:
+        if stats == _version_sources:
+            return _dataset_version
+        previous = _dataset_version
+        if previous is not None:
+            with _snapshot_lock:
+                _snapshot_checked = False
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            version = snapshot.dataset_version
+        else:
+            version = sources_hash({key: file_sha256(DATASET_PATHS[key]) for key in stats})
+        if previous is not None and version != previous:
+            logger.info(f'Dataset sources changed on disk ({previous[:12]} -> {version[:12]}); dropping cached datasets')
+            _dataset_cache.clear(include_pinned=True)
+        _dataset_version = version
+        _version_sources = stats
+        return version
+
+def _cached(key, loader):
+    """Cached dataset lookup; moves to a new dataset version first if the sources changed on disk"""
+    get_dataset_version()
+    return _dataset_cache.get_or_load(key, loader)
+
+def _read_dataset(name, filepath, **read_csv_kwargs):
+    """Read a dataset frame from the snapshot when it is current, otherwise parse the CSV"""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        df = snapshot.frame(name, filepath)
+        if df is not None:
+            return df
+    return pd.read_csv(filepath, **read_csv_kwargs)
+
+def compile_snapshot(dataset_paths, snapshot_path):
+    """Parse every CMPortal CSV and write them into one versioned binary snapshot"""
+    writer = SnapshotWriter(dataset_paths)
+    for name, key, read_csv_kwargs in _SNAPSHOT_FRAMES:
+        writer.add_frame(name, key, pd.read_csv(dataset_paths[key], **read_csv_kwargs))
+    
+    lookups = _read_lookup_tables(
+        dataset_paths['feature_categories_filepath'],
+        dataset_paths['target_param_filepath'],
+        dataset_paths['causal_feature_categories_filepath']
+    )
+    for name, key, table in zip(
+        ['feature_categories_lookup', 'target_parameters_lookup', 'causal_feature_categories_lookup'],
+        ['feature_categories_filepath', 'target_param_filepath', 'causal_feature_categories_filepath'],
+        lookups
+    ):
+        writer.add_list_dict(name, key, table)
+    
+    from dashboard.tools.cmportal.core.cmportal_utils import PackedFeatureMatrix
+    binary_df = pd.read_csv(dataset_paths['binary_filepath'], low_memory=False)
+    writer.add_array('packed_binary_words', 'binary_filepath', PackedFeatureMatrix.from_dataframe(binary_df).words)
+    
+    writer.add_string_list('selected_variables', 'selected_vars_filepath',
+                           _read_selected_variables(dataset_paths['selected_vars_filepath']))
+    
+    version = writer.write(snapshot_path)
+    logger.info(f'Compiled dataset snapshot {version[:12]} to {snapshot_path}')
+    return version
 
 # ----- Load small lookup tables into memory at startup -----
 def load_lookup_tables(feature_categories_filepath, target_param_filepath, causal_feature_categories_filepath=None):
+    """Load lookup tables into dictionaries, from the snapshot when it is current"""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        tables = [
+            snapshot.list_dict('feature_categories_lookup', feature_categories_filepath),
+            snapshot.list_dict('target_parameters_lookup', target_param_filepath),
+            snapshot.list_dict('causal_feature_categories_lookup', causal_feature_categories_filepath)
+            if causal_feature_categories_filepath else []
+        ]
+        if all(table is not None for table in tables):
+            return tuple(defaultdict(list, table) for table in tables)
+    
+    return _read_lookup_tables(feature_categories_filepath, target_param_filepath, causal_feature_categories_filepath)
+
+def _read_lookup_tables(feature_categories_filepath, target_param_filepath, causal_feature_categories_filepath=None):
     """Load lookup tables from CSV files into dictionaries"""
     FeatureCategories_dict = defaultdict(list)
     TargetParameters_dict = defaultdict(list)
@@ -66,173 +385,667 @@ def load_lookup_tables(feature_categories_filepath, target_param_filepath, causa
 # ----- Lazy Loading Helper Functions -----
 def load_viewer_data(cleaned_database_filepath):
     """Lazy loader for viewer data"""
-    global viewer_data, viewer_columns
-    
-    if viewer_data is None:
+    def _load():
         try:
-            _df = pd.read_csv(cleaned_database_filepath, low_memory=False)
+            _df = _read_dataset('cleaned_df', cleaned_database_filepath, low_memory=False)
             _df = _df.fillna("NaN")
-            viewer_data = _df.to_dict(orient='records')
-            viewer_columns = _df.columns.tolist()
+            data = _df.to_dict(orient='records')
+            columns = _df.columns.tolist()
             del _df
-            gc.collect()  # Explicitly call garbage collection
-            logger.info(f'Loaded cleaned database: {len(viewer_data)} rows')
+            logger.info(f'Loaded cleaned database: {len(data)} rows')
+            return data, columns
         except Exception as e:
             logger.error(f'Error loading cleaned database: {e}')
-            viewer_data = []
-            viewer_columns = []
+            return None
     
-    return viewer_data, viewer_columns
+    return _cached('viewer_data', _load) or ([], [])
 
 def load_enrichment_data(enrich_filepath):
     """Lazy loader for enrichment data"""
-    global enrichment_data, enrichment_columns
-    
-    if enrichment_data is None:
+    def _load():
         try:
-            _df = pd.read_csv(enrich_filepath, low_memory=False)
+            _df = _read_dataset('enrichment_df', enrich_filepath, low_memory=False)
             _df = _df.fillna('')
-            enrichment_data = _df.to_dict(orient='records')
-            enrichment_columns = _df.columns.tolist()
+            data = _df.to_dict(orient='records')
+            columns = _df.columns.tolist()
             del _df
-            gc.collect()  # Explicitly call garbage collection
-            logger.info(f'Loaded enrichment data: {len(enrichment_data)} rows')
+            logger.info(f'Loaded enrichment data: {len(data)} rows')
+            return data, columns
         except Exception as e:
             logger.error(f'Error loading enrichment data: {e}')
-            enrichment_data = []
-            enrichment_columns = []
+            return None
+    
+    return _cached('enrichment_data', _load) or ([], [])
+
+class EnrichmentStore:
+    """
+    In-memory enrichment table with lookup indexes, so the enrichment endpoints
+    never re-parse the CSV. Rebuilt only when the file's mtime changes.
     
-    return enrichment_data, enrichment_columns
+    Indexes:
+    - Target Label -> row ids (hash index)
+    - Prioritised Features word tokens -> distinct feature values (inverted index)
+    - Boolean mask of rows whose Prioritised Features is in SelectedVariables_lst
+    """
+    _token_pattern = re.compile(r'\w+')
+
+    def __init__(self, enrich_filepath, selected_variables=None):
+        self.filepath = enrich_filepath
+        self.mtime = os.path.getmtime(enrich_filepath)
+        
+        _df = _read_dataset('enrichment_df', enrich_filepath, low_memory=False)
+        self.columns = _df.columns.tolist()
+        self.records = _df.to_dict(orient='records')
+        
+        self.label_index = defaultdict(list)
+        self.feature_rows = defaultdict(list)
+        for row_id, (label, feature) in enumerate(zip(_df['Target Label'], _df['Prioritised Features'])):
+            self.label_index[label].append(row_id)
+            if isinstance(feature, str):
+                self.feature_rows[feature].append(row_id)
+        
+        self._lowered_features = {feature: feature.lower() for feature in self.feature_rows}
+        self.token_index = defaultdict(set)
+        for feature, lowered in self._lowered_features.items():
+            for token in self._token_pattern.findall(lowered):
+                self.token_index[token].add(feature)
+        
+        self.selected_variables = list(selected_variables or [])
+        selected = set(self.selected_variables)
+        self.selected_mask = np.array([r['Prioritised Features'] in selected for r in self.records], dtype=bool)
+        
+        del _df
+        logger.info(f'Built enrichment store: {len(self.records)} rows, {len(self.label_index)} labels')
+
+    def is_stale(self):
+        try:
+            return os.path.getmtime(self.filepath) != self.mtime
+        except OSError:
+            return False
+
+    def rows_for_labels(self, labels):
+        """Row ids whose Target Label is one of labels, in file order"""
+        rows = set()
+        for label in labels:
+            rows.update(self.label_index.get(label, ()))
+        return sorted(rows)
+
+    def _features_containing(self, query):
+        """Distinct Prioritised Features values containing query (case-insensitive substring)"""
+        query = query.lower()
+        # Only tokens bounded by non-word characters inside the query are guaranteed
+        # to be whole tokens of a matching value; edge tokens may be partial.
+        interior = [m.group(0) for m in self._token_pattern.finditer(query)
+                    if m.start() > 0 and m.end() < len(query)]
+        if interior:
+            candidates = set.intersection(*(self.token_index.get(t, set()) for t in interior))
+        else:
+            candidates = self._lowered_features.keys()
+        return [f for f in candidates if query in self._lowered_features[f]]
+
+    def rows_for_features(self, features):
+        """Row ids whose Prioritised Features contains any of features, in file order"""
+        rows = set()
+        for query in features:
+            for feature in self._features_containing(query):
+                rows.update(self.feature_rows[feature])
+        return sorted(rows)
+
+    def select(self, rows, selected_only=False):
+        """Return record dicts for row ids, optionally restricted to selected variables"""
+        if selected_only and self.selected_variables:
+            rows = [r for r in rows if self.selected_mask[r]]
+        return [self.records[r] for r in rows]
+
+def get_enrichment_store(enrich_filepath, selected_variables=None):
+    """Lazy loader for the indexed enrichment store; reloads when the CSV changes on disk"""
+    previous = _dataset_cache.get('enrichment_store')
+    get_dataset_version()
+    store = _dataset_cache.get('enrichment_store')
+    
+    if store is not None and store.is_stale():
+        logger.info('Enrichment CSV changed on disk; rebuilding store')
+        _dataset_cache.invalidate('enrichment_store', expected=store)
+        store = None
+    
+    if store is None:
+        # A rebuilt store keeps the selected variables it was first loaded with
+        if selected_variables is None and previous is not None:
+            selected_variables = previous.selected_variables
+        store = _dataset_cache.get_or_load(
+            'enrichment_store', lambda: EnrichmentStore(enrich_filepath, selected_variables)
+        )
+    
+    return store
+
+class ViewerIndex:
+    """
+    Column arrays over the cleaned database for the paginated viewer API.
+    
+    The first CSV row holds each column's category and is kept apart as
+    `categories`. Per column we keep the display values (missing -> "NaN", as
+    in load_viewer_data), lowercased text for contains filters, parsed numbers
+    for range filters, and a sort rank plus precomputed ascending permutation.
+    Columns whose values all parse as numbers sort numerically, the rest sort
+    case-insensitively; missing values sort last in either direction.
+    """
+    _term_pattern = re.compile(r'"([^"]+)"|(\S+)')
+
+    def __init__(self, cleaned_df):
+        self.columns = cleaned_df.columns.tolist()
+        self.categories = {col: (val if isinstance(val, str) else '') for col, val in cleaned_df.iloc[0].items()}
+        body = cleaned_df.iloc[1:].reset_index(drop=True)
+        self.n_rows = len(body)
+        
+        self.display = {}
+        self.lower = {}
+        self.numeric = {}
+        self.missing = {}
+        self.rank = {}
+        self.n_ranks = {}
+        self.perm = {}
+        for col in self.columns:
+            raw = body[col]
+            missing = raw.isna().to_numpy()
+            numbers = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=float)
+            is_numeric = bool((~missing).any()) and not np.isnan(numbers[~missing]).any()
+            
+            self.display[col] = raw.fillna('NaN').astype(str).to_numpy(dtype=object)
+            self.lower[col] = pd.Series(self.display[col]).str.lower()
+            self.numeric[col] = numbers
+            self.missing[col] = missing
+            
+            keys = numbers[~missing] if is_numeric else self.lower[col].to_numpy()[~missing]
+            rank = np.empty(self.n_rows, dtype=np.int64)
+            uniques, inverse = np.unique(keys, return_inverse=True)
+            rank[~missing] = inverse
+            rank[missing] = len(uniques)
+            self.rank[col] = rank
+            self.n_ranks[col] = len(uniques)
+            self.perm[col] = np.argsort(rank, kind='stable')
+        
+        # One lowercased haystack per row for the DataTables-style global search
+        self.haystack = pd.Series(['\x1f'.join(row) for row in zip(*(self.display[c] for c in self.columns))]).str.lower()
+
+    def _sort_key(self, col, descending):
+        rank = self.rank[col]
+        if not descending:
+            return rank
+        # Reverse non-missing ranks but keep missing values last
+        return np.where(self.missing[col], self.n_ranks[col], self.n_ranks[col] - 1 - rank)
+
+    def query(self, sort=(), eq=None, ranges=None, contains=None, search=''):
+        """
+        Filter and sort the rows; returns (ordered row ids, total row count).
+        
+        Args:
+            sort: List of (column, descending) pairs, most significant first
+            eq: Dict column -> display value that must match exactly
+            ranges: Dict column -> (min or None, max or None), inclusive, numeric
+            contains: Dict column -> case-insensitive substring
+            search: Space-separated terms (or "quoted phrases") that must each appear in some column
+        """
+        mask = np.ones(self.n_rows, dtype=bool)
+        for col, value in (eq or {}).items():
+            mask &= self.display[col] == value
+        for col, (low, high) in (ranges or {}).items():
+            numbers = self.numeric[col]
+            with np.errstate(invalid='ignore'):
+                if low is not None:
+                    mask &= numbers >= low
+                if high is not None:
+                    mask &= numbers <= high
+        for col, text in (contains or {}).items():
+            mask &= self.lower[col].str.contains(text.lower(), regex=False).to_numpy()
+        for quoted, word in self._term_pattern.findall(search or ''):
+            mask &= self.haystack.str.contains((quoted or word).lower(), regex=False).to_numpy()
+        
+        if not sort:
+            rows = np.flatnonzero(mask)
+        elif len(sort) == 1:
+            col, descending = sort[0]
+            if descending:
+                rows = np.lexsort((np.arange(self.n_rows), self._sort_key(col, True)))
+            else:
+                rows = self.perm[col]
+            rows = rows[mask[rows]]
+        else:
+            keys = [self._sort_key(col, descending) for col, descending in reversed(sort)]
+            rows = np.lexsort(keys)
+            rows = rows[mask[rows]]
+        return rows, self.n_rows
+
+    def column_values(self, rows, columns=None):
+        """Viewer display values for row ids, as one list per column (optionally projected)"""
+        columns = columns or self.columns
+        return [self.display[col][rows].tolist() for col in columns]
+
+def get_viewer_index(cleaned_database_filepath):
+    """Lazy loader for the viewer query index"""
+    return _cached(
+        'viewer_index', lambda: ViewerIndex(_read_dataset('cleaned_df', cleaned_database_filepath, low_memory=False))
+    )
+
+class SuggestIndex:
+    """
+    Typeahead index over protocol features, target parameters and causal features.
+    
+    Every word-start suffix of every lowercased name is kept in one sorted list,
+    so a query matching the start of any word is a bisect plus a short scan;
+    queries that only match mid-word fall back to a substring scan. Matches rank
+    by where they hit (start of name, start of a word, inside a word), then by
+    prevalence (the "(163)" suffix), then by name.
+    """
+    KINDS = ('feature', 'target', 'causal')
+    _count_pattern = re.compile(r'\s*\((\d+)\)\s*$')
+    _word_start = re.compile(r'(?<![\w])\w')
+
+    def __init__(self, features, feature_categories, target_parameters, causal_categories):
+        category_of = {f: cat for cat, values in feature_categories.items() for f in values}
+        entries = [(f, 'feature', category_of.get(f, '')) for f in features]
+        for kind, lookup in (('target', target_parameters), ('causal', causal_categories)):
+            entries.extend((name, kind, cat) for cat, values in lookup.items() for name in values)
+        
+        self.entries = []
+        for name, kind, category in entries:
+            match = self._count_pattern.search(name)
+            self.entries.append({
+                'text': name,
+                'label': name[:match.start()] if match else name,
+                'kind': kind,
+                'category': category,
+                'count': int(match.group(1)) if match else None
+            })
+        self.lowered = [e['text'].lower() for e in self.entries]
+        
+        suffixes = []
+        for entry_id, lowered in enumerate(self.lowered):
+            for m in self._word_start.finditer(lowered):
+                suffixes.append((lowered[m.start():], entry_id, 0 if m.start() == 0 else 1))
+        suffixes.sort()
+        self._suffixes = [s[0] for s in suffixes]
+        self._suffix_entries = [(s[1], s[2]) for s in suffixes]
+
+    def suggest(self, query, kinds=None, limit=10):
+        """
+        Ranked entries whose name contains query (case-insensitive).
+        
+        Args:
+            query: Text typed so far
+            kinds: Optional subset of KINDS to search
+            limit: Maximum number of suggestions
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+        kinds = set(kinds or self.KINDS)
+        
+        best = {}   # entry id -> match position class (0 name start, 1 word start, 2 inside a word)
+        start = bisect.bisect_left(self._suffixes, query)
+        for i in range(start, len(self._suffixes)):
+            if not self._suffixes[i].startswith(query):
+                break
+            entry_id, where = self._suffix_entries[i]
+            if self.entries[entry_id]['kind'] in kinds and where < best.get(entry_id, 3):
+                best[entry_id] = where
+        
+        if len(best) < limit:
+            for entry_id, lowered in enumerate(self.lowered):
+                if entry_id not in best and query in lowered and self.entries[entry_id]['kind'] in kinds:
+                    best[entry_id] = 2
+        
+        def rank(entry_id):
+            entry = self.entries[entry_id]
+            return (best[entry_id], -(entry['count'] or 0), entry['text'])
+        
+        return [self.entries[i] for i in heapq.nsmallest(limit, best, key=rank)]
+
+def get_suggest_index(binary_filepath, feature_categories, target_parameters, causal_categories):
+    """Lazy loader for the typeahead index (built once per loaded dataset)"""
+    def _load():
+        binary_df = get_binary_df(binary_filepath)
+        exclude_cols = {'Protocol ID', 'Title', 'DOI', 'Matches', 'Protocol Similarity Rank'}
+        features = [col for col in binary_df.columns if col not in exclude_cols and not col.endswith('Feature Found')]
+        return SuggestIndex(features, feature_categories, target_parameters, causal_categories)
+    
+    return _cached('suggest_index', _load)
 
 def get_binary_df(binary_filepath):
     """Lazy loader for binary features dataframe"""
-    global _binary_df
-    
-    if _binary_df is None:
+    def _load():
         logger.info('Loading binary features dataframe')
-        _binary_df = pd.read_csv(binary_filepath, low_memory=False)
+        return _read_dataset('binary_df', binary_filepath, low_memory=False)
+    
+    return _cached('binary_df', _load)
+
+def get_packed_binary_matrix(binary_filepath):
+    """Lazy loader for the bit-packed binary features matrix used by search ranking"""
+    def _load():
+        from dashboard.tools.cmportal.core.cmportal_utils import PackedFeatureMatrix
+        binary_df = get_binary_df(binary_filepath)
+        snapshot = get_snapshot()
+        words = snapshot.stored_array('packed_binary_words', binary_filepath) if snapshot is not None else None
+        if words is not None:
+            feature_index = {col: i for i, col in enumerate(binary_df.columns)}
+            return PackedFeatureMatrix(words, feature_index, binary_df.index)
+        logger.info('Packing binary features matrix')
+        return PackedFeatureMatrix.from_dataframe(binary_df)
     
-    return _binary_df
+    return _cached('packed_binary', _load)
+
+def get_similarity_index(binary_filepath, cleaned_database_filepath):
+    """Lazy loader for the protocol k-NN index over the binary features"""
+    def _load():
+        from dashboard.tools.cmportal.core.cmportal_utils import ProtocolSimilarityIndex
+        packed_binary = get_packed_binary_matrix(binary_filepath)
+        # Binary row i is Protocol ID row i + 1 of the cleaned database (row 0 holds categories)
+        protocol_ids = get_cleaned_df(cleaned_database_filepath)['Protocol ID'].iloc[1:].astype(str).tolist()
+        if len(protocol_ids) != len(packed_binary.index):
+            protocol_ids = [str(row + 1) for row in range(len(packed_binary.index))]
+        return ProtocolSimilarityIndex(packed_binary, protocol_ids)
+    
+    return _cached('similarity_index', _load)
+
+def database_experimental_data(protocol_name, indicator_values, indicators):
+    """
+    Experimental data of a database protocol in the getUserData shape: indicator values
+    as strings, "" when missing, and T-tubule Structure reported as found ('1').
+    """
+    data = {'ProtocolName': protocol_name}
+    for indicator, value in zip(indicators, indicator_values):
+        if not pd.isna(value) and str(value) != "nan":
+            data[indicator] = '1' if indicator == 'T-tubule Structure (Found)' else str(value)
+        else:
+            data[indicator] = ""
+    return data
+
+def get_benchmark_results(binary_filepath, cleaned_database_filepath, odds_filepath):
+    """
+    Lazy loader for the maturity results of every database protocol.
+    
+    Returns:
+        dict: protocol ID (int) -> {indicator: (quantile, flag)}, as process_maturity_indicators
+        returns them, so database comparisons in /api/submit_benchmark are lookups
+    """
+    def _load():
+        from dashboard.tools.cmportal.core.cmportal_utils import MATURITY_INDICATORS, process_maturity_indicators
+        binary_df = get_binary_df(binary_filepath)
+        cleaned_df = get_cleaned_df(cleaned_database_filepath)
+        target_feature_dict = get_target_feature_dict(odds_filepath)
+        candidates = get_candidates()
+        
+        # Binary row i is Protocol ID i + 1 of the cleaned database (row 0 holds categories)
+        indicator_rows = dict(zip(cleaned_df.index, cleaned_df[MATURITY_INDICATORS].to_numpy(dtype=object)))
+        results = {}
+        for row, binary_values in zip(binary_df.index, binary_df[candidates].to_numpy()):
+            protocol_id = row + 1
+            if protocol_id not in indicator_rows:
+                continue
+            features = [col for col, val in zip(candidates, binary_values) if val]
+            data = database_experimental_data(f'Protocol {protocol_id}', indicator_rows[protocol_id], MATURITY_INDICATORS)
+            _, results[protocol_id] = process_maturity_indicators(data, features, target_feature_dict)
+        logger.info(f'Materialized benchmark results for {len(results)} protocols')
+        return results
+    
+    return _cached('benchmark_results', _load)
+
+def get_indicator_distributions(cleaned_database_filepath):
+    """Lazy loader for the sorted database values of every maturity indicator (built once per loaded dataset)"""
+    def _load():
+        from dashboard.tools.cmportal.core.cmportal_utils import MATURITY_INDICATORS, IndicatorDistributions
+        cleaned_df = get_cleaned_df(cleaned_database_filepath)
+        protocols = cleaned_df.iloc[1:]   # Row 0 holds categories
+        columns = []
+        for indicator in MATURITY_INDICATORS:
+            column = protocols[indicator]
+            if indicator == 'T-tubule Structure (Found)':
+                # Any reported value counts as found, as in database_experimental_data
+                columns.append(np.where(column.notna(), 1.0, np.nan))
+            else:
+                columns.append(pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64))
+        values = np.column_stack(columns)
+        values[~np.isfinite(values)] = np.nan
+        logger.info(f'Sorted {int(np.isfinite(values).sum())} database indicator values')
+        return IndicatorDistributions(values, protocols['Protocol ID'].astype(str).tolist(), MATURITY_INDICATORS)
+    
+    return _cached('indicator_distributions', _load)
 
 def get_cleaned_df(cleaned_database_filepath):
     """Lazy loader for cleaned dataframe"""
-    global _cleaned_df
-    
-    if _cleaned_df is None:
+    def _load():
         logger.info('Loading cleaned database dataframe')
-        _cleaned_df = pd.read_csv(cleaned_database_filepath)
+        return _read_dataset('cleaned_df', cleaned_database_filepath)
     
-    return _cleaned_df
+    return _cached('cleaned_df', _load)
 
 def get_categories_dict(feature_categories_filepath):
     """Lazy loader for categories dictionary"""
-    global _categories_dict
-    
-    if _categories_dict is None:
+    def _load():
         logger.info('Loading categories dictionary')
-        categories_df = pd.read_csv(feature_categories_filepath, low_memory=False)
-        _categories_dict = {col: categories_df[col].dropna().tolist() for col in categories_df.columns}
-        del categories_df
-        gc.collect()
+        categories_df = _read_dataset('feature_categories_df', feature_categories_filepath, low_memory=False)
+        return {col: categories_df[col].dropna().tolist() for col in categories_df.columns}
+    
+    return _cached('categories_dict', _load)
+
+def get_odds_enrichments_df(odds_filepath):
+    """Lazy loader for positive odds enrichments dataframe"""
+    def _load():
+        if not odds_filepath:
+            return None
+        return _read_dataset('odds_enrichments_df', odds_filepath, low_memory=False)
     
-    return _categories_dict
+    return _cached('odds_enrichments_df', _load)
 
 def get_target_feature_dict(odds_filepath):
     """Lazy loader for enrichments dictionary"""
-    global _target_feature_dict, _odds_enrichments_df
-    
-    if _target_feature_dict is None:
+    def _load():
         logger.info('Loading enrichments dictionary')
-        
-        if _odds_enrichments_df is None and odds_filepath:
-            _odds_enrichments_df = pd.read_csv(odds_filepath, low_memory=False)
-            
-        if _odds_enrichments_df is not None:
-            _target_feature_dict = {col: _odds_enrichments_df[col].dropna().tolist() for col in _odds_enrichments_df.columns}
+        odds_enrichments_df = get_odds_enrichments_df(odds_filepath)
+        if odds_enrichments_df is None:
+            return None
+        return {col: odds_enrichments_df[col].dropna().tolist() for col in odds_enrichments_df.columns}
     
-    return _target_feature_dict
+    return _cached('target_feature_dict', _load)
     
 def get_causal_categories_dict(causal_feature_categories_filepath):
     """Lazy loader for causal categories dictionary"""
-    global _causal_categories_dict
-    
-    if _causal_categories_dict is None and causal_feature_categories_filepath:
+    def _load():
+        if not causal_feature_categories_filepath:
+            return None
         logger.info('Loading causal categories dictionary')
-        causal_categories_df = pd.read_csv(causal_feature_categories_filepath, low_memory=False)
-        _causal_categories_dict = {col: causal_categories_df[col].dropna().tolist() for col in causal_categories_df.columns}
-        del causal_categories_df
-        gc.collect()
+        causal_categories_df = _read_dataset('causal_feature_categories_df', causal_feature_categories_filepath, low_memory=False)
+        return {col: causal_categories_df[col].dropna().tolist() for col in causal_categories_df.columns}
     
-    return _causal_categories_dict
-# Free up memory when not in use
-def clear_memory_cache():
-    """Clear memory cache of large dataframes when not in use"""
-    global _binary_df, _cleaned_df, _odds_enrichments_df, _categories_dict, _target_feature_dict
-    global viewer_data, viewer_columns, enrichment_data, enrichment_columns
+    return _cached('causal_categories_dict', _load)
+
+def _load_all_datasets(dataset_paths):
+    get_snapshot()
+    get_binary_df(dataset_paths['binary_filepath'])
+    get_packed_binary_matrix(dataset_paths['binary_filepath'])
+    get_cleaned_df(dataset_paths['cleaned_database_filepath'])
+    load_viewer_data(dataset_paths['cleaned_database_filepath'])
+    get_viewer_index(dataset_paths['cleaned_database_filepath'])
+    get_categories_dict(dataset_paths['feature_categories_filepath'])
+    get_causal_categories_dict(dataset_paths['causal_feature_categories_filepath'])
+    get_target_feature_dict(dataset_paths['odds_filepath'])
+    get_enrichment_store(dataset_paths['enrich_filepath'])
+    get_benchmark_results(dataset_paths['binary_filepath'], dataset_paths['cleaned_database_filepath'],
+                          dataset_paths['odds_filepath'])
+    get_indicator_distributions(dataset_paths['cleaned_database_filepath'])
+
+def preload_datasets(dataset_paths):
+    """
+    Load every dataset up front, when the worker imports the app, instead of on
+    first use. Only the zero-copy snapshot arrays (the binary feature matrix and the
+    stored derived arrays) are shared with other workers, through the page cache.
+    Everything else (cleaned_df, the viewer records, the enrichment store, string
+    columns decoded from the snapshot) is a private copy in each worker. There is
+    no fork after loading, so gc.freeze() only keeps collections from walking
+    these objects.
     
-    if _binary_df is not None:
-        del _binary_df
-        _binary_df = None
-        
-    if _cleaned_df is not None:
-        del _cleaned_df
-        _cleaned_df = None
-        
-    if _odds_enrichments_df is not None:
-        del _odds_enrichments_df
-        _odds_enrichments_df = None
-        
-    if _categories_dict is not None:
-        del _categories_dict
-        _categories_dict = None
-        
-    if _target_feature_dict is not None:
-        del _target_feature_dict
-        _target_feature_dict = None
-        
-    if viewer_data is not None:
-        viewer_data = None
-        viewer_columns = None
-        
-    if enrichment_data is not None:
-        enrichment_data = None
-        enrichment_columns = None
-        
-    # Clear any benchmark-specific caches from utils.py
-    try:
-        from utils import _protocol_features_cache
-        _protocol_features_cache.clear()
-    except ImportError:
-        pass
-        
+    Not meant for gunicorn --preload: the app would be imported in the master,
+    before the gevent worker monkey-patches, so the module-level locks would be
+    real OS locks and the threads started at registration (upload cleanup,
+    prefetch) would run in the master rather than in the worker.
+    """
+    _load_all_datasets(dataset_paths)
     gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    logger.info(f'Preloaded datasets: {get_memory_report()}')
+
+def start_background_prefetch(dataset_paths):
+    """Warm every dataset in a daemon thread at worker start; requests that arrive
+    meanwhile wait on the same single-flight loads instead of parsing again"""
+    def _prefetch():
+        try:
+            _load_all_datasets(dataset_paths)
+            logger.info(f'Prefetched datasets: {_dataset_cache.load_seconds}')
+        except Exception as e:
+            logger.error(f'Error prefetching datasets: {e}')
+    
+    thread = threading.Thread(target=_prefetch, name='cmportal-prefetch', daemon=True)
+    thread.start()
+    return thread
+
+def get_memory_report():
+    """Process RSS split into private/file-backed/shared parts, plus per-dataset private bytes"""
+    report = {'pid': os.getpid()}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'RssAnon', 'RssFile', 'RssShmem'):
+                    report[key] = int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+        report['MaxRSS'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    
+    snapshot = get_snapshot()
+    report['snapshot_mapped_bytes'] = snapshot.mapped_bytes if snapshot is not None else 0
+    report['dataset_private_bytes'] = _dataset_cache.total_size
+    return report
+
+# Free up memory on demand (admin call or memory pressure), never per request
+def clear_memory_cache(include_pinned=False):
+    """Evict cached datasets and search results; pinned hot datasets are kept unless include_pinned is set"""
+    _dataset_cache.clear(include_pinned=include_pinned)
+    _search_cache.clear()
     logger.info('Memory cache cleared')
 
-def get_search_table(FeaturesOfInterest, binary_filepath, cleaned_database_filepath, 
-                    odds_filepath, feature_categories_filepath, LabelOfInterest=None, 
-                    CategoriesOfInterest=[True,False,False,False,False], SearchMode=None):
+# ----- Search result cache -----
+class SearchResultCache:
     """
-    Get a search result table with protocols matching the specified features and criteria.
-    Now handles three explicitly defined modes:
-    - normal: Find protocols with ALL selected features
-    - enrichment: Find protocols based on target topic key characteristics
-    - combined: Find protocols by target topic and filter by specific features
+    LRU cache of serialized search results and rankings, bounded by total bytes.
     
-    Args:
-        FeaturesOfInterest: List of features to search for
-        LabelOfInterest: Target topic to search for (optional)
-        CategoriesOfInterest: List of booleans indicating which categories to filter by
-        SearchMode: Explicit mode to use ('normal', 'enrichment', or 'combined')
+    Keys are canonical queries (see make_key) that include the dataset version;
+    the whole cache is dropped as soon as a different version is seen, so cached
+    results never outlive the data they were computed from.
     """
-    Categories = ['Protocol Variable', 'Analysis Method', 'Cell Profile', 'Study Characteristic', 'Measured Endpoint']
-    
-    # Load required dataframes if not already in memory
-    binary_df = get_binary_df(binary_filepath)
-    cleaned_df = get_cleaned_df(cleaned_database_filepath)
+    SEARCH_CATEGORIES = 5   # length of the toggle_states list get_search_table reads
+
+    def __init__(self, memory_budget):
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()   # key -> (value, size)
+        self._size = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(self, features, label, toggle_states, mode, variant=''):
+        """
+        Canonical key for a search: inputs a mode ignores are dropped, features are
+        an order-free set and the category toggles a bitmask.
+        
+        Args:
+            features: Selected protocol features
+            label: Target topic
+            toggle_states: Category toggles (booleans)
+            mode: 'normal', 'enrichment' or 'combined'
+            variant: Anything else the cached value depends on (e.g. response format)
+        """
+        version = get_dataset_version()
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    logger.info('Dataset version changed; dropping cached search results')
+                self._entries.clear()
+                self._size = 0
+                self._version = version
+        
+        features = () if mode == 'enrichment' else tuple(sorted(set(features)))
+        label = '' if mode == 'normal' else label
+        toggles = 0
+        if mode != 'normal':
+            for i, state in enumerate(toggle_states[:self.SEARCH_CATEGORIES]):
+                toggles |= bool(state) << i
+        return (version, mode, features, label, toggles, variant)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        """Store a value (serialized bytes or a SearchRanking) for key; values larger than the whole budget are not cached"""
+        size = (len(value) if isinstance(value, bytes) else estimate_size(value)) + estimate_size(key)
+        if size > self.memory_budget:
+            return value
+        with self._lock:
+            if key[0] != self._version:
+                return value
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.memory_budget:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'memory_budget': self.memory_budget,
+                'total_size': self._size,
+                'entries': len(self._entries)
+            }
+
+
+_search_cache = SearchResultCache(SEARCH_CACHE_MEMORY_BUDGET)
+
+def get_search_cache():
+    """Return the process-wide search result cache"""
+    return _search_cache
+
+def _resolve_search(FeaturesOfInterest, target_feature_dict, LabelOfInterest, CategoriesOfInterest, SearchMode):
+    """
+    Turn search inputs into ranking arguments.
     
-    # Use parameter to load target_feature_dict
-    target_feature_dict = get_target_feature_dict(odds_filepath)
-    categories_dict = get_categories_dict(feature_categories_filepath)
+    Returns:
+        tuple: (mode, selected_features, filter_features, filter_categories, wanted_cols),
+        or None when the search cannot produce results
+    """
+    Categories = ['Protocol Variable', 'Analysis Method', 'Cell Profile', 'Study Characteristic', 'Measured Endpoint']
     
     # Determine mode based on inputs if not explicitly provided
     if not SearchMode:
@@ -247,7 +1060,7 @@ def get_search_table(FeaturesOfInterest, binary_filepath, cleaned_database_filep
             mode = 'combined'
         else:
             # Failsafe if somehow nothing was provided
-            return pd.DataFrame()
+            return None
     else:
         mode = SearchMode
     
@@ -261,12 +1074,12 @@ def get_search_table(FeaturesOfInterest, binary_filepath, cleaned_database_filep
     elif mode == 'enrichment':
         # Pure enrichment: just search for protocols with enrichment for target
         if LabelOfInterest not in target_feature_dict:
-            print(f"DEBUG: Label '{LabelOfInterest}' not found in target_feature_dict. Available keys: {list(target_feature_dict.keys())[:5]}...")
-            return pd.DataFrame()  # Return empty DataFrame if label not found
+            logger.debug(f"Label '{LabelOfInterest}' not found in target_feature_dict. Available keys: {list(target_feature_dict.keys())[:5]}...")
+            return None
             
         selected_features = target_feature_dict[LabelOfInterest]
-        # Debug print to check what features were found for this label
-        print(f"DEBUG: Found {len(selected_features)} features for '{LabelOfInterest}'")
+        # Log how many features were found for this label
+        logger.debug(f"Found {len(selected_features)} features for '{LabelOfInterest}'")
         
         filter_features = []  # No feature filtering
         filter_categories = [cat for cat, boo in zip(Categories, CategoriesOfInterest) if boo]
@@ -275,7 +1088,7 @@ def get_search_table(FeaturesOfInterest, binary_filepath, cleaned_database_filep
     elif mode == 'combined':
         # Combined mode: find protocols enriched for target topic and filter by features
         if LabelOfInterest not in target_feature_dict:
-            return pd.DataFrame()  # Return empty DataFrame if label not found
+            return None
             
         selected_features = target_feature_dict[LabelOfInterest]
         filter_features = FeaturesOfInterest
@@ -284,21 +1097,12 @@ def get_search_table(FeaturesOfInterest, binary_filepath, cleaned_database_filep
     
     else:
         # Invalid mode
-        return pd.DataFrame()
-    
-    # Import the utility function from utils
-    from utils import add_and_sort_by_matches
-    
-    # Rank and filter protocols
-    sorted_index, additional_columns = add_and_sort_by_matches(
-        binary_df,
-        selected_features,
-        categories_dict,
-        filter_features,
-        filter_categories
-    )
+        return None
     
-    # Get info from cleaned_df and create result dataframe
+    return mode, selected_features, filter_features, filter_categories, wanted_cols
+
+def _build_result_table(cleaned_df, mode, wanted_cols, sorted_index, additional_columns):
+    """Join ranked protocol rows from cleaned_df with the ranking columns"""
     result_df = cleaned_df[wanted_cols].iloc[1:].reset_index(drop=True).loc[sorted_index].copy()
     
     # Handle additional columns correctly to preserve column names
@@ -319,10 +1123,163 @@ def get_search_table(FeaturesOfInterest, binary_filepath, cleaned_database_filep
     
     return result_df
 
+def get_search_table(FeaturesOfInterest, binary_filepath, cleaned_database_filepath, 
+                    odds_filepath, feature_categories_filepath, LabelOfInterest=None, 
+                    CategoriesOfInterest=[True,False,False,False,False], SearchMode=None):
+    """
+    Get a search result table with protocols matching the specified features and criteria.
+    Now handles three explicitly defined modes:
+    - normal: Find protocols with ALL selected features
+    - enrichment: Find protocols based on target topic key characteristics
+    - combined: Find protocols by target topic and filter by specific features
+    
+    Args:
+        FeaturesOfInterest: List of features to search for
+        LabelOfInterest: Target topic to search for (optional)
+        CategoriesOfInterest: List of booleans indicating which categories to filter by
+        SearchMode: Explicit mode to use ('normal', 'enrichment', or 'combined')
+    """
+    # Load required dataframes if not already in memory
+    packed_binary = get_packed_binary_matrix(binary_filepath)
+    cleaned_df = get_cleaned_df(cleaned_database_filepath)
+    
+    # Use parameter to load target_feature_dict
+    target_feature_dict = get_target_feature_dict(odds_filepath)
+    categories_dict = get_categories_dict(feature_categories_filepath)
+    
+    resolved = _resolve_search(FeaturesOfInterest, target_feature_dict, LabelOfInterest, CategoriesOfInterest, SearchMode)
+    if resolved is None:
+        return pd.DataFrame()
+    mode, selected_features, filter_features, filter_categories, wanted_cols = resolved
+    
+    # Import the packed ranking function from cmportal_utils
+    from dashboard.tools.cmportal.core.cmportal_utils import add_and_sort_by_matches
+    
+    # Rank and filter protocols
+    sorted_index, additional_columns = add_and_sort_by_matches(
+        packed_binary,
+        selected_features,
+        categories_dict,
+        filter_features,
+        filter_categories
+    )
+    
+    return _build_result_table(cleaned_df, mode, wanted_cols, sorted_index, additional_columns)
+
+def get_search_ranking(FeaturesOfInterest, binary_filepath, odds_filepath, feature_categories_filepath,
+                       LabelOfInterest=None, CategoriesOfInterest=[True,False,False,False,False], SearchMode=None):
+    """
+    Score a search without sorting it, for top-k and paginated results.
+    Same inputs and modes as get_search_table.
+    
+    Returns:
+        SearchRanking with mode and wanted_cols attached, or None when the search has no results
+    """
+    packed_binary = get_packed_binary_matrix(binary_filepath)
+    target_feature_dict = get_target_feature_dict(odds_filepath)
+    categories_dict = get_categories_dict(feature_categories_filepath)
+    
+    resolved = _resolve_search(FeaturesOfInterest, target_feature_dict, LabelOfInterest, CategoriesOfInterest, SearchMode)
+    if resolved is None:
+        return None
+    mode, selected_features, filter_features, filter_categories, wanted_cols = resolved
+    
+    from dashboard.tools.cmportal.core.cmportal_utils import rank_by_matches
+    ranking = rank_by_matches(packed_binary, selected_features, categories_dict, filter_features, filter_categories)
+    ranking.mode = mode
+    ranking.wanted_cols = wanted_cols
+    return ranking
+
+SEARCH_MODES = ('normal', 'enrichment', 'combined')
+
+def validate_search_query(query):
+    """
+    Check the field types of one batch_search query; missing fields are allowed.
+    
+    Raises:
+        ValueError: describing the first invalid field
+    """
+    if not isinstance(query, dict):
+        raise ValueError('query must be an object')
+    features = query.get('features')
+    if features is not None and not (isinstance(features, list) and all(isinstance(f, str) for f in features)):
+        raise ValueError('features must be a list of strings')
+    toggle_states = query.get('toggle_states')
+    if toggle_states is not None and not (isinstance(toggle_states, list) and all(isinstance(t, bool) for t in toggle_states)):
+        raise ValueError('toggle_states must be a list of booleans')
+    parameter = query.get('parameter')
+    if parameter is not None and not isinstance(parameter, str):
+        raise ValueError('parameter must be a string')
+    mode = query.get('mode')
+    if mode is not None and mode != '' and mode not in SEARCH_MODES:
+        raise ValueError(f'mode must be one of {", ".join(SEARCH_MODES)}')
+
+def batch_search(queries, binary_filepath, cleaned_database_filepath, odds_filepath, feature_categories_filepath):
+    """
+    Run many searches in one vectorized pass (see batch_sort_by_matches).
+    
+    Args:
+        queries: List of dicts with 'features', 'parameter', 'toggle_states' and
+            optionally 'mode', interpreted as by get_search_table
+    
+    Returns:
+        list: One result table per query, identical to get_search_table's
+        (an empty DataFrame when the query has no results)
+    
+    Raises:
+        ValueError: for a query that fails validate_search_query
+    """
+    for i, query in enumerate(queries):
+        try:
+            validate_search_query(query)
+        except ValueError as e:
+            raise ValueError(f'Query {i}: {e}')
+    
+    packed_binary = get_packed_binary_matrix(binary_filepath)
+    cleaned_df = get_cleaned_df(cleaned_database_filepath)
+    target_feature_dict = get_target_feature_dict(odds_filepath)
+    categories_dict = get_categories_dict(feature_categories_filepath)
+    
+    resolved = [
+        _resolve_search(q.get('features') or [], target_feature_dict, q.get('parameter') or '',
+                        q.get('toggle_states') or [], q.get('mode') or None)
+        for q in queries
+    ]
+    valid = [r for r in resolved if r is not None]
+    
+    from dashboard.tools.cmportal.core.cmportal_utils import batch_sort_by_matches
+    ranked = iter(batch_sort_by_matches(
+        packed_binary, [(r[1], r[2], r[3]) for r in valid], categories_dict
+    ))
+    
+    tables = []
+    for r in resolved:
+        if r is None:
+            tables.append(pd.DataFrame())
+            continue
+        sorted_index, additional_columns = next(ranked)
+        tables.append(_build_result_table(cleaned_df, r[0], r[4], sorted_index, additional_columns))
+    return tables
+
+def get_search_page(ranking, cleaned_database_filepath, offset, limit):
+    """Result table (same columns as get_search_table) for ranked positions offset..offset+limit"""
+    cleaned_df = get_cleaned_df(cleaned_database_filepath)
+    sorted_index, additional_columns = ranking.page(offset, limit)
+    return _build_result_table(cleaned_df, ranking.mode, ranking.wanted_cols, sorted_index, additional_columns)
+
 def get_candidates():
     return ["hiPSC Matrix Coating - Matrigel (163)", "hiPSC Matrix Coating - Geltrex (33)", "hiPSC Matrix Coating - EBs (18)", "hiPSC Matrix Coating - Vitronectin (10)", "hiPSC Matrix Coating - MEF feeder cells (8)", "hiPSC Backbone Media - Embryonic Stem Cell (127)", "hiPSC Backbone Media - mTeSR (106)", "hiPSC Backbone Media - Essential 8 (82)", "hiPSC Backbone Media - Conditioned (12)", "hiPSC Backbone Media - DMEM/F12 (10)", "hiPSC Backbone Media - StemFit (5)", "hiPSC Backbone Media - StemFlex (5)", "hiPSC-CM Backbone Media - RPMI-1640 (167)", "hiPSC-CM Backbone Media - iCell Maintenance (86)", "hiPSC-CM Backbone Media - DMEM (18)", "hiPSC-CM Backbone Media - StemPro-34 (14)", "hiPSC-CM Backbone Media - Commercial CM Kit (12)", "hiPSC-CM Backbone Media - Cor.4U Complete (6)", "hiPSC-CM Media Supplement - B27 (180)", "hiPSC-CM Media Supplement - Ascorbic Acid (41)", "hiPSC-CM Media Supplement - iCell Maintenance Medium (41)", "hiPSC-CM Media Supplement - Albumin (28)", "hiPSC-CM Media Supplement - L-glutamine (19)", "hiPSC-CM Media Supplement - HEPES (16)", "hiPSC-CM Media Supplement - FBS (16)", "hiPSC-CM Media Supplement - 1-thioglycerol (14)", "hiPSC-CM Media Supplement - Transferrin (11)", "hiPSC-CM Media Supplement - Mercaptoethanol (10)", "hiPSC-CM Media Supplement - Lipids (9)", "hiPSC-CM Media Supplement - GlutaMax (8)", "hiPSC-CM Media Supplement - Nonessential Amino Acids (8)", "hiPSC-CM Media Supplement - Selenium (7)", "hiPSC-CM Media Supplement - Polyvinylalchohol (6)", "hiPSC-CM Media Supplement - Lipid Mix (5)", "hiPSC-CM Media Supplement - VEGF (4)", "hiPSC-CM Media Supplement - bFGF (3)", "Wnt Induction - CHIR99021 (184)", "Wnt Induction - Activin A (80)", "Wnt Induction - BMP4 (74)", "Wnt Induction - bFGF (45)", "Wnt Induction - StemCell Diff Kit (4)", "Wnt Induction - Wnt3a (3)", "Seeding Confluency (%) - 85 to 89 (43)", "Seeding Confluency (%) - 90 to 94 (26)", "Seeding Confluency (%) - 95 to 100 (23)", "Seeding Confluency (%) - 80 to 84 (12)", "Seeding Confluency (%) - 70 to 79 (11)", "Seeding Confluency 2D (%) - 70 to 79 (6)", "Seeding Confluency 3D (%) - 70 to 79 (3)", "Seeding Confluency 2D (%) - 80 to 84 (5)", "Seeding Confluency 3D (%) - 80 to 84 (5)", "Seeding Confluency 2D (%) - 85 to 89 (26)", "Seeding Confluency 3D (%) - 85 to 89 (12)", "Seeding Confluency 2D (%) - 90 to 94 (12)", "Seeding Confluency 3D (%) - 90 to 94 (13)", "Seeding Confluency 2D (%) - 95 to 100 (6)", "Seeding Confluency 3D (%) - 95 to 100 (13)", "Wnt Induction Duration (days) - 3 days (38)", "Wnt Induction Duration (days) - 4 days (15)", "Wnt Induction Duration (days) - 5 days (8)", "Wnt Induction Duration (days) Quantiles - Q3 (>1 and ≤1) (186)", "Wnt Induction Duration (days) Quantiles - Q2 (>1 and ≤2) (75)", "Wnt Induction Duration (days) Quantiles - Q1 (>2 and ≤5) (61)", "Wnt Inhibitor - IWP (112)", "Wnt Inhibitor - IWR (56)", "Wnt Inhibitor - Wnt-C59 (30)", "Wnt Inhibitor - XAV939 (24)", "Wnt Inhibitor - DS-I-7 (9)", "Wnt Inhibitor - bFGF (8)", "Wnt Inhibitor - KY02111 (7)", "Wnt Inhibitor - BMP4 (7)", "Wnt Inhibitor - VEGF (3)", "Wnt Inhibitor Duration (days) - 4 days (19)", "Wnt Inhibitor Duration (days) - 3 days (17)", "Wnt Inhibitor Duration (days) - >6 days (12)", "Wnt Inhibitor Duration (days) - 5 days (6)", "Wnt Inhibitor Duration (days) - 6 days (4)", "Wnt Inhibitor Duration (days) Quantiles - Q2 (>1 and ≤2) (156)", "Wnt Inhibitor Duration (days) Quantiles - Q3 (>1 and ≤1) (108)", "Wnt Inhibitor Duration (days) Quantiles - Q1 (>2 and ≤9) (58)", "Insulin Start Day - 7 (85)", "Insulin Start Day - 6 (20)", "Insulin Start Day - 1 (19)", "Insulin Start Day - 8 (15)", "Insulin Start Day - 5 (14)", "Insulin Start Day - 4 (11)", "Insulin Start Day - 9 (10)", "Insulin Start Day - 0 (7)", "Insulin Start Day - After 11 (7)", "Insulin Start Day - 10 (6)", "Insulin Start Day - 3 (5)", "Insulin Start Day - 2 (4)", "Insulin Start Day - 11 (3)", "Insulin Withdrawal Duration (days) Quantiles - Q2 (>2 and ≤4) (25)", "Insulin Withdrawal Duration (days) Quantiles - Q1 (>4 and ≤10) (11)", "Insulin Withdrawal Duration (days) - 4 days (18)", "Insulin Withdrawal Duration (days) - 3 days (6)", "Insulin Withdrawal Duration (days) - 6 days (3)", "Insulin Withdrawal Duration (days) - 8 days (3)", "Purification Protocol - Glucose and Lactate (85)", "Purification Protocol - Metabolic (8)", "Purification Protocol - Cell Sorting (7)", "Purification Protocol - Antibiotic (4)", "hiPSC-CM Purification Duration (days) - <3 days (31)", "hiPSC-CM Purification Duration (days) - 4 days (29)", "hiPSC-CM Purification Duration (days) - 3 days (13)", "hiPSC-CM Purification Duration (days) - 6 days (10)", "hiPSC-CM Purification Duration (days) - 5 days (6)", "hiPSC-CM Purification Duration (days) - 7 days (6)", "hiPSC-CM Purification Duration (days) - >9 days (5)", "hiPSC-CM Purification Duration (days) - 8 days (4)", "hiPSC-CM Purification Duration (days) Quantiles - Q2 (>1 and ≤4) (61)", "hiPSC-CM Purification Duration (days) Quantiles - Q1 (>4 and ≤20) (31)", "Differentiation Purity (%) Quantiles - Q4 (>79 and ≤85) (40)", "Differentiation Purity (%) Quantiles - Q3 (>85 and ≤90) (34)", "Differentiation Purity (%) Quantiles - Q5 (>30 and ≤79) (32)", "Differentiation Purity (%) Quantiles - Q2 (>90 and ≤95) (27)", "Differentiation Purity (%) Quantiles - Q1 (>95 and ≤99) (22)", "New Media for Maturation - RPMI-1640 (30)", "New Media for Maturation - DMEM (21)", "New Media for Maturation - F12 (7)", "New Media for Maturation - Commercial Kit (5)", "hiPSC-CM Maturation Media - RPMI-1640 (153)", "hiPSC-CM Maturation Media - iCell Maintenance (83)", "hiPSC-CM Maturation Media - DMEM (35)", "hiPSC-CM Maturation Media - Commercial Kit (27)", "hiPSC-CM Maturation Media - StemPro-34 (14)", "hiPSC-CM Maturation Media - F12 (10)", "hiPSC-CM Maturation Media - Cor.4U Complete (6)", "Coating for Replating - Matrigel (65)", "Coating for Replating - Gelatin (43)", "Coating for Replating - Fibronectin (32)", "Coating for Replating - Geltrex (10)", "Coating for Replating - Laminin (5)", "Coating for Replating - Synthemax (3)", "Coating for Replating - Vitronectin (3)", "Maturation Strategy - Metabolic (33)", "Maturation Strategy - Electrical (39)", "Maturation Strategy - Tension (64)", "Maturation Strategy - Other Cells (80)", "Maturation Strategy - Mechanical (36)", "Maturation Strategy - Cell Alignment (59)", "Maturation Strategy - Elastomeric (33)", "Maturation Strategy - ECM (21)", "Metabolic Component - T3 (14)", "Metabolic Component - Fatty Acid (13)", "Metabolic Component - Palmitic Acid (11)", "Metabolic Component - Creatine (7)", "Metabolic Component - Taurine (7)", "Metabolic Component - Dexamethasone (7)", "Metabolic Component - L-carnitine (6)", "Metabolic Component - Nonessential Amino Acids (6)", "Metabolic Component - Galactose (4)", "Metabolic Component - Lactate (4)", "Metabolic Component - Insulin-Transferrin-Selenium (3)", "Metabolic Component - Vitamin B12 (3)", "Metabolic Component - Biotin (3)", "Metabolic Component - Ascorbic Acid (3)", "Metabolic Component - Albumax (3)", "Metabolic Component - B27 (3)", "Metabolic Component - KOSR (3)", "Metabolic Component - IGF-1 (3)", "Metabolic Component Category - Fatty Acids and Lipids (21)", "Metabolic Component Category - Metabolic Modulation (20)", "Metabolic Component Category - Hormonal Stimulation (14)", "Metabolic Component Category - Sugars and Carbohydrates (9)", "Metabolic Component Category - Amino Acids and Derivatives (9)", "Metabolic Component Category - Signaling Pathway Regulators (6)", "Metabolic Component Category - Kinase Inhibitors (3)", "2D Surface - ECM-coated (115)", "2D Surface - Micropatterned (27)", "2D Surface - Hydrogel (17)", "2D Surface - Electrospun (13)", "2D Surface - Microelectrode Array (9)", "2D Surface - Nanotopography (6)", "2D Surface - Decellularized ECM (3)", "2D Surface - Microparticle/fluid (3)", "3D Platform - Fibrin (50)", "3D Platform - Scaffold Free (43)", "3D Platform - Collagen (38)", "3D Platform - Matrigel (33)", "3D Platform - Extracellular Scaffold (18)", "3D Platform - 3D printed (9)", "3D Platform - Polyethylene Glycol (8)", "3D Platform - Gelatin (6)", "3D Platform - Fibronectin (3)", "3D Platform - Nanotechnology (3)", "3D Tissue Media - RPMI-1640 (72)", "3D Tissue Media - MEM-α (60)", "3D Tissue Media - DMEM (53)", "3D Tissue Media - Commercial Kit (21)", "3D Tissue Media - Growth Factor (12)", "3D Tissue Media - iCell Maintenance (12)", "3D Tissue Media - High-glucose DMEM (9)", "3D Tissue Media - Iscove (5)", "Cell Line - iCell (47)", "Cell Line - WTC11 (30)", "Cell Line - IMR90 (19)", "Cell Line - Cor.4U (16)", "Cell Line - DF19-9-11T.H (16)", "Cell Line - PGP1 (11)", "Cell Line - 253G1 (10)", "Cell Line - Gibco episomal (10)", "Cell Line - 201B7 (9)", "Cell Line - iCell2 (8)", "Cell Line - SCVI-273 (8)", "Cell Line - BJ1 (7)", "Cell Line - C25 (6)", "Cell Line - ATCC (5)", "Cell Line - Cellapy (4)", "Cell Line - BJ RiPS (4)", "Cell Line - 201B6 (3)", "Number of Cell Lines - 1 (225)", "Number of Cell Lines - 2 (50)", "Number of Cell Lines - 3 (29)", "Number of Cell Lines - 4 (11)", "Number of Cell Lines - >5 (9)", "Cell Line Sex - Both (118)", "Cell Line Sex - Male (64)", "Cell Line Sex - Female (40)", "Cell Line Ancestry - Caucasian (41)", "Cell Line Ancestry - Asian (28)", "Cell Coculture - Cardiomyocyte (157)", "Cell Coculture - Stromal Cell (78)", "Cell Coculture - Endothelial Cell (35)", "3D CM Ratio (CM-EC-SC) Quantiles - Q1 (>91 and ≤100) (74)", "3D CM Ratio (CM-EC-SC) Quantiles - Q3 (>9 and ≤75) (48)", "3D CM Ratio (CM-EC-SC) Quantiles - Q2 (>75 and ≤91) (28)", "3D EC Ratio (CM-EC-SC) Quantiles - Q2 (>0 and ≤0) (119)", "3D EC Ratio (CM-EC-SC) Quantiles - Q1 (>0 and ≤91) (31)", "3D SC Ratio (CM-EC-SC) Quantiles - Q3 (>0 and ≤0) (74)", "3D SC Ratio (CM-EC-SC) Quantiles - Q1 (>10 and ≤50) (47)", "3D SC Ratio (CM-EC-SC) Quantiles - Q2 (>0 and ≤10) (29)", "3D Stromal Cell Source - Human Fibroblast (38)", "3D Stromal Cell Source - Stromal Cell (35)", "3D Stromal Cell Source - Cardiac Fibroblast (32)", "3D Stromal Cell Source - Mesenchymal Stem Cell (12)", "3D Stromal Cell Source - hiPSC-CardiacF (8)", "3D Stromal Cell Source - Dermal Fibroblast (7)", "3D Stromal Cell Source - hiPSC-MuralC (3)", "3D Stromal Cell Source - hiPSC-SmoothMC (3)", "3D Endothelial Cell Source - hiPSC-EndothelialC (16)", "3D Endothelial Cell Source - Umbilical Vein EndothelialC (10)", "3D Endothelial Cell Source - Cardiac Microvascular EndothelialC (5)", "Differentiation Purity Assessment - Flow Cytometry cTnT+ (135)", "Differentiation Purity Assessment - Flow Cytometry a-actinin+ (9)", "Differentiation Purity Assessment - IHC a-actinin (8)", "Differentiation Purity Assessment - IHC cTnT (7)", "Differentiation Purity Assessment - Visual Inspection (6)", "Differentiation Purity Assessment - Flow Cytometry SIRPA+ (4)", "Differentiation Purity Assessment - Flow Cytometry VCAM1+ (4)", "Differentiation Purity Assessment - Flow Cytometry cTnI+ (3)", "Immunofluorescent Imaging - Yes (268)", "Electron Imaging - Transmission (62)", "Electron Imaging - Scanning (22)", "Sacromere or Cellular Alignment Analysis - Yes (72)", "Contractile Analysis Method - Motion Tracking (93)", "Contractile Analysis Method - Deflection (39)", "Contractile Analysis Method - Force Transducer (27)", "Contractile Analysis Method - Traction Force Microscopy (9)", "Calcium Handling Analysis Method - Visual (104)", "Calcium Handling Analysis Method - Genetic (23)", "Electrophysiology Analysis Method - Patch Clamp (59)", "Electrophysiology Analysis Method - Optical Mapping (39)", "Electrophysiology Analysis Method - Microelectrode (31)", "Electrophysiology Analysis Method - Motion-Contrast Reconstruction (5)", "Electrophysiology Analysis Method - Genetic (3)", "Metabolic Analysis Method - Seahorse (35)", "Metabolic Analysis Method - Flux Rates (13)", "Metabolic Analysis Method - Mitochondrial (4)", "Metabolic Analysis Method - Genetic (3)", "Fatty Acid Metabolism Assessed - Yes (20)", "Gene Analysis Method - RNA (169)"]
 
 def load_selected_variables(filepath):
+    """Load selected variables list, from the snapshot when it is current"""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        selected = snapshot.string_list('selected_variables', filepath)
+        if selected is not None:
+            return selected
+    return _read_selected_variables(filepath)
+
+def _read_selected_variables(filepath):
     """Load selected variables list from CSV (single column, no header assumed)"""
     try:
         df = pd.read_csv(filepath, header=None)  # Single column, no header
@@ -0,0 +1,422 @@
+"""
+CMPortal Extraction
+Runs PDF form extraction (getUserProtocolFeatures, getUserData) in isolated worker
+processes. Uploaded files are parsed concurrently, and a malformed or huge PDF is
+killed at its timeout or memory limit instead of stalling the request worker.
+Results are cached by file content, so re-uploaded forms are not parsed again.
+Uploads are kept in memory while the request is parsed, and non-PDF parts are
+rejected as soon as their first bytes arrive.
+"""
+
+import io
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from flask import Request
+from werkzeug.exceptions import BadRequest
+
+from dashboard.tools.cmportal.core.cmportal_config import (
+    PDF_WORKERS, PDF_TIMEOUT_SECONDS, PDF_MEMORY_LIMIT, PDF_CACHE_PATH, PDF_CACHE_MEMORY_BUDGET,
+    PDF_CACHE_DISK_BUDGET, PDF_CACHE_TTL_SECONDS, UPLOAD_FOLDER, UPLOAD_SPOOL_SIZE, PDF_UPLOAD_ENDPOINTS
+)
+from dashboard.tools.cmportal.core.cmportal_snapshot import file_sha256
+from dashboard.tools.cmportal.core.cmportal_utils import getUserProtocolFeatures, getUserData
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Part content types browsers send for PDF files ('' when the part has none)
+PDF_CONTENT_TYPES = {'application/pdf', 'application/x-pdf', 'application/acrobat', 'application/octet-stream', ''}
+
+# Readers accept a %PDF- header anywhere in the first KiB of the file
+PDF_HEADER = b'%PDF-'
+PDF_HEADER_WINDOW = 1024
+
+
+class PdfExtractionError(Exception):
+    """A PDF could not be parsed within its time or memory limit"""
+
+
+class UploadRejected(BadRequest):
+    """An uploaded file is not a PDF; raised while the request body is being parsed"""
+
+
+class PdfUploadSpool:
+    """
+    Destination for one uploaded PDF part while the multipart body is parsed.
+
+    Bytes stay in memory and move to a named file in UPLOAD_FOLDER only once the
+    part grows past spool_size (the file is deleted on close, at the end of the
+    request). The header is checked as the first bytes arrive, so a non-PDF part
+    is rejected before the rest of the request body is read.
+    """
+    def __init__(self, filename, spool_size=UPLOAD_SPOOL_SIZE):
+        self.filename = filename
+        self.spool_size = spool_size
+        self.path = None
+        self.size = 0
+        self._head = b''
+        self._file = io.BytesIO()
+
+    def write(self, data):
+        if len(self._head) < PDF_HEADER_WINDOW and PDF_HEADER not in self._head:
+            self._head += bytes(data[:PDF_HEADER_WINDOW - len(self._head)])
+            if len(self._head) >= PDF_HEADER_WINDOW and PDF_HEADER not in self._head:
+                raise UploadRejected(f'{self.filename} is not a PDF file')
+        if self.path is None and self.size + len(data) > self.spool_size:
+            spilled = tempfile.NamedTemporaryFile(prefix='upload_', suffix='.pdf', dir=UPLOAD_FOLDER)
+            spilled.write(self._file.getvalue())
+            self._file = spilled
+            self.path = spilled.name
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read/seek/tell/close and the rest of the file API go to the current buffer
+        return getattr(self._file, name)
+
+    @property
+    def is_pdf(self):
+        return PDF_HEADER in self._head
+
+    def source(self):
+        """Input for the extraction functions: a fresh in-memory stream, or the spill file's path"""
+        if self.path is not None:
+            self._file.flush()
+            return self.path
+        return io.BytesIO(self._file.getvalue())
+
+
+class CMPortalRequest(Request):
+    """Request class that spools file parts of the PDF upload endpoints into PdfUploadSpool"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint not in PDF_UPLOAD_ENDPOINTS:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        if (content_type or '').split(';')[0].strip().lower() not in PDF_CONTENT_TYPES:
+            raise UploadRejected(f'{filename} is not a PDF file (content type {content_type})')
+        return PdfUploadSpool(filename)
+
+
+def upload_source(file_storage, in_memory=False):
+    """
+    Extraction input for an uploaded file.
+
+    Args:
+        file_storage: Uploaded file from request.files
+        in_memory: Read a spilled upload back into memory, for use after the request
+            ends (the spill file is deleted with the request)
+
+    Returns:
+        In-memory stream or spill file path; raises UploadRejected if it is not a PDF
+    """
+    stream = file_storage.stream
+    if isinstance(stream, PdfUploadSpool):
+        if not stream.is_pdf:
+            raise UploadRejected(f'{file_storage.filename} is not a PDF file')
+        source = stream.source()
+        if in_memory and not isinstance(source, io.BytesIO):
+            with open(source, 'rb') as f:
+                source = io.BytesIO(f.read())
+        return source
+    data = stream.read()
+    if PDF_HEADER not in data[:PDF_HEADER_WINDOW]:
+        raise UploadRejected(f'{file_storage.filename} is not a PDF file')
+    return io.BytesIO(data)
+
+
+def _source_sha256(source):
+    """SHA-256 of a file path's bytes or of a seekable stream (left at its start)"""
+    if isinstance(source, (str, os.PathLike)):
+        return file_sha256(source)
+    digest = hashlib.sha256()
+    source.seek(0)
+    for chunk in iter(lambda: source.read(1 << 20), b''):
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+def _address_space_bytes():
+    """Current virtual memory size of this process (0 when unknown)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def _run_extraction(conn, func, args, memory_limit):
+    """Worker process body: apply the memory limit, run func and send back (ok, result)"""
+    if memory_limit and resource is not None:
+        limit = _address_space_bytes() + memory_limit
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        result = (True, func(*args))
+    except MemoryError:
+        result = (False, PdfExtractionError('PDF exceeded the extraction memory limit'))
+    except Exception as e:
+        result = (False, e)
+    try:
+        conn.send(result)
+    except Exception:
+        # The exception may not pickle; keep its message
+        conn.send((False, PdfExtractionError(f'{type(result[1]).__name__}: {result[1]}')))
+    finally:
+        conn.close()
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of PDF extraction results, stored as JSON text.
+
+    Keys combine the SHA-256 of the file bytes with the extraction kind (and, for
+    protocol features, a hash of the candidate list), so a re-upload hits whatever
+    it is named and two different files never collide. Entries live in an in-process
+    LRU bounded by memory_budget and in an SQLite file shared by every worker, trimmed
+    to disk_budget bytes least-recently-used first. Both tiers expire entries ttl
+    seconds after they were stored. Disk errors are logged and the disk tier skipped.
+    """
+    def __init__(self, path, memory_budget, disk_budget, ttl):
+        self.path = path
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (text, stored_at)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk_ready = False
+
+    @staticmethod
+    def make_key(kind, source, *parts):
+        """Cache key for extracting kind from source (a path or stream) with extra inputs parts"""
+        key = f'{kind}:{_source_sha256(source)}'
+        if parts:
+            digest = hashlib.sha256('\x1f'.join(map(str, parts)).encode('utf-8')).hexdigest()[:16]
+            key = f'{key}:{digest}'
+        return key
+
+    def _connect(self):
+        # One short-lived connection per operation: safe across threads and forked processes
+        if not self._disk_ready:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5)
+        if not self._disk_ready:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS extractions ('
+                               'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                               'stored_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+            self._disk_ready = True
+        return connection
+
+    def _remember(self, key, text, stored_at):
+        """Add to the in-process tier (caller holds the lock)"""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old[0])
+        if len(text) > self.memory_budget:
+            return
+        self._entries[key] = (text, stored_at)
+        self._size += len(text)
+        while self._size > self.memory_budget:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def get(self, key):
+        """Cached result for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[1] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(entry[0])
+                del self._entries[key]
+                self._size -= len(entry[0])
+        
+        row = None
+        if self.path:
+            try:
+                with self._connect() as connection:
+                    row = connection.execute('SELECT value, stored_at FROM extractions WHERE key = ? AND stored_at > ?',
+                                             (key, now - self.ttl)).fetchone()
+                    if row is not None:
+                        connection.execute('UPDATE extractions SET accessed_at = ? WHERE key = ?', (now, key))
+            except sqlite3.Error as e:
+                logger.warning(f'PDF extraction cache read failed: {e}')
+        
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self._remember(key, row[0], row[1])
+            self.disk_hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """Store a JSON-serializable extraction result in both tiers"""
+        text = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._remember(key, text, now)
+        if not self.path:
+            return
+        try:
+            with self._connect() as connection:
+                connection.execute('INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?)',
+                                   (key, text, len(text), now, now))
+                connection.execute('DELETE FROM extractions WHERE stored_at <= ?', (now - self.ttl,))
+                total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM extractions').fetchone()[0]
+                if total > self.disk_budget:
+                    evict = []
+                    for old_key, size in connection.execute('SELECT key, size FROM extractions ORDER BY accessed_at'):
+                        if total <= self.disk_budget:
+                            break
+                        evict.append((old_key,))
+                        total -= size
+                    connection.executemany('DELETE FROM extractions WHERE key = ?', evict)
+        except sqlite3.Error as e:
+            logger.warning(f'PDF extraction cache write failed: {e}')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        if self.path and os.path.exists(self.path):
+            try:
+                with self._connect() as connection:
+                    connection.execute('DELETE FROM extractions')
+            except sqlite3.Error as e:
+                logger.warning(f'PDF extraction cache clear failed: {e}')
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_budget': self.memory_budget,
+                'memory_size': self._size,
+                'memory_entries': len(self._entries),
+                'disk_budget': self.disk_budget,
+                'ttl': self.ttl
+            }
+        if self.path and os.path.exists(self.path):
+            try:
+                with self._connect() as connection:
+                    stats['disk_entries'], stats['disk_size'] = connection.execute(
+                        'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions').fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f'PDF extraction cache stats failed: {e}')
+        return stats
+
+
+class PdfExtractionPool:
+    """
+    Bounded pool for PDF extraction jobs.
+
+    At most max_workers jobs run at once, each in its own process forked from the
+    request worker (so the extraction code and its imports are already loaded; spawn
+    is used where fork is unavailable). A job that runs past timeout seconds is
+    killed on its own, so the other jobs in flight are unaffected, and a job's
+    process may grow by at most memory_limit bytes (RLIMIT_AS). Results of the
+    submit_* helpers are looked up in and stored to cache when one is given.
+    """
+    def __init__(self, max_workers=PDF_WORKERS, timeout=PDF_TIMEOUT_SECONDS, memory_limit=PDF_MEMORY_LIMIT, cache=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.cache = cache
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cmportal-pdf')
+
+        start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(start_method)
+
+    def _run(self, func, args):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_run_extraction, args=(sender, func, args, self.memory_limit), daemon=True)
+        process.start()
+        sender.close()
+        finished, message = False, None
+        try:
+            finished = receiver.poll(self.timeout)
+            if finished:
+                message = receiver.recv()
+        except EOFError:
+            pass
+        finally:
+            receiver.close()
+            if process.is_alive():
+                process.kill()
+            process.join()
+
+        if not finished:
+            raise PdfExtractionError(f'PDF extraction timed out after {self.timeout} seconds')
+        if message is None:
+            raise PdfExtractionError(f'PDF extraction process exited with code {process.exitcode}')
+        ok, result = message
+        if not ok:
+            raise result
+        return result
+
+    def submit(self, func, *args):
+        """Queue func(*args) for extraction; returns a Future for its result"""
+        return self._threads.submit(self._run, func, args)
+
+    def run(self, func, *args):
+        """Extract in a worker process and wait for the result"""
+        return self.submit(func, *args).result()
+
+    def _run_and_store(self, key, func, args):
+        result = self._run(func, args)
+        self.cache.put(key, result)
+        return result
+
+    def _submit_cached(self, key, func, *args):
+        if self.cache is None:
+            return self.submit(func, *args)
+        cached = self.cache.get(key)
+        if cached is None:
+            return self._threads.submit(self._run_and_store, key, func, args)
+        future = Future()
+        future.set_result(cached)
+        return future
+
+    def submit_protocol_features(self, source, causal_candidates):
+        """getUserProtocolFeatures(source, causal_candidates), cached by file content"""
+        key = ExtractionCache.make_key('features', source, *causal_candidates) if self.cache is not None else None
+        return self._submit_cached(key, getUserProtocolFeatures, source, causal_candidates)
+
+    def submit_user_data(self, source):
+        """getUserData(source), cached by file content"""
+        key = ExtractionCache.make_key('data', source) if self.cache is not None else None
+        return self._submit_cached(key, getUserData, source)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_extraction_pool():
+    """The process-wide PdfExtractionPool (created on first use)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            cache = ExtractionCache(PDF_CACHE_PATH, PDF_CACHE_MEMORY_BUDGET, PDF_CACHE_DISK_BUDGET, PDF_CACHE_TTL_SECONDS)
+            _pool = PdfExtractionPool(cache=cache)
+            logger.info(f'PDF extraction pool: {_pool.max_workers} workers, {_pool.timeout}s timeout')
+        return _pool
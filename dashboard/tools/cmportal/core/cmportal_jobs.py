@@ -0,0 +1,300 @@
+"""
+CMPortal Jobs
+Background benchmark jobs. A submission is queued and answered with a job ID at
+once; a small worker pool runs the benchmark and records per-stage progress in a
+job store, which clients poll or follow as Server-Sent Events. Finished results
+are kept for a TTL so the request worker never waits on the benchmark itself.
+
+Each process refreshes the jobs it owns on a heartbeat; a queued or running job
+that is not refreshed (its worker died or restarted) is marked failed when read.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dashboard.tools.cmportal.core.cmportal_config import (
+    BENCHMARK_JOB_WORKERS, BENCHMARK_JOB_TTL_SECONDS, BENCHMARK_JOB_STORE, BENCHMARK_JOB_STORE_PATH,
+    BENCHMARK_JOB_STALE_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# Job states; a job ends in 'done' or 'error'
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+FINISHED_STATES = (DONE, ERROR)
+
+
+def _new_record(job_id, now, owner=None):
+    return {
+        'id': job_id,
+        'owner': owner,
+        'state': QUEUED,
+        'stage': None,
+        'step': 0,
+        'steps': 0,
+        'progress': [],
+        'error': None,
+        'created_at': now,
+        'updated_at': now,
+        'result': None
+    }
+
+
+class MemoryJobStore:
+    """Job records held in this process (single-worker deployments and tests)"""
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, owner=None):
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = _new_record(job_id, now, owner)
+
+    def update(self, job_id, progress_event=None, **fields):
+        """Set record fields, appending progress_event to the progress list when given"""
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None:
+                return
+            record.update(fields)
+            if progress_event is not None:
+                record['progress'] = record['progress'] + [progress_event]
+            record['updated_at'] = time.time()
+
+    def get(self, job_id):
+        """Copy of the job record, or None when unknown or expired"""
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None or time.time() - record['updated_at'] >= self.ttl:
+                return None
+            return dict(record)
+
+    def purge(self):
+        """Drop records not updated within the TTL"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for job_id in [job_id for job_id, record in self._jobs.items() if record['updated_at'] <= cutoff]:
+                del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """
+    Job records in an SQLite file, so any gunicorn worker can answer a poll for a
+    job that another worker is running. Results are stored as serialized JSON text.
+    """
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._ready = False
+
+    def _connect(self):
+        # One short-lived connection per operation: safe across threads and forked processes
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5)
+        if not self._ready:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS benchmark_jobs ('
+                               'id TEXT PRIMARY KEY, record TEXT NOT NULL, updated_at REAL NOT NULL)')
+            self._ready = True
+        return connection
+
+    def create(self, job_id, owner=None):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('INSERT INTO benchmark_jobs VALUES (?, ?, ?)',
+                               (job_id, json.dumps(_new_record(job_id, now, owner)), now))
+
+    def update(self, job_id, progress_event=None, **fields):
+        """Set record fields, appending progress_event to the progress list when given"""
+        with self._connect() as connection:
+            # Take the write lock before reading, so concurrent updates cannot interleave
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute('SELECT record FROM benchmark_jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return
+            record = json.loads(row[0])
+            record.update(fields)
+            if progress_event is not None:
+                record['progress'].append(progress_event)
+            record['updated_at'] = time.time()
+            connection.execute('UPDATE benchmark_jobs SET record = ?, updated_at = ? WHERE id = ?',
+                               (json.dumps(record), record['updated_at'], job_id))
+
+    def get(self, job_id):
+        """The job record, or None when unknown or expired"""
+        with self._connect() as connection:
+            row = connection.execute('SELECT record FROM benchmark_jobs WHERE id = ? AND updated_at > ?',
+                                     (job_id, time.time() - self.ttl)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def purge(self):
+        """Drop records not updated within the TTL"""
+        with self._connect() as connection:
+            connection.execute('DELETE FROM benchmark_jobs WHERE updated_at <= ?', (time.time() - self.ttl,))
+
+
+class BenchmarkJobQueue:
+    """
+    Runs benchmark callables on a thread pool and tracks them in a job store.
+
+    A job callable takes a progress(stage, message, step, steps) callback and returns
+    a JSON-serializable result; an exception marks the job as failed with its message.
+
+    Jobs are owned by the process that queued them. A heartbeat thread refreshes
+    the owned jobs every stale_after / 6 seconds, and get() marks a queued or running
+    job that has not been refreshed for stale_after seconds as failed, so a job
+    whose worker died does not look like it is still running.
+    """
+    def __init__(self, store, max_workers=BENCHMARK_JOB_WORKERS, stale_after=BENCHMARK_JOB_STALE_SECONDS):
+        self.store = store
+        self.max_workers = max(1, max_workers)
+        self.stale_after = stale_after
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='cmportal-benchmark')
+        self._active = set()
+        self._active_lock = threading.Lock()
+        self._heartbeat = None
+
+    def submit(self, run):
+        """Queue run and return its job ID"""
+        self.store.purge()
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id, owner=self.owner)
+        with self._active_lock:
+            self._active.add(job_id)
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name='cmportal-benchmark-heartbeat', daemon=True)
+                self._heartbeat.start()
+        self._executor.submit(self._execute, job_id, run)
+        return job_id
+
+    def _beat(self):
+        """Refresh the owned jobs' update times for as long as the process lives"""
+        while True:
+            time.sleep(max(0.5, self.stale_after / 6))
+            with self._active_lock:
+                job_ids = list(self._active)
+            for job_id in job_ids:
+                try:
+                    self.store.update(job_id)
+                except Exception:
+                    logger.exception(f'Benchmark job {job_id}: heartbeat failed')
+
+    def _execute(self, job_id, run):
+        try:
+            self._run(job_id, run)
+        finally:
+            with self._active_lock:
+                self._active.discard(job_id)
+
+    def _run(self, job_id, run):
+        def progress(stage, message, step, steps):
+            event = {'stage': stage, 'message': message, 'step': step, 'steps': steps}
+            self.store.update(job_id, progress_event=event, stage=stage, step=step, steps=steps)
+
+        try:
+            self.store.update(job_id, state=RUNNING)
+            result = run(progress)
+        except Exception as e:
+            logger.exception(f'Benchmark job {job_id} failed')
+            self._fail(job_id, str(e))
+            return
+        try:
+            self.store.update(job_id, state=DONE, result=result)
+        except Exception as e:
+            # e.g. a result that is not JSON-serializable, or the store being locked too long
+            logger.exception(f'Benchmark job {job_id}: storing the result failed')
+            self._fail(job_id, f'Could not store the result: {e}')
+
+    def _fail(self, job_id, error):
+        try:
+            self.store.update(job_id, state=ERROR, error=error)
+        except Exception:
+            # Left unrefreshed, the job is reported as failed once it goes stale
+            logger.exception(f'Benchmark job {job_id}: recording the failure failed')
+
+    def get(self, job_id):
+        """The job record, with an unrefreshed queued or running job marked as failed"""
+        record = self.store.get(job_id)
+        if record is None or record['state'] in FINISHED_STATES:
+            return record
+        if time.time() - record['updated_at'] >= self.stale_after:
+            with self._active_lock:
+                owned = job_id in self._active
+            if not owned:
+                logger.warning(f'Benchmark job {job_id} of {record.get("owner")} stopped responding')
+                self.store.update(job_id, state=ERROR, error='The job was interrupted (its worker stopped)')
+                record = self.store.get(job_id)
+        return record
+
+    def events(self, job_id, poll_interval=0.25, keepalive=5, timeout=None):
+        """
+        Server-Sent Events for one job: a 'progress' event per recorded stage, then a
+        'done' or 'error' event carrying the job status (without the result).
+        A comment line goes out every keepalive seconds without an event, so proxies
+        keep the stream open. Stops with an 'error' event if the job expires or
+        timeout seconds pass.
+        """
+        timeout = self.store.ttl if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        last_sent = time.monotonic()
+        sent = 0
+        yield 'retry: 2000\n\n'
+        while True:
+            record = self.get(job_id)
+            if record is None:
+                yield _sse('error', {'id': job_id, 'state': ERROR, 'error': 'Job not found or expired'})
+                return
+            for event in record['progress'][sent:]:
+                yield _sse('progress', event)
+                last_sent = time.monotonic()
+            sent = len(record['progress'])
+            if record['state'] in FINISHED_STATES:
+                yield _sse(record['state'], job_status(record))
+                return
+            if time.monotonic() >= deadline:
+                yield _sse('error', {'id': job_id, 'state': record['state'], 'error': 'Timed out waiting for job'})
+                return
+            if time.monotonic() - last_sent >= keepalive:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(poll_interval)
+
+
+def _sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def job_status(record):
+    """Job record without its result, as returned to clients"""
+    return {key: value for key, value in record.items() if key != 'result'}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """The process-wide BenchmarkJobQueue (created on first use)"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            if BENCHMARK_JOB_STORE == 'memory':
+                store = MemoryJobStore(BENCHMARK_JOB_TTL_SECONDS)
+            else:
+                store = SQLiteJobStore(BENCHMARK_JOB_STORE_PATH, BENCHMARK_JOB_TTL_SECONDS)
+            _queue = BenchmarkJobQueue(store)
+            logger.info(f'Benchmark job queue: {_queue.max_workers} workers, {BENCHMARK_JOB_STORE} store')
+        return _queue
@@ -0,0 +1,254 @@
+"""
+CMPortal Responses
+Single-pass serialization for CMPortal endpoints (row JSON, columnar JSON or
+MessagePack, negotiated through Accept), and pre-serialized responses for data
+that only depends on the dataset version.
+"""
+
+import gzip
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+from flask import request, current_app
+
+from dashboard.tools.cmportal.core.cmportal_data_manager import get_dataset_cache, get_dataset_version
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Only bother compressing bodies larger than this
+MIN_COMPRESS_SIZE = 512
+
+# Response formats a client can ask for in Accept. Row-oriented JSON is the default;
+# the columnar layouts send Table values as {"columns": [...], "values": [[...], ...]}.
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_JSON_MIMETYPE = 'application/vnd.cmportal.columnar+json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+# ----- JSON serialization -----
+def _column_values(values):
+    """One column as a list of plain Python values, with NaN/None/NaT as None"""
+    values = np.asarray(values)
+    kind = values.dtype.kind
+    if kind in 'biu':
+        return values.tolist()
+    if kind == 'f':
+        missing = np.isnan(values)
+    else:
+        missing = pd.isna(values)
+    if not missing.any():
+        return values.tolist()
+    values = values.astype(object)
+    values[missing] = None
+    return values.tolist()
+
+class Table:
+    """
+    Tabular payload value, held column-wise as lists of plain Python values.
+    Serialized as a list of row objects (the to_dict(orient='records') shape) for
+    row JSON, or as {"columns": [...], "values": [[...], ...]} for columnar formats.
+    """
+    def __init__(self, columns, values):
+        self.columns = list(columns)
+        self.values = values
+
+    @classmethod
+    def from_frame(cls, df):
+        """Convert column-wise, so NumPy scalars and missing values are handled once per column"""
+        return cls([str(col) for col in df.columns],
+                   [_column_values(df.iloc[:, i].to_numpy()) for i in range(df.shape[1])])
+
+    @classmethod
+    def from_records(cls, records, columns):
+        return cls(columns, [[record.get(col) for record in records] for col in columns])
+
+    def __len__(self):
+        return len(self.values[0]) if self.values else 0
+
+    def rows(self):
+        return [dict(zip(self.columns, row)) for row in zip(*self.values)]
+
+    def columnar(self):
+        return {'columns': self.columns, 'values': self.values}
+
+
+def frame_records(df):
+    """DataFrame rows as dicts (like to_dict(orient='records')), converted column-wise"""
+    return Table.from_frame(df).rows()
+
+def _make_default(columnar):
+    """Encoder fallback for the pandas/NumPy objects (and Tables) the encoders do not handle themselves"""
+    def _default(obj):
+        if isinstance(obj, Table):
+            return obj.columnar() if columnar else obj.rows()
+        if isinstance(obj, pd.DataFrame):
+            table = Table.from_frame(obj)
+            return table.columnar() if columnar else table.rows()
+        if isinstance(obj, (pd.Series, pd.Index, np.ndarray)):
+            return _column_values(obj)
+        if isinstance(obj, np.generic):
+            value = obj.item()
+            return None if isinstance(value, float) and value != value else value
+        if obj is pd.NaT or obj is pd.NA:
+            return None
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+    return _default
+
+def available_formats():
+    """Response mimetypes this server can produce, default first"""
+    formats = [JSON_MIMETYPE, COLUMNAR_JSON_MIMETYPE]
+    if msgpack is not None:
+        formats.append(MSGPACK_MIMETYPE)
+    return formats
+
+def negotiate_format():
+    """Pick the response format for the current request from its Accept header"""
+    return request.accept_mimetypes.best_match(available_formats(), default=JSON_MIMETYPE)
+
+def dumps(obj, sort_keys=False, mimetype=JSON_MIMETYPE):
+    """
+    Serialize a response payload in one pass.
+    Tables, DataFrames, Series and NumPy arrays/scalars may appear anywhere in the
+    payload; NaN becomes null. Uses orjson for JSON when it is installed.
+    
+    Args:
+        obj: Payload to serialize
+        sort_keys: Sort object keys (matches Flask's jsonify ordering; JSON only)
+        mimetype: One of available_formats()
+    
+    Returns:
+        Encoded response body bytes
+    """
+    default = _make_default(columnar=mimetype != JSON_MIMETYPE)
+    if mimetype == MSGPACK_MIMETYPE:
+        return msgpack.packb(obj, default=default)
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, default=default, sort_keys=sort_keys, separators=(',', ':')).encode('utf-8')
+
+def json_response(payload, status=200, sort_keys=False):
+    """Flask response for a payload serialized with dumps(), in the format the client negotiated"""
+    mimetype = negotiate_format()
+    response = current_app.response_class(
+        response=dumps(payload, sort_keys=sort_keys, mimetype=mimetype),
+        status=status,
+        mimetype=mimetype
+    )
+    response.headers['Vary'] = 'Accept'
+    return response
+
+def spliced_response(payload, name, encoded, mimetype, status=200):
+    """
+    Response for payload plus one extra member whose value was serialized earlier
+    (with dumps and the same mimetype), without decoding and re-encoding it.
+    The spliced member comes last, and payload must have fewer than 15 members.
+    """
+    if mimetype == MSGPACK_MIMETYPE:
+        # fixmap header, then each key/value pair encoded back to back
+        body = bytes([0x80 | (len(payload) + 1)])
+        body += b''.join(dumps(k, mimetype=mimetype) + dumps(v, mimetype=mimetype) for k, v in payload.items())
+        body += dumps(name, mimetype=mimetype) + encoded
+    else:
+        head = dumps(payload, mimetype=mimetype)
+        separator = b',' if payload else b''
+        body = head[:-1] + separator + dumps(name) + b':' + encoded + b'}'
+    
+    response = current_app.response_class(response=body, status=status, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept'
+    return response
+
+
+# ----- Pre-serialized responses -----
+class PrecompressedResponse:
+    """
+    One response body in identity, gzip and (when the brotli package is installed)
+    br encodings. Each encoding gets its own strong ETag, derived from the dataset
+    version, the cache key and the body, since the bytes on the wire differ.
+    """
+    def __init__(self, key, payload, dataset_version, mimetype=JSON_MIMETYPE):
+        self.key = key
+        self.mimetype = mimetype
+        self.dataset_version = dataset_version
+        self.bodies = {'identity': dumps(payload, sort_keys=True, mimetype=mimetype)}
+
+        if len(self.bodies['identity']) >= MIN_COMPRESS_SIZE:
+            self.bodies['gzip'] = gzip.compress(self.bodies['identity'], compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(self.bodies['identity'], quality=11)
+
+        tag = hashlib.sha256(f'{dataset_version}:{key}:'.encode('utf-8') + self.bodies['identity']).hexdigest()[:24]
+        self.etags = {
+            encoding: tag if encoding == 'identity' else f'{tag}-{encoding}'
+            for encoding in self.bodies
+        }
+
+    def negotiate(self, accept_encoding):
+        """Pick the smallest encoding the client accepts"""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.bodies and accept_encoding[encoding]:
+                return encoding
+        return 'identity'
+
+    def to_response(self):
+        """Build the Flask response for the current request (304 when the client copy is current)"""
+        encoding = self.negotiate(request.accept_encodings)
+
+        response = current_app.response_class(mimetype=self.mimetype)
+        response.set_etag(self.etags[encoding])
+        response.headers['Vary'] = 'Accept, Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'
+
+        # Any encoding of the same dataset version is still current for the client
+        if any(request.if_none_match.contains_weak(tag) for tag in self.etags.values()):
+            response.status_code = 304
+            return response
+
+        response.set_data(self.bodies[encoding])
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+
+def cached_json_response(key, build_payload):
+    """
+    Serve a payload that only depends on the dataset version, in the negotiated format.
+
+    Args:
+        key: Cache key unique to the endpoint and its arguments
+        build_payload: Callable returning the JSON-serializable payload (called on a miss)
+
+    Returns:
+        Flask response with ETag/304 handling and content negotiation
+    """
+    cache = get_dataset_cache()
+    mimetype = negotiate_format()
+    key = f'{key}:{mimetype}'
+    cache_key = f'response:{key}'
+    version = get_dataset_version()
+
+    entry = cache.get(cache_key)
+    if entry is not None and entry.dataset_version != version:
+        cache.invalidate(cache_key, expected=entry)
+        entry = None
+    if entry is None:
+        entry = cache.get_or_load(cache_key, lambda: PrecompressedResponse(key, build_payload(), version, mimetype))
+
+    return entry.to_response()
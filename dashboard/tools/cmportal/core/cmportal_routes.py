@@ -5,30 +5,44 @@ Contains all routes and logic for the CMPortal dashboard tool
 
 from flask import render_template, jsonify, request, current_app
 import os
-import json
 import re
+import hmac
+import base64
 import numpy as np
 import pandas as pd
-import tempfile
-import shutil
 import traceback
 import threading
 import time
 from werkzeug.utils import secure_filename
 
 # Import CMPortal-specific modules
-from dashboard.tools.cmportal.core.cmportal_config import DATASET_PATHS, UPLOAD_FOLDER, MAX_CONTENT_LENGTH
+from dashboard.tools.cmportal.core.cmportal_config import (
+    DATASET_PATHS, UPLOAD_FOLDER, MAX_CONTENT_LENGTH, ADMIN_TOKEN, PRELOAD_DATASETS,
+    VIEWER_DEFAULT_LIMIT, VIEWER_MAX_LIMIT, SEARCH_DEFAULT_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE,
+    BATCH_MAX_QUERIES, SIMILAR_DEFAULT_K, SIMILAR_MAX_K, SUGGEST_DEFAULT_LIMIT, SUGGEST_MAX_LIMIT,
+    BENCHMARK_NEAREST_PROTOCOLS
+)
 from dashboard.tools.cmportal.core.cmportal_data_manager import (
     load_lookup_tables, load_viewer_data, load_enrichment_data, get_search_table,
     clear_memory_cache, get_binary_df, get_cleaned_df, get_target_feature_dict,
     get_categories_dict, get_causal_categories_dict, get_candidates,
-    load_selected_variables  # ADD THIS LINE
+    load_selected_variables, get_enrichment_store, get_dataset_cache,
+    preload_datasets, start_background_prefetch, get_memory_report,
+    get_viewer_index, get_dataset_version, get_search_cache, get_search_ranking, get_search_page,
+    batch_search, validate_search_query, get_similarity_index, get_suggest_index, SuggestIndex, get_benchmark_results,
+    get_indicator_distributions
+)
+from dashboard.tools.cmportal.core.cmportal_responses import (
+    Table, cached_json_response, json_response, spliced_response, negotiate_format, dumps
 )
 from dashboard.tools.cmportal.core.cmportal_utils import (
-    NpEncoder, getUserProtocolFeatures, getUserData, process_maturity_indicators
+    process_maturity_indicators, experimental_values, MATURITY_INDICATORS
 )
+from dashboard.tools.cmportal.core.cmportal_extraction import (
+    get_extraction_pool, upload_source, CMPortalRequest, PdfExtractionError, UploadRejected
+)
+from dashboard.tools.cmportal.core.cmportal_jobs import get_job_queue, job_status
 # Global variables for CMPortal
-_benchmark_results_cache = {}
 FeatureCategories_dict = {}
 TargetParameters_dict = {}
 CausalFeatureCategories_dict = {}
@@ -39,6 +53,7 @@ def register_cmportal_routes(app):
     # Set upload folder and max content length
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
     app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+    app.request_class = CMPortalRequest
     
     # Ensure uploads directory exists
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -52,6 +67,11 @@ def register_cmportal_routes(app):
     )
     SelectedVariables_lst = load_selected_variables(DATASET_PATHS['selected_vars_filepath'])
     print(f"Loaded {len(SelectedVariables_lst)} selected variables")
+    get_enrichment_store(DATASET_PATHS['enrich_filepath'], SelectedVariables_lst)
+    if PRELOAD_DATASETS:
+        preload_datasets(DATASET_PATHS)
+    else:
+        start_background_prefetch(DATASET_PATHS)
 
     # Start background cleanup thread
     cleanup_thread = threading.Thread(target=cleanup_temp_files, daemon=True)
@@ -80,8 +100,8 @@ def register_cmportal_routes(app):
         try:
             search_mode = request.args.get('search_mode', 'target')
             
-            enrichment_df = pd.read_csv(DATASET_PATHS['enrich_filepath'], low_memory=False)  # CHANGED
-            if enrichment_df.empty:
+            store = get_enrichment_store(DATASET_PATHS['enrich_filepath'], SelectedVariables_lst)
+            if not store.records:
                 return jsonify({'error': 'Enrichment data not available'}), 404
             
             if search_mode == 'target':
@@ -93,23 +113,22 @@ def register_cmportal_routes(app):
                 if not parameters:
                     return jsonify({'error': 'No target parameters selected'}), 400
                 
-                filtered_df = enrichment_df[enrichment_df['Target Label'].isin(parameters)]
+                records = store.select(store.rows_for_labels(parameters))
                 
             elif search_mode == 'features':
                 features = request.args.getlist('protocol_features[]')
                 if not features:
                     return jsonify({'error': 'No protocol features selected'}), 400
                 
-                pattern = '|'.join([re.escape(f) for f in features])
-                filtered_df = enrichment_df[enrichment_df['Prioritised Features'].str.contains(pattern, case=False, na=False)]
+                records = store.select(store.rows_for_features(features))
             
             else:
-                filtered_df = enrichment_df
+                records = store.records
             
-            return jsonify({
-                'data': filtered_df.to_dict(orient='records'),
-                'columns': filtered_df.columns.tolist()
-            })
+            return json_response({
+                'data': Table.from_records(records, store.columns),
+                'columns': store.columns
+            }, sort_keys=True)
             
         except Exception as e:
             app.logger.error(f"Error in get_enrichment_data: {str(e)}")
@@ -124,8 +143,8 @@ def register_cmportal_routes(app):
             if search_mode != 'target':
                 return jsonify({'error': 'Filtered search only available in target mode'}), 400
             
-            enrichment_df = pd.read_csv(DATASET_PATHS['enrich_filepath'], low_memory=False)  # CHANGED
-            if enrichment_df.empty:
+            store = get_enrichment_store(DATASET_PATHS['enrich_filepath'], SelectedVariables_lst)
+            if not store.records:
                 return jsonify({'error': 'Enrichment data not available'}), 404
             
             parameters = request.args.getlist('parameter[]')
@@ -136,19 +155,14 @@ def register_cmportal_routes(app):
             if not parameters:
                 return jsonify({'error': 'No target parameters selected'}), 400
             
-            filtered_df = enrichment_df[enrichment_df['Target Label'].isin(parameters)]
-            
-            if SelectedVariables_lst:
-                filtered_df = filtered_df[filtered_df['Prioritised Features'].isin(SelectedVariables_lst)]
+            records = store.select(store.rows_for_labels(parameters), selected_only=True)
+            columns = store.columns
             
-            records = filtered_df.to_dict('records')
-            columns = filtered_df.columns.tolist()
-            
-            return jsonify({
+            return json_response({
                 'columns': columns,
-                'data': records,
+                'data': Table.from_records(records, columns),
                 'filtered_count': len(SelectedVariables_lst)
-            })
+            }, sort_keys=True)
             
         except Exception as e:
             print(f"Error in get_enrichment_data_filtered: {str(e)}")
@@ -163,51 +177,120 @@ def register_cmportal_routes(app):
             if not category or category not in TargetParameters_dict:
                 return jsonify({'error': 'Invalid category'}), 400
             
-            parameters = TargetParameters_dict[category]
-            return jsonify({'parameters': parameters})
+            return cached_json_response(
+                f'target_parameters:{category}',
+                lambda: {'parameters': TargetParameters_dict[category]}
+            )
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
     @app.route('/api/protocol_features', methods=['GET'])
     def get_protocol_features():
         """Return all protocol features from binary_df columns"""
-        try:
+        def build_payload():
             binary_df = get_binary_df(DATASET_PATHS['binary_filepath'])
             exclude_cols = {'Protocol ID', 'Title', 'DOI', 'Matches', 'Protocol Similarity Rank'}
             features = [col for col in binary_df.columns if col not in exclude_cols and not col.endswith('Feature Found')]
-            return jsonify({'features': sorted(features)})
+            return {'features': sorted(features)}
+        
+        try:
+            return cached_json_response('protocol_features', build_payload)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
+    @app.route('/api/suggest', methods=['GET'])
+    def suggest():
+        """Typeahead over protocol features, target parameters and causal features (q, kind[], limit)"""
+        query = request.args.get('q', '')
+        kinds = request.args.getlist('kind[]')
+        unknown = [k for k in kinds if k not in SuggestIndex.KINDS]
+        if unknown:
+            return jsonify({'error': f'Unknown kind: {unknown[0]}'}), 400
+        try:
+            limit = min(int(request.args.get('limit', SUGGEST_DEFAULT_LIMIT)), SUGGEST_MAX_LIMIT)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        
+        index = get_suggest_index(
+            DATASET_PATHS['binary_filepath'], FeatureCategories_dict,
+            TargetParameters_dict, CausalFeatureCategories_dict
+        )
+        return json_response({'query': query, 'suggestions': index.suggest(query, kinds, max(limit, 0))})
+    
     @app.route('/api/viewer')
     def api_viewer():
-        """Serve the entire cleaned database as JSON"""
-        viewer_data, viewer_columns = load_viewer_data(DATASET_PATHS['cleaned_database_filepath'])
-        if not viewer_data:
-            return jsonify({'error': 'Viewer data not available'}), 404
-        return jsonify({'data': viewer_data, 'columns': viewer_columns})
+        """
+        Serve the cleaned database (rows by default, columnar/MessagePack via Accept).
+        Without query parameters the whole table is returned (category row first).
+        With any of offset/limit/cursor/columns[]/sort[]/eq[col]/min[col]/max[col]/
+        contains[col]/q, one filtered, sorted page is returned instead.
+        """
+        if not request.args:
+            viewer_data, viewer_columns = load_viewer_data(DATASET_PATHS['cleaned_database_filepath'])
+            if not viewer_data:
+                return jsonify({'error': 'Viewer data not available'}), 404
+            return cached_json_response('viewer', lambda: {
+                'data': Table.from_records(viewer_data, viewer_columns),
+                'columns': viewer_columns
+            })
+        
+        try:
+            index = get_viewer_index(DATASET_PATHS['cleaned_database_filepath'])
+            query = parse_viewer_query(request.args, index.columns)
+            rows, total = index.query(
+                sort=query['sort'], eq=query['eq'], ranges=query['ranges'],
+                contains=query['contains'], search=query['search']
+            )
+            offset, limit = query['offset'], query['limit']
+            page = rows[offset:offset + limit]
+            next_offset = offset + len(page)
+            return json_response({
+                'columns': query['columns'],
+                'categories': {col: index.categories[col] for col in query['columns']},
+                'data': Table(query['columns'], index.column_values(page, query['columns'])),
+                'total': total,
+                'filtered': len(rows),
+                'offset': offset,
+                'limit': limit,
+                'next_cursor': encode_viewer_cursor(next_offset) if next_offset < len(rows) else None
+            }, sort_keys=True)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            app.logger.error(f"Error in api_viewer: {str(e)}")
+            return jsonify({'error': str(e)}), 500
     
     @app.route('/api/get_ProtocolFeatures', methods=['POST'])
     def get_ProtocolFeatures():
         """Get protocol features by category key"""
         key = request.form.get('selected_key', '')
-        return jsonify(values=FeatureCategories_dict.get(key, []))
+        if key not in FeatureCategories_dict:
+            return jsonify(values=[])
+        return cached_json_response(f'get_ProtocolFeatures:{key}', lambda: {'values': FeatureCategories_dict[key]})
     
     @app.route('/api/get_TargetParameters', methods=['POST'])
     def get_TargetParameters():
         """Get target parameters by category key"""
         key = request.form.get('selected_key', '')
-        return jsonify(values=TargetParameters_dict.get(key, []))
+        if key not in TargetParameters_dict:
+            return jsonify(values=[])
+        return cached_json_response(f'get_TargetParameters:{key}', lambda: {'values': TargetParameters_dict[key]})
     
     @app.route('/api/get_CausalFeatures', methods=['POST'])
     def get_CausalFeatures():
         """Get causal features by category key"""
         key = request.form.get('selected_key', '')
-        return jsonify(values=CausalFeatureCategories_dict.get(key, []))
+        if key not in CausalFeatureCategories_dict:
+            return jsonify(values=[])
+        return cached_json_response(f'get_CausalFeatures:{key}', lambda: {'values': CausalFeatureCategories_dict[key]})
     
     @app.route('/api/submit_features', methods=['POST'])
     def submit_features():
-        """Handle feature search form submission"""
+        """
+        Handle feature search form submission.
+        Returns the full ranked table, or with page/page_size/top_k one page of it
+        plus the total hit count.
+        """
         parameter = request.form.get('parameter', '')
         features = request.form.getlist('selected_features[]')
         explicit_mode = request.form.get('mode', '')
@@ -238,44 +321,215 @@ def register_cmportal_routes(app):
         toggle_states = [s.lower() == 'true' for s in raw_states]
         
         try:
-            result_table = get_search_table(
-                FeaturesOfInterest=features,
+            paging = parse_search_paging(request.form)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)})
+        
+        def no_results():
+            error_msg = 'No results found. '
+            if mode == 'normal':
+                error_msg += 'Try fewer features'
+            elif mode == 'enrichment':
+                error_msg += 'Try a different topic'
+            else:
+                error_msg += 'Try fewer constraints'
+            return jsonify({'status': 'error', 'message': error_msg})
+        
+        try:
+            search_cache = get_search_cache()
+            echo = {
+                'status': 'success',
+                'data': {'parameter': parameter, 'selected_features': features, 'mode': mode},
+                'toggle_states': toggle_states
+            }
+            
+            if paging is not None:
+                # Top-k / paged results: partial selection over a cached ranking
+                page, page_size, top_k = paging
+                cache_key = search_cache.make_key(features, parameter, toggle_states, mode, variant='ranking')
+                ranking = search_cache.get(cache_key)
+                if ranking is None:
+                    ranking = get_search_ranking(
+                        FeaturesOfInterest=features,
+                        binary_filepath=DATASET_PATHS['binary_filepath'],
+                        odds_filepath=DATASET_PATHS['odds_filepath'],
+                        feature_categories_filepath=DATASET_PATHS['feature_categories_filepath'],
+                        LabelOfInterest=parameter,
+                        CategoriesOfInterest=toggle_states,
+                        SearchMode=mode
+                    )
+                    if ranking is not None:
+                        search_cache.put(cache_key, ranking)
+                if ranking is None or ranking.total == 0:
+                    return no_results()
+                
+                available = min(ranking.total, top_k) if top_k else ranking.total
+                offset = (page - 1) * page_size
+                result_table = get_search_page(
+                    ranking, DATASET_PATHS['cleaned_database_filepath'],
+                    offset, max(0, min(page_size, available - offset))
+                )
+                echo['search_results'] = {
+                    'data': result_table,
+                    'columns': result_table.columns.tolist(),
+                    'total': ranking.total,
+                    'page': page,
+                    'page_size': page_size,
+                    'pages': -(-available // page_size),
+                    'top_k': top_k
+                }
+                return json_response(echo)
+            
+            # Serialized results are cached per canonical query; b'' records "no results"
+            mimetype = negotiate_format()
+            cache_key = search_cache.make_key(features, parameter, toggle_states, mode, variant=mimetype)
+            search_results = search_cache.get(cache_key)
+            
+            if search_results is None:
+                result_table = get_search_table(
+                    FeaturesOfInterest=features,
+                    binary_filepath=DATASET_PATHS['binary_filepath'],
+                    cleaned_database_filepath=DATASET_PATHS['cleaned_database_filepath'],
+                    odds_filepath=DATASET_PATHS['odds_filepath'],
+                    feature_categories_filepath=DATASET_PATHS['feature_categories_filepath'],
+                    LabelOfInterest=parameter,
+                    CategoriesOfInterest=toggle_states,
+                    SearchMode=mode
+                )
+                search_results = b''
+                if not result_table.empty:
+                    search_results = dumps(
+                        {'data': result_table, 'columns': result_table.columns.tolist()}, mimetype=mimetype
+                    )
+                search_cache.put(cache_key, search_results)
+            
+            if not search_results:
+                return no_results()
+            
+            return spliced_response(echo, 'search_results', search_results, mimetype)
+        except Exception as e:
+            app.logger.error(f"Error in submit_features: {e}")
+            return jsonify({'status': 'error', 'message': f'Error: {str(e)}'})
+    
+    @app.route('/api/batch_search', methods=['POST'])
+    def batch_search_route():
+        """
+        Run many searches in one call. JSON body:
+        {"queries": [{"features": [...], "parameter": "...", "toggle_states": [...], "mode": "..."}, ...],
+         "top_k": optional row limit per query}
+        """
+        body = request.get_json(silent=True) or {}
+        queries = body.get('queries')
+        if not isinstance(queries, list) or not queries:
+            return jsonify({'status': 'error', 'message': 'queries must be a non-empty list'}), 400
+        if len(queries) > BATCH_MAX_QUERIES:
+            return jsonify({'status': 'error', 'message': f'At most {BATCH_MAX_QUERIES} queries per batch'}), 400
+        if not all(isinstance(q, dict) for q in queries):
+            return jsonify({'status': 'error', 'message': 'Each query must be an object'}), 400
+        for i, query in enumerate(queries):
+            try:
+                validate_search_query(query)
+            except ValueError as e:
+                return jsonify({'status': 'error', 'message': f'Query {i}: {e}'}), 400
+        top_k = body.get('top_k')
+        if top_k is not None and (not isinstance(top_k, int) or top_k < 1):
+            return jsonify({'status': 'error', 'message': 'top_k must be a positive integer'}), 400
+        
+        try:
+            tables = batch_search(
+                queries,
                 binary_filepath=DATASET_PATHS['binary_filepath'],
                 cleaned_database_filepath=DATASET_PATHS['cleaned_database_filepath'],
                 odds_filepath=DATASET_PATHS['odds_filepath'],
-                feature_categories_filepath=DATASET_PATHS['feature_categories_filepath'],
-                LabelOfInterest=parameter,
-                CategoriesOfInterest=toggle_states,
-                SearchMode=mode
+                feature_categories_filepath=DATASET_PATHS['feature_categories_filepath']
             )
+            results = []
+            for table in tables:
+                if table.empty:
+                    results.append({'status': 'error', 'message': 'No results found'})
+                    continue
+                results.append({
+                    'status': 'success',
+                    'total': len(table),
+                    'search_results': {
+                        'data': table.head(top_k) if top_k else table,
+                        'columns': table.columns.tolist()
+                    }
+                })
+            return json_response({'status': 'success', 'results': results})
+        except Exception as e:
+            app.logger.error(f"Error in batch_search: {e}")
+            return jsonify({'status': 'error', 'message': f'Error: {str(e)}'}), 500
+    
+    @app.route('/api/similar_protocols', methods=['GET', 'POST'])
+    def similar_protocols():
+        """
+        The k protocols most similar to a database protocol (protocol_id) or to an
+        uploaded protocol PDF (protocol_file, POST). Optional k and metric
+        ('jaccard' or 'hamming'). Uploaded protocols only fill in the candidate
+        features, so they are compared on those features alone.
+        """
+        try:
+            params = request.values
+            protocol_file = request.files.get('protocol_file')
+        except UploadRejected as e:
+            return jsonify({'status': 'error', 'message': e.description}), 400
+        protocol_id = params.get('protocol_id', '').strip()
+        metric = params.get('metric', 'jaccard')
+        try:
+            k = int(params.get('k', SIMILAR_DEFAULT_K))
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'k must be an integer'}), 400
+        if not 1 <= k <= SIMILAR_MAX_K:
+            return jsonify({'status': 'error', 'message': f'k must be between 1 and {SIMILAR_MAX_K}'}), 400
+        if not protocol_id and not protocol_file:
+            return jsonify({'status': 'error', 'message': 'Protocol ID or protocol file required'}), 400
+        
+        try:
+            index = get_similarity_index(DATASET_PATHS['binary_filepath'], DATASET_PATHS['cleaned_database_filepath'])
+            packed = index.packed
+            scope = None
+            exclude_row = None
+            
+            if protocol_id:
+                if protocol_id not in index.row_of:
+                    return jsonify({'status': 'error', 'message': f'Unknown protocol ID: {protocol_id}'}), 404
+                exclude_row = index.row_of[protocol_id]
+                query_mask = packed.words[exclude_row]
+                query = {'protocol_id': protocol_id}
+            else:
+                protocol_filename = secure_filename(protocol_file.filename)
+                candidates = get_candidates()
+                features = get_extraction_pool().submit_protocol_features(upload_source(protocol_file), candidates).result()
+                query_mask = packed.mask(features)
+                scope = packed.mask(candidates)
+                query = {'protocol_file': protocol_filename}
             
-            if result_table.empty:
-                error_msg = 'No results found. '
-                if mode == 'normal':
-                    error_msg += 'Try fewer features'
-                elif mode == 'enrichment':
-                    error_msg += 'Try a different topic'
-                else:
-                    error_msg += 'Try fewer constraints'
-                return jsonify({'status': 'error', 'message': error_msg})
+            rows, scores, shared = index.query(query_mask, k=k, metric=metric, scope=scope, exclude_row=exclude_row)
             
-            result_table = result_table.replace({np.nan: None})
-            result_data = json.loads(json.dumps(result_table.to_dict(orient='records'), cls=NpEncoder))
-            result_columns = result_table.columns.tolist()
+            cleaned_df = get_cleaned_df(DATASET_PATHS['cleaned_database_filepath'])
+            info = cleaned_df[['Title', 'DOI']].iloc[1:].reset_index(drop=True)
+            score_column = 'Jaccard Similarity' if metric == 'jaccard' else 'Hamming Distance'
+            neighbours = pd.DataFrame({
+                'Protocol ID': [index.protocol_ids[r] for r in rows],
+                'Title': info['Title'].to_numpy()[rows],
+                'DOI': info['DOI'].to_numpy()[rows],
+                score_column: np.round(scores, 4) if metric == 'jaccard' else scores,
+                'Shared Features': shared
+            })
             
-            return app.response_class(
-                response=json.dumps({
-                    'status': 'success',
-                    'data': {'parameter': parameter, 'selected_features': features, 'mode': mode},
-                    'toggle_states': toggle_states,
-                    'search_results': {'data': result_data, 'columns': result_columns}
-                }, cls=NpEncoder),
-                status=200,
-                mimetype='application/json'
-            )
+            return json_response({
+                'status': 'success',
+                'query': query,
+                'metric': metric,
+                'k': k,
+                'neighbours': {'data': neighbours, 'columns': neighbours.columns.tolist()}
+            })
+        except (ValueError, PdfExtractionError, UploadRejected) as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
         except Exception as e:
-            app.logger.error(f"Error in submit_features: {e}")
-            return jsonify({'status': 'error', 'message': f'Error: {str(e)}'})
+            app.logger.error(f"Error in similar_protocols: {e}")
+            return jsonify({'status': 'error', 'message': f'Error: {str(e)}'}), 500
     
     @app.route('/api/filter_features', methods=['POST'])
     def filter_features():
@@ -291,139 +545,213 @@ def register_cmportal_routes(app):
     @app.route('/api/submit_benchmark', methods=['POST'])
     def submit_benchmark():
         """Handle benchmark form submission with file uploads or database protocol selection"""
-        temp_dir = None
         try:
-            protocol_file = request.files.get('protocol_file')
-            experimental_file = request.files.get('experimental_file')
-            selected_purpose = request.form.get('selected_purpose')
-            selected_protocol_ids = request.form.getlist('selected_protocol_ids[]')
-            selected_own_protocol_id = request.form.get('selected_own_protocol_id')
-
-            if not protocol_file and not selected_own_protocol_id:
-                return jsonify({'status': 'error', 'message': 'Protocol file or database selection required'})
-            if not selected_purpose:
-                return jsonify({'status': 'error', 'message': 'Protocol purpose selection required'})
-            if not selected_own_protocol_id and protocol_file and not experimental_file:
-                return jsonify({'status': 'error', 'message': 'Experimental data file required when uploading protocol'})
-
-            temp_dir = tempfile.mkdtemp(prefix="benchmark_")
-            app.logger.info(f"Created temp directory: {temp_dir}")
-
-            protocol_data = None
-            if protocol_file:
-                protocol_filename = secure_filename(protocol_file.filename)
-                protocol_path = os.path.join(temp_dir, protocol_filename)
-                protocol_file.save(protocol_path)
-                protocol_data = {'path': protocol_path, 'name': protocol_filename}
-
-            experimental_data = None
-            if experimental_file:
-                experimental_filename = secure_filename(experimental_file.filename)
-                experimental_path = os.path.join(temp_dir, experimental_filename)
-                experimental_file.save(experimental_path)
-                experimental_data = {'path': experimental_path, 'name': experimental_filename}
-
-            reference_data = []
-            ref_protocol_files = request.files.getlist('reference_protocol_files[]')
-            ref_experimental_files = request.files.getlist('reference_experimental_files[]')
-
-            for ref_protocol, ref_experimental in zip(ref_protocol_files, ref_experimental_files):
-                if ref_protocol and ref_experimental:
-                    ref_protocol_filename = secure_filename(ref_protocol.filename)
-                    ref_experimental_filename = secure_filename(ref_experimental.filename)
-                    ref_protocol_path = os.path.join(temp_dir, ref_protocol_filename)
-                    ref_experimental_path = os.path.join(temp_dir, ref_experimental_filename)
-                    ref_protocol.save(ref_protocol_path)
-                    ref_experimental.save(ref_experimental_path)
-                    reference_data.append({'protocol_path': ref_protocol_path, 'data_path': ref_experimental_path})
-
+            benchmark_args = read_benchmark_form(request.form, request.files)
             try:
-                results = process_benchmark_data(
-                    protocol_data=protocol_data,
-                    experimental_data=experimental_data,
-                    selected_purpose=selected_purpose,
-                    selected_protocol_ids=selected_protocol_ids,
-                    reference_data=reference_data,
-                    selected_own_protocol_id=selected_own_protocol_id
-                )
-                return jsonify(results)
+                results = process_benchmark_data(**benchmark_args)
+                return json_response(results, sort_keys=True)
             except Exception as e:
                 app.logger.error(f"Error processing benchmark: {str(e)}")
                 app.logger.error(traceback.format_exc())
                 return jsonify({'status': 'error', 'message': f'Error processing benchmark: {str(e)}'})
 
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)})
+        except UploadRejected as e:
+            return jsonify({'status': 'error', 'message': e.description})
         except Exception as e:
             app.logger.error(f"Error in submit_benchmark: {str(e)}")
             app.logger.error(traceback.format_exc())
             return jsonify({'status': 'error', 'message': f'Error processing request: {str(e)}'})
 
-        finally:
-            if temp_dir and os.path.exists(temp_dir):
-                try:
-                    shutil.rmtree(temp_dir)
-                    app.logger.info(f"Cleaned up temp directory: {temp_dir}")
-                except Exception as e:
-                    app.logger.error(f"Error cleaning up {temp_dir}: {e}")
+    # ===== Benchmark Jobs =====
 
-    @app.teardown_appcontext
-    def teardown_cmportal(exception=None):
-        """Clean up CMPortal resources on app shutdown"""
-        global _benchmark_results_cache
-        _benchmark_results_cache.clear()
-        clear_memory_cache()
+    @app.route('/api/benchmark_jobs', methods=['POST'])
+    def submit_benchmark_job():
+        """Queue a benchmark (same form as /api/submit_benchmark) and return its job ID at once"""
+        try:
+            benchmark_args = read_benchmark_form(request.form, request.files, in_memory=True)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        except UploadRejected as e:
+            return jsonify({'status': 'error', 'message': e.description}), 400
+
+        def run(progress):
+            with app.app_context():
+                return process_benchmark_data(progress=progress, **benchmark_args)
+
+        job_id = get_job_queue().submit(run)
+        return jsonify({
+            'status': 'success',
+            'job_id': job_id,
+            'status_url': f'/api/benchmark_jobs/{job_id}',
+            'events_url': f'/api/benchmark_jobs/{job_id}/events'
+        }), 202
+
+    @app.route('/api/benchmark_jobs/<job_id>', methods=['GET'])
+    def benchmark_job_status(job_id):
+        """Job state and progress, plus the benchmark results once it is done"""
+        record = get_job_queue().get(job_id)
+        if record is None:
+            return jsonify({'status': 'error', 'message': 'Job not found or expired'}), 404
+        payload = {'status': 'success', 'job': job_status(record)}
+        if record['state'] == 'done':
+            payload['result'] = record['result']
+        return json_response(payload, sort_keys=True)
+
+    @app.route('/api/benchmark_jobs/<job_id>/events', methods=['GET'])
+    def benchmark_job_events(job_id):
+        """Server-Sent Events stream of a job's progress, ending with a done or error event"""
+        response = app.response_class(get_job_queue().events(job_id), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    # ===== Admin Routes =====
+    
+    def _is_admin_request():
+        # Constant-time comparison, so response timing does not leak the token
+        token = request.headers.get('X-Admin-Token', '')
+        return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+    
+    @app.route('/api/admin/cache', methods=['GET'])
+    def admin_cache_stats():
+        """Dataset cache counters, per-entry sizes and this worker's RSS"""
+        if not _is_admin_request():
+            return jsonify({'error': 'Not found'}), 404
+        stats = get_dataset_cache().stats()
+        stats['search_cache'] = get_search_cache().stats()
+        stats['pdf_cache'] = get_extraction_pool().cache.stats()
+        stats['memory'] = get_memory_report()
+        return jsonify(stats)
+    
+    @app.route('/api/admin/cache/clear', methods=['POST'])
+    def admin_cache_clear():
+        """Evict cached datasets (pinned ones only when include_pinned=true)"""
+        if not _is_admin_request():
+            return jsonify({'error': 'Not found'}), 404
+        include_pinned = request.form.get('include_pinned', 'false').lower() == 'true'
+        clear_memory_cache(include_pinned=include_pinned)
+        return jsonify({'status': 'success', 'cache': get_dataset_cache().stats()})
+
+
+def read_benchmark_form(form, files, in_memory=False):
+    """
+    Read and validate a benchmark submission.
+    
+    Args:
+        form: request.form
+        files: request.files
+        in_memory: Keep every upload in memory, for benchmarks that outlive the request
+    
+    Returns:
+        Keyword arguments for process_benchmark_data; raises ValueError for an
+        incomplete form and UploadRejected for a non-PDF upload
+    """
+    protocol_file = files.get('protocol_file')
+    experimental_file = files.get('experimental_file')
+    selected_purpose = form.get('selected_purpose')
+    selected_own_protocol_id = form.get('selected_own_protocol_id')
+
+    if not protocol_file and not selected_own_protocol_id:
+        raise ValueError('Protocol file or database selection required')
+    if not selected_purpose:
+        raise ValueError('Protocol purpose selection required')
+    if not selected_own_protocol_id and protocol_file and not experimental_file:
+        raise ValueError('Experimental data file required when uploading protocol')
+
+    # Uploads are parsed from memory (spilled to UPLOAD_FOLDER only when large)
+    protocol_data = None
+    if protocol_file:
+        protocol_data = {'source': upload_source(protocol_file, in_memory),
+                         'name': secure_filename(protocol_file.filename)}
+
+    experimental_data = None
+    if experimental_file:
+        experimental_data = {'source': upload_source(experimental_file, in_memory),
+                             'name': secure_filename(experimental_file.filename)}
+
+    reference_data = []
+    ref_protocol_files = files.getlist('reference_protocol_files[]')
+    ref_experimental_files = files.getlist('reference_experimental_files[]')
+
+    for ref_protocol, ref_experimental in zip(ref_protocol_files, ref_experimental_files):
+        if ref_protocol and ref_experimental:
+            reference_data.append({'protocol_source': upload_source(ref_protocol, in_memory),
+                                   'data_source': upload_source(ref_experimental, in_memory)})
+
+    return {
+        'protocol_data': protocol_data,
+        'experimental_data': experimental_data,
+        'selected_purpose': selected_purpose,
+        'selected_protocol_ids': form.getlist('selected_protocol_ids[]'),
+        'reference_data': reference_data,
+        'selected_own_protocol_id': selected_own_protocol_id
+    }
 
 
 def process_benchmark_data(protocol_data, experimental_data, selected_purpose,
-                           selected_protocol_ids, reference_data, selected_own_protocol_id=None):
-    """Process benchmark data and return results"""
+                           selected_protocol_ids, reference_data, selected_own_protocol_id=None,
+                           progress=None):
+    """
+    Process benchmark data and return results.
+    
+    The main protocol and each uploaded reference also get 'percentiles': every
+    submitted indicator value ranked against the database values of that indicator,
+    with its nearest database protocols (see IndicatorDistributions).
+    
+    progress, when given, is called as progress(stage, message, step, steps) as each
+    stage starts: 'parsing', 'main', 'purpose', 'reference' (once per pair) and 'database'.
+    """
+    steps = (0 if selected_own_protocol_id and not reference_data else 1) + 3 + len(reference_data)
+    step = 0
+
+    def report(stage, message):
+        nonlocal step
+        step += 1
+        if progress is not None:
+            progress(stage, message, step, steps)
+
     c_candidates = get_candidates()
     target_feature_dict = get_target_feature_dict(DATASET_PATHS['odds_filepath'])
-    binary_df = get_binary_df(DATASET_PATHS['binary_filepath'])
-    cleaned_df = get_cleaned_df(DATASET_PATHS['cleaned_database_filepath'])
-
-    indicators = [
-        'Sarcomere Length (um)', 'Cell Area (um2)', 'T-tubule Structure (Found)',
-        'Contractile Force (mN)', 'Contractile Stress (mN/mm2)',
-        'Contraction Upstroke Velocity (um/s)', 'Calcium Flux Amplitude (F/F0)',
-        'Time to Calcium Flux Peak (ms)', 'Time from Calcium Peak to Relaxation (ms)',
-        'Conduction Velocity from Calcium Imaging (cm/s)',
-        'Action Potential Conduction Velocity (cm/s)', 'Action Potential Amplitude (mV)',
-        'Resting Membrane Potential (mV)', 'Beat Rate (bpm)',
-        'Max Capture Rate of Paced CMs (Hz)', 'MYH7 Percentage (MYH6)',
-        'MYL2 Percentage (MYL7)', 'TNNI3 Percentage (TNNI1)'
-    ]
+    benchmark_results = get_benchmark_results(DATASET_PATHS['binary_filepath'], DATASET_PATHS['cleaned_database_filepath'],
+                                              DATASET_PATHS['odds_filepath'])
 
-    # Handle main protocol
-    if selected_own_protocol_id:
-        try:
-            index_for_binary = int(selected_own_protocol_id) - 1
-            index_for_cleaned = int(selected_own_protocol_id)
+    indicators = MATURITY_INDICATORS
 
-            filtered_b_row = binary_df.loc[index_for_binary, c_candidates]
-            main_features = [col for col, val in filtered_b_row.items() if val]
+    uploads = (0 if selected_own_protocol_id else 2) + 2 * len(reference_data)
+    if uploads:
+        report('parsing', f'Parsing {uploads} uploaded PDF files')
 
-            filtered_c_row = cleaned_df.loc[index_for_cleaned, indicators]
-            main_data = {'ProtocolName': f'Protocol {selected_own_protocol_id}'}
+    # Parse every uploaded PDF concurrently in the extraction pool; results are collected in upload order
+    pool = get_extraction_pool()
+    if not selected_own_protocol_id:
+        if not experimental_data:
+            raise Exception("Experimental data required when uploading protocol")
+        if not protocol_data:
+            raise Exception("Protocol data required")
+        main_data_job = pool.submit_user_data(experimental_data['source'])
+        main_features_job = pool.submit_protocol_features(protocol_data['source'], c_candidates)
+    reference_jobs = [
+        (pool.submit_user_data(ref_data['data_source']),
+         pool.submit_protocol_features(ref_data['protocol_source'], c_candidates))
+        for ref_data in reference_data
+    ]
 
-            for indicator in indicators:
-                if indicator in filtered_c_row and not pd.isna(filtered_c_row[indicator]) and str(filtered_c_row[indicator]) != "nan":
-                    main_data[indicator] = '1' if indicator == 'T-tubule Structure (Found)' else str(filtered_c_row[indicator])
-                else:
-                    main_data[indicator] = ""
+    # Uploaded experimental data, ranked against the database together once every upload is scored
+    ranked_entries, ranked_data = [], []
 
-            main_protocol_name, main_results_by_indicator = process_maturity_indicators(
-                main_data, main_features, target_feature_dict
-            )
+    # Handle main protocol
+    report('main', 'Scoring main protocol')
+    if selected_own_protocol_id:
+        try:
+            main_protocol_name = f'Protocol {selected_own_protocol_id}'
+            main_results_by_indicator = dict(benchmark_results[int(selected_own_protocol_id)])
         except Exception as e:
             raise Exception(f"Failed to load protocol ID {selected_own_protocol_id}: {str(e)}")
     else:
-        if not experimental_data:
-            raise Exception("Experimental data required when uploading protocol")
-        main_data = getUserData(experimental_data['path'])
-        if protocol_data:
-            main_features = getUserProtocolFeatures(protocol_data['path'], c_candidates)
-        else:
-            raise Exception("Protocol data required")
+        main_data = main_data_job.result()
+        main_features = main_features_job.result()
         main_protocol_name, main_results_by_indicator = process_maturity_indicators(
             main_data, main_features, target_feature_dict
         )
@@ -433,11 +761,16 @@ def process_benchmark_data(protocol_data, experimental_data, selected_purpose,
         'protocol_name': main_protocol_name,
         'selected_purpose': selected_purpose,
         'results': main_results_by_indicator,
+        'percentiles': {},
         'reference_results': [],
         'db_protocol_results': []
     }
+    if not selected_own_protocol_id:
+        ranked_entries.append(results)
+        ranked_data.append(main_data)
 
     # Process purpose-based reference
+    report('purpose', f'Scoring key characteristics of {selected_purpose}')
     PurposeData = {'ProtocolName': f'Key Characteristics of {selected_purpose}'}
     for indicator in indicators:
         PurposeData[indicator] = ''
@@ -448,40 +781,34 @@ def process_benchmark_data(protocol_data, experimental_data, selected_purpose,
     results['reference_results'].append({'name': PurposeProtocolName, 'results': PurposeQResultsByIndicator})
 
     # Process user-uploaded reference pairs
-    for ref_data in reference_data:
-        RefData = getUserData(ref_data['data_path'])
-        RefFeatures = getUserProtocolFeatures(ref_data['protocol_path'], c_candidates)
+    for i, (data_job, features_job) in enumerate(reference_jobs, 1):
+        report('reference', f'Scoring reference {i} of {len(reference_jobs)}')
+        RefData = data_job.result()
+        RefFeatures = features_job.result()
         RefProtocolName, RefQResultsByIndicator = process_maturity_indicators(
             RefData, RefFeatures, target_feature_dict
         )
-        results['reference_results'].append({'name': RefProtocolName, 'results': RefQResultsByIndicator})
-
-    # Process database protocol comparisons
+        reference_entry = {'name': RefProtocolName, 'results': RefQResultsByIndicator}
+        results['reference_results'].append(reference_entry)
+        ranked_entries.append(reference_entry)
+        ranked_data.append(RefData)
+
+    # Percentiles of all uploads and indicators in one vectorized pass over the sorted database values
+    if ranked_entries:
+        distributions = get_indicator_distributions(DATASET_PATHS['cleaned_database_filepath'])
+        ranked = distributions.rank(experimental_values(ranked_data, distributions.indicators), BENCHMARK_NEAREST_PROTOCOLS)
+        for entry, percentiles in zip(ranked_entries, ranked):
+            entry['percentiles'] = percentiles
+
+    # Process database protocol comparisons (precomputed per dataset)
+    report('database', f'Comparing {len(selected_protocol_ids)} database protocols')
     for protocol_id in selected_protocol_ids:
         try:
-            index_for_binary = int(protocol_id) - 1
-            index_for_cleaned = int(protocol_id)
-
-            filtered_b_row = binary_df.loc[index_for_binary, c_candidates]
-            IDRefFeatures = [col for col, val in filtered_b_row.items() if val]
-
-            filtered_c_row = cleaned_df.loc[index_for_cleaned, indicators]
             protocol_name_suffix = " (Reference)" if protocol_id == selected_own_protocol_id else ""
-            IDRefData = {'ProtocolName': f'Protocol {protocol_id}{protocol_name_suffix}'}
-
-            for indicator in indicators:
-                if indicator in filtered_c_row and not pd.isna(filtered_c_row[indicator]) and str(filtered_c_row[indicator]) != "nan":
-                    IDRefData[indicator] = '1' if indicator == 'T-tubule Structure (Found)' else str(filtered_c_row[indicator])
-                else:
-                    IDRefData[indicator] = ""
-
-            IDRefProtocolName, IDRefQResultsByIndicator = process_maturity_indicators(
-                IDRefData, IDRefFeatures, target_feature_dict
-            )
             results['db_protocol_results'].append({
                 'id': protocol_id,
-                'name': IDRefProtocolName,
-                'results': IDRefQResultsByIndicator
+                'name': f'Protocol {protocol_id}{protocol_name_suffix}',
+                'results': dict(benchmark_results[int(protocol_id)])
             })
         except Exception as e:
             current_app.logger.error(f"Error processing protocol ID {protocol_id}: {str(e)}")
@@ -489,6 +816,116 @@ def process_benchmark_data(protocol_data, experimental_data, selected_purpose,
     return results
 
 
+def parse_search_paging(form):
+    """
+    Read the optional page/page_size/top_k search parameters.
+    
+    Returns:
+        (page, page_size, top_k) with top_k None when unlimited, or None when no
+        paging was requested; raises ValueError for invalid values
+    """
+    if not any(form.get(name) for name in ('page', 'page_size', 'top_k')):
+        return None
+    
+    def positive_int(name, default=None):
+        raw = form.get(name)
+        if not raw:
+            return default
+        try:
+            value = int(raw)
+        except ValueError:
+            raise ValueError(f'{name} must be an integer')
+        if value < 1:
+            raise ValueError(f'{name} must be at least 1')
+        return value
+    
+    top_k = positive_int('top_k')
+    page = positive_int('page', 1)
+    page_size = positive_int('page_size', min(top_k or SEARCH_DEFAULT_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE))
+    if page_size > SEARCH_MAX_PAGE_SIZE:
+        raise ValueError(f'page_size must be at most {SEARCH_MAX_PAGE_SIZE}')
+    return page, page_size, top_k
+
+
+_VIEWER_FILTER_PARAM = re.compile(r'^(eq|min|max|contains)\[(.+)\]$')
+
+def encode_viewer_cursor(offset):
+    """Opaque viewer cursor: next offset tied to the dataset version it was issued for"""
+    payload = f'{offset}:{get_dataset_version()[:16]}'.encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+def decode_viewer_cursor(cursor):
+    try:
+        offset, version = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split(':')
+        offset = int(offset)
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if version != get_dataset_version()[:16]:
+        raise ValueError('Cursor is from an older dataset version; restart from the first page')
+    return offset
+
+def parse_viewer_query(args, all_columns):
+    """Translate /api/viewer query-string arguments into ViewerIndex.query arguments"""
+    known = set(all_columns)
+    
+    def check_column(col):
+        if col not in known:
+            raise ValueError(f'Unknown column: {col}')
+        return col
+    
+    columns = [check_column(c) for c in args.getlist('columns[]')] or list(all_columns)
+    
+    sort = []
+    for spec in args.getlist('sort[]'):
+        col, _, direction = spec.rpartition(':')
+        if direction.lower() not in ('asc', 'desc'):
+            col, direction = spec, 'asc'
+        sort.append((check_column(col), direction.lower() == 'desc'))
+    
+    eq, contains, ranges = {}, {}, {}
+    for key, value in args.items(multi=True):
+        match = _VIEWER_FILTER_PARAM.match(key)
+        if not match:
+            continue
+        op, col = match.group(1), check_column(match.group(2))
+        if op == 'eq':
+            eq[col] = value
+        elif op == 'contains':
+            contains[col] = value
+        else:
+            try:
+                bound = float(value)
+            except ValueError:
+                raise ValueError(f'{op}[{col}] must be a number')
+            low, high = ranges.get(col, (None, None))
+            ranges[col] = (bound, high) if op == 'min' else (low, bound)
+    
+    if args.get('cursor'):
+        offset = decode_viewer_cursor(args['cursor'])
+    else:
+        try:
+            offset = int(args.get('offset', 0))
+        except ValueError:
+            raise ValueError('offset must be an integer')
+    try:
+        limit = int(args.get('limit', VIEWER_DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if offset < 0 or limit < 0:
+        raise ValueError('offset and limit must be non-negative')
+    
+    return {
+        'columns': columns,
+        'sort': sort,
+        'eq': eq,
+        'contains': contains,
+        'ranges': ranges,
+        'search': args.get('q', ''),
+        'offset': offset,
+        'limit': min(limit, VIEWER_MAX_LIMIT)
+    }
+
+
 def cleanup_temp_files():
     """Background thread to clean up old temporary files. Runs every 20 minutes"""
     while True:
@@ -506,18 +943,6 @@ def cleanup_temp_files():
                             current_app.logger.info(f"Deleted old upload: {filename}")
                         except Exception as e:
                             current_app.logger.error(f"Error deleting {filename}: {e}")
-
-            system_temp = tempfile.gettempdir()
-            if os.path.exists(system_temp):
-                for dirname in os.listdir(system_temp):
-                    if dirname.startswith('benchmark_'):
-                        dir_path = os.path.join(system_temp, dirname)
-                        if os.path.isdir(dir_path) and current_time - os.path.getmtime(dir_path) > 1200:
-                            try:
-                                shutil.rmtree(dir_path)
-                                current_app.logger.info(f"Deleted old temp directory: {dirname}")
-                            except Exception as e:
-                                current_app.logger.error(f"Error deleting directory {dirname}: {e}")
         except Exception as e:
             if current_app:
                 current_app.logger.error(f"Error in cleanup thread: {e}")
\ No newline at end of file
@@ -0,0 +1,332 @@
+"""
+CMPortal Dataset Snapshot Module
+Compiles the CMPortal CSV datasets into one versioned binary snapshot that workers
+memory-map at startup instead of re-parsing every CSV.
+
+Layout: magic, header length, JSON header, then 64-byte aligned raw NumPy arrays.
+Strings are interned into a single table and referenced by int32 codes (-1 = NaN).
+The header records a SHA-256 per source CSV; a snapshot whose hashes no longer
+match the files on disk is ignored and the data manager falls back to CSV.
+
+Compile (from the repository root):
+    python -m dashboard.tools.cmportal.core.cmportal_snapshot
+"""
+
+import os
+import sys
+import json
+import mmap
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'CMPSNAP\x00'
+SNAPSHOT_VERSION = 2
+_ALIGN = 64
+_NAN_CODE = -1
+
+
+def file_sha256(filepath):
+    """SHA-256 hex digest of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sources_hash(source_hashes):
+    """Combined content hash over all source files, used as the dataset version"""
+    digest = hashlib.sha256()
+    for key in sorted(source_hashes):
+        digest.update(f'{key}={source_hashes[key]};'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SnapshotWriter:
+    """Collects frames, string lists and dicts of string lists, then writes them to one file"""
+    def __init__(self, dataset_paths):
+        self.dataset_paths = dataset_paths
+        self.sources = {}
+        self.frames = {}
+        self.string_lists = {}
+        self.list_dicts = {}
+        self.stored_arrays = {}
+        self._arrays = {}
+        self._string_ids = {}
+        self._strings = []
+
+    def _source(self, source_key):
+        if source_key not in self.sources:
+            filepath = self.dataset_paths[source_key]
+            self.sources[source_key] = {
+                'filename': os.path.basename(filepath),
+                'sha256': file_sha256(filepath)
+            }
+        return source_key
+
+    def _intern(self, value):
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._string_ids[value] = string_id
+            self._strings.append(value)
+        return string_id
+
+    def _codes(self, values):
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            if isinstance(value, str):
+                codes[i] = self._intern(value)
+            elif pd.isna(value):
+                codes[i] = _NAN_CODE
+            else:
+                raise TypeError(f'Cannot snapshot non-string object value {value!r}')
+        return codes
+
+    def _array(self, name, array):
+        self._arrays[name] = np.ascontiguousarray(array)
+        return name
+
+    def add_frame(self, name, source_key, df):
+        """Store a DataFrame read from a CSV (RangeIndex, string column names)"""
+        if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+            raise ValueError(f'{name}: only RangeIndex frames can be snapshotted')
+        spec = {
+            'source': self._source(source_key),
+            'columns': [self._intern(str(col)) for col in df.columns],
+            'nrows': len(df)
+        }
+        dtypes = set(df.dtypes)
+        if len(dtypes) == 1 and next(iter(dtypes)).kind in 'biuf':
+            spec['layout'] = 'matrix'
+            spec['array'] = self._array(f'{name}/matrix', df.to_numpy())
+        else:
+            spec['layout'] = 'columns'
+            spec['kinds'] = []
+            spec['arrays'] = []
+            for i, col in enumerate(df.columns):
+                series = df[col]
+                if series.dtype.kind in 'biuf':
+                    spec['kinds'].append('array')
+                    spec['arrays'].append(self._array(f'{name}/{i}', series.to_numpy()))
+                elif series.dtype == object:
+                    spec['kinds'].append('codes')
+                    spec['arrays'].append(self._array(f'{name}/{i}', self._codes(series.tolist())))
+                else:
+                    raise TypeError(f'{name}: unsupported dtype {series.dtype} for column {col}')
+        self.frames[name] = spec
+
+    def add_array(self, name, source_key, array):
+        """Store a derived NumPy array (e.g. the packed feature matrix) tied to a source CSV"""
+        self.stored_arrays[name] = {
+            'source': self._source(source_key),
+            'array': self._array(f'{name}/array', array)
+        }
+
+    def add_string_list(self, name, source_key, values):
+        self.string_lists[name] = {
+            'source': self._source(source_key),
+            'array': self._array(f'{name}/codes', self._codes(values))
+        }
+
+    def add_list_dict(self, name, source_key, mapping):
+        keys = list(mapping.keys())
+        values = [v for key in keys for v in mapping[key]]
+        self.list_dicts[name] = {
+            'source': self._source(source_key),
+            'keys': self._array(f'{name}/keys', self._codes(keys)),
+            'lengths': self._array(f'{name}/lengths', np.array([len(mapping[k]) for k in keys], dtype=np.int64)),
+            'values': self._array(f'{name}/values', self._codes(values))
+        }
+
+    def write(self, snapshot_path):
+        """Write the snapshot atomically (temp file + rename) and return its dataset version"""
+        text = ''.join(self._strings)
+        offsets = np.zeros(len(self._strings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(s) for s in self._strings])
+        self._array('__strings__/blob', np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32))
+        self._array('__strings__/offsets', offsets)
+
+        source_hashes = {key: src['sha256'] for key, src in self.sources.items()}
+        header = {
+            'version': SNAPSHOT_VERSION,
+            'dataset_version': sources_hash(source_hashes),
+            'sources': self.sources,
+            'frames': self.frames,
+            'string_lists': self.string_lists,
+            'list_dicts': self.list_dicts,
+            'stored_arrays': self.stored_arrays,
+            'arrays': {}
+        }
+        offset = 0
+        for name, array in self._arrays.items():
+            offset = -(-offset // _ALIGN) * _ALIGN
+            header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += array.nbytes
+
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_start = -(-(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes)) // _ALIGN) * _ALIGN
+
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        tmp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(np.uint64(len(header_bytes)).tobytes())
+            f.write(header_bytes)
+            for name, array in self._arrays.items():
+                f.seek(data_start + header['arrays'][name]['offset'])
+                f.write(array.tobytes())
+        os.replace(tmp_path, snapshot_path)
+        return header['dataset_version']
+
+
+def is_mapped(array):
+    """True if a NumPy array is a view onto a memory-mapped file (shared between processes)"""
+    while isinstance(array, np.ndarray):
+        array = array.base
+    if isinstance(array, memoryview):
+        array = array.obj
+    return isinstance(array, mmap.mmap)
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a compiled snapshot"""
+    def __init__(self, snapshot_path, mm, header, data_start, source_stats):
+        self.path = snapshot_path
+        self.header = header
+        self.dataset_version = header['dataset_version']
+        self._mm = mm
+        self._data_start = data_start
+        self._source_stats = source_stats
+        self._strings = None
+        self._string_table = None
+
+    @classmethod
+    def open(cls, snapshot_path, dataset_paths):
+        """Memory-map a snapshot; returns None if it is missing, from another format version or stale"""
+        if not os.path.exists(snapshot_path):
+            logger.info(f'No dataset snapshot at {snapshot_path}')
+            return None
+        try:
+            with open(snapshot_path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError('bad magic')
+            header_len = int(np.frombuffer(mm, dtype=np.uint64, count=1, offset=len(SNAPSHOT_MAGIC))[0])
+            header_start = len(SNAPSHOT_MAGIC) + 8
+            header = json.loads(mm[header_start:header_start + header_len].decode('utf-8'))
+            data_start = -(-(header_start + header_len) // _ALIGN) * _ALIGN
+        except Exception as e:
+            logger.error(f'Unreadable dataset snapshot {snapshot_path}: {e}')
+            return None
+
+        if header.get('version') != SNAPSHOT_VERSION:
+            logger.warning('Dataset snapshot format version mismatch; falling back to CSV')
+            return None
+
+        source_stats = {}
+        for key, source in header['sources'].items():
+            filepath = dataset_paths.get(key)
+            if (not filepath or os.path.basename(filepath) != source['filename']
+                    or not os.path.exists(filepath) or file_sha256(filepath) != source['sha256']):
+                logger.warning(f'Dataset snapshot is stale for {key}; falling back to CSV')
+                return None
+            st = os.stat(filepath)
+            source_stats[key] = (filepath, st.st_mtime_ns, st.st_size)
+
+        logger.info(f'Memory-mapped dataset snapshot {header["dataset_version"][:12]}')
+        return cls(snapshot_path, mm, header, data_start, source_stats)
+
+    @property
+    def mapped_bytes(self):
+        return len(self._mm)
+
+    def _is_fresh(self, source_key, filepath):
+        """The source is the same file the snapshot was validated against and unchanged since"""
+        recorded = self._source_stats.get(source_key)
+        if recorded is None or os.path.abspath(recorded[0]) != os.path.abspath(filepath):
+            return False
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return False
+        return (st.st_mtime_ns, st.st_size) == recorded[1:]
+
+    def array(self, name):
+        """Zero-copy read-only NumPy view of a stored array"""
+        spec = self.header['arrays'][name]
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        return np.frombuffer(self._mm, dtype=dtype, count=count,
+                             offset=self._data_start + spec['offset']).reshape(spec['shape'])
+
+    @property
+    def strings(self):
+        if self._strings is None:
+            text = self.array('__strings__/blob').tobytes().decode('utf-32-le')
+            offsets = self.array('__strings__/offsets').tolist()
+            self._strings = [text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        return self._strings
+
+    def _decode(self, codes):
+        if self._string_table is None:
+            table = np.empty(len(self.strings) + 1, dtype=object)
+            table[:-1] = self.strings
+            table[_NAN_CODE] = np.nan
+            self._string_table = table
+        return self._string_table[codes]
+
+    def frame(self, name, filepath):
+        """Rebuild a stored DataFrame, or None if absent or its source changed"""
+        spec = self.header['frames'].get(name)
+        if spec is None or not self._is_fresh(spec['source'], filepath):
+            return None
+        columns = [self.strings[i] for i in spec['columns']]
+        if spec['layout'] == 'matrix':
+            return pd.DataFrame(self.array(spec['array']), columns=columns, copy=False)
+        data = {}
+        for col, kind, array_name in zip(columns, spec['kinds'], spec['arrays']):
+            array = self.array(array_name)
+            data[col] = self._decode(array) if kind == 'codes' else array
+        return pd.DataFrame(data, columns=columns)
+
+    def stored_array(self, name, filepath):
+        """Zero-copy view of a stored derived array, or None if absent or its source changed"""
+        spec = self.header['stored_arrays'].get(name)
+        if spec is None or not self._is_fresh(spec['source'], filepath):
+            return None
+        return self.array(spec['array'])
+
+    def string_list(self, name, filepath):
+        spec = self.header['string_lists'].get(name)
+        if spec is None or not self._is_fresh(spec['source'], filepath):
+            return None
+        return self._decode(self.array(spec['array'])).tolist()
+
+    def list_dict(self, name, filepath):
+        """Rebuild a stored dict of string lists as a list of (key, values) pairs, or None"""
+        spec = self.header['list_dicts'].get(name)
+        if spec is None or not self._is_fresh(spec['source'], filepath):
+            return None
+        keys = self._decode(self.array(spec['keys'])).tolist()
+        values = self._decode(self.array(spec['values'])).tolist()
+        bounds = np.concatenate([[0], np.cumsum(self.array(spec['lengths']))]).tolist()
+        return [(key, values[bounds[i]:bounds[i + 1]]) for i, key in enumerate(keys)]
+
+
+if __name__ == '__main__':
+    # Mirror app.py's import path so the data manager's `import config` resolves
+    BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+    sys.path.insert(0, BASE_DIR)
+    sys.path.insert(0, os.path.join(BASE_DIR, 'core'))
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    from dashboard.tools.cmportal.core.cmportal_config import DATASET_PATHS, SNAPSHOT_PATH
+    from dashboard.tools.cmportal.core.cmportal_data_manager import compile_snapshot
+
+    version = compile_snapshot(DATASET_PATHS, SNAPSHOT_PATH)
+    print(f'Wrote {SNAPSHOT_PATH} (dataset version {version[:12]})')
@@ -3,18 +3,16 @@ Utility functions for palpant-labsite
 Extracted from app.py for better modularity
 """
 
-import json
+import bisect
 import numpy as np
 import pandas as pd
 import re
-from PyPDF2 import PdfReader
+from collections import defaultdict
+from dashboard.tools.cmportal.core.cmportal_acroform import read_form_fields
 
 # Precompiled regex pattern for better performance
 _quantile_pattern = re.compile(r'Q[1-6]')
 
-# Cache for protocol features to avoid reprocessing
-_protocol_features_cache = {}
-
 # Centralized constants to avoid redundancy
 MATURITY_QUANTILES = {
     "Sarcomere Length (um)": [(1.95, 2.5), (1.88, 1.95), (1.75, 1.88), (1.64, 1.75), (1.01, 1.64)],
@@ -38,6 +36,25 @@ MATURITY_QUANTILES = {
     "3D Estimated Cell Density (mil cells/mL)": [(5, 40), (1.25, 5), (0.25, 1.25)]
 }
 
+# Maturity indicators reported by the benchmark, in display order
+MATURITY_INDICATORS = [
+    'Sarcomere Length (um)', 'Cell Area (um2)', 'T-tubule Structure (Found)',
+    'Contractile Force (mN)', 'Contractile Stress (mN/mm2)',
+    'Contraction Upstroke Velocity (um/s)', 'Calcium Flux Amplitude (F/F0)',
+    'Time to Calcium Flux Peak (ms)', 'Time from Calcium Peak to Relaxation (ms)',
+    'Conduction Velocity from Calcium Imaging (cm/s)',
+    'Action Potential Conduction Velocity (cm/s)', 'Action Potential Amplitude (mV)',
+    'Resting Membrane Potential (mV)', 'Beat Rate (bpm)',
+    'Max Capture Rate of Paced CMs (Hz)', 'MYH7 Percentage (MYH6)',
+    'MYL2 Percentage (MYL7)', 'TNNI3 Percentage (TNNI1)'
+]
+
+# Indicators where a lower value is more mature; their MATURITY_QUANTILES ranges ascend
+LOWER_IS_BETTER_INDICATORS = frozenset({
+    'Beat Rate (bpm)', 'Time to Calcium Flux Peak (ms)',
+    'Time from Calcium Peak to Relaxation (ms)', 'Resting Membrane Potential (mV)'
+})
+
 # PDF field mapping for consistent data extraction - UPDATED for consistent field names
 PDF_FIELD_MAP = {
     'ProtocolName': 'ProtocolName',
@@ -64,31 +81,6 @@ PDF_FIELD_MAP = {
 }
 
 
-class NpEncoder(json.JSONEncoder):
-    """
-    Custom JSON encoder for NumPy types.
-    
-    This encoder converts:
-    - NumPy integers to Python integers
-    - NumPy floats to Python floats
-    - NumPy arrays to Python lists
-    - NumPy and Python booleans to Python booleans
-    - NaN values to None
-    """
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        if isinstance(obj, (np.bool_, bool)):
-            return bool(obj)
-        if pd.isna(obj):  # Check if the object is NaN or None
-            return None
-        return super(NpEncoder, self).default(obj)
-
-
 def normalize_field_name(field_name):
     """
     Normalize field names by replacing Unicode symbols with ASCII equivalents
@@ -155,10 +147,213 @@ def classify_quantile(indicator_name, value):
     return 'Q1'  # Default to Q1 if no match
 
 
+class QuantileBins:
+    """
+    The MATURITY_QUANTILES ranges of one indicator compiled into sorted bin edges.
+    
+    The range bounds cut the number line into pieces: each bound itself and the open
+    intervals between bounds. Every value in a piece gets the same (quantile, flag),
+    so it is worked out once per piece and classifying values is one np.searchsorted.
+    Quantile 0 means the value is not classified (NaN, or a gap between ranges).
+    Flags follow process_maturity_indicators: 1 within the ranges, 3 better than the
+    best range (Q1), 4 worse than the worst range (last quantile).
+    """
+    def __init__(self, ranges, lower_is_better):
+        self.ranges = ranges
+        self.lower_is_better = lower_is_better
+        self.edges = np.unique(np.asarray(ranges, dtype=np.float64).ravel())
+        self.edge_list = self.edges.tolist()
+        
+        # Piece 2i is the open interval below edges[i] (2n is above the last edge), 2i + 1 is edges[i]
+        edges = self.edge_list
+        samples = [edges[0] - 1.0]
+        for i, edge in enumerate(edges):
+            samples.append(edge)
+            samples.append((edge + edges[i + 1]) / 2 if i + 1 < len(edges) else edge + 1.0)
+        classified = [self._classify_piece(sample) for sample in samples]
+        self.quantiles = np.array([quantile for quantile, _ in classified], dtype=np.int64)
+        self.flags = np.array([flag for _, flag in classified], dtype=np.int64)
+
+    def _classify_piece(self, value):
+        """Classify one representative value by walking the ranges"""
+        ranges = self.ranges
+        if self.lower_is_better:
+            if value < ranges[0][0]:
+                return 1, 3
+            if value > ranges[-1][1]:
+                return len(ranges), 4
+        else:
+            if value > ranges[0][1]:
+                return 1, 3
+            if value < ranges[-1][0]:
+                return len(ranges), 4
+        for i, (low, high) in enumerate(ranges):
+            if low <= value <= high:
+                return i + 1, 1
+        return 0, 0
+
+    def classify(self, values):
+        """
+        Classify many values at once.
+        
+        Returns:
+            Tuple (quantiles, flags) of int64 arrays shaped like values
+        """
+        values = np.asarray(values, dtype=np.float64)
+        positions = np.searchsorted(self.edges, values)
+        on_edge = self.edges[np.minimum(positions, len(self.edges) - 1)] == values
+        pieces = 2 * positions + on_edge
+        quantiles = self.quantiles[pieces]
+        flags = self.flags[pieces]
+        missing = np.isnan(values)
+        quantiles[missing] = 0
+        flags[missing] = 0
+        return quantiles, flags
+
+    def classify_value(self, value):
+        """Classify a single float; returns (quantile, flag)"""
+        if value != value:
+            return 0, 0
+        position = bisect.bisect_left(self.edge_list, value)
+        piece = 2 * position + (position < len(self.edge_list) and self.edge_list[position] == value)
+        return int(self.quantiles[piece]), int(self.flags[piece])
+
+
+QUANTILE_BINS = {
+    indicator: QuantileBins(ranges, indicator in LOWER_IS_BETTER_INDICATORS)
+    for indicator, ranges in MATURITY_QUANTILES.items()
+}
+
+
+def classify_quantiles(indicator_name, values):
+    """
+    Classify many experimental values of one indicator, e.g. a column of cleaned_df.
+    
+    Returns:
+        Tuple (quantiles, flags) of int64 arrays (quantile 0 = not classified),
+        or None if the indicator has no quantile ranges
+    """
+    bins = QUANTILE_BINS.get(indicator_name)
+    if bins is None:
+        return None
+    return bins.classify(values)
+
+
+def classify_frame(df, indicators=MATURITY_INDICATORS):
+    """
+    Classify every indicator column of df at once.
+    
+    Returns:
+        Tuple (quantiles, flags) of int DataFrames indexed like df, one column per
+        indicator present in both df and MATURITY_QUANTILES (quantile 0 = not classified)
+    """
+    columns = [indicator for indicator in indicators if indicator in df.columns and indicator in QUANTILE_BINS]
+    quantiles, flags = {}, {}
+    for indicator in columns:
+        values = pd.to_numeric(df[indicator], errors='coerce').to_numpy(dtype=np.float64)
+        quantiles[indicator], flags[indicator] = QUANTILE_BINS[indicator].classify(values)
+    return (pd.DataFrame(quantiles, index=df.index, columns=columns),
+            pd.DataFrame(flags, index=df.index, columns=columns))
+
+
+def experimental_values(user_data_list, indicators=MATURITY_INDICATORS):
+    """
+    Reported indicator values of many getUserData results as one float matrix.
+
+    Returns:
+        float64 array (submissions x indicators), NaN where a value is missing or
+        not a finite number (the values process_maturity_indicators cannot classify)
+    """
+    values = np.full((len(user_data_list), len(indicators)), np.nan)
+    for i, user_data in enumerate(user_data_list):
+        for j, indicator in enumerate(indicators):
+            value = user_data.get(indicator)
+            if value and value.strip():
+                try:
+                    values[i, j] = float(value)
+                except (ValueError, TypeError):
+                    continue
+    values[~np.isfinite(values)] = np.nan
+    return values
+
+
+class IndicatorDistributions:
+    """
+    The database values of each maturity indicator as a sorted array, for ranking
+    experimental values against the database rather than the MATURITY_QUANTILES ranges.
+
+    The percentile of a value is the share of database values below it, with equal
+    values counted as half (mid-rank), in percent. Since the arrays are sorted, both
+    the percentile and the nearest database protocols come from np.searchsorted.
+    """
+    def __init__(self, values, protocol_ids, indicators=MATURITY_INDICATORS):
+        """
+        Args:
+            values: float array (protocols x indicators), NaN where not reported
+            protocol_ids: protocol ID per row of values
+        """
+        self.indicators = list(indicators)
+        protocol_ids = np.asarray(protocol_ids, dtype=object)
+        self.sorted_values = []
+        self.sorted_ids = []
+        for j in range(len(self.indicators)):
+            column = values[:, j]
+            present = np.flatnonzero(~np.isnan(column))
+            order = present[np.argsort(column[present], kind='stable')]
+            self.sorted_values.append(column[order])
+            self.sorted_ids.append(protocol_ids[order])
+
+    def rank(self, values, k=3):
+        """
+        Percentiles and nearest database protocols of many submissions at once;
+        each indicator is ranked for every submission with one np.searchsorted.
+
+        Args:
+            values: float array (submissions x indicators), NaN where not submitted
+                (see experimental_values)
+            k: number of nearest database protocols per value
+
+        Returns:
+            List with one dict per submission: indicator -> {'value', 'percentile',
+            'count', 'nearest': [{'id', 'value'}, ...]} for each submitted value whose
+            indicator has database values; nearest protocols are closest first
+        """
+        ranked = [{} for _ in range(len(values))]
+        for j, indicator in enumerate(self.indicators):
+            database = self.sorted_values[j]
+            n = len(database)
+            rows = np.flatnonzero(~np.isnan(values[:, j]))
+            if n == 0 or len(rows) == 0:
+                continue
+            submitted = values[rows, j]
+            below = np.searchsorted(database, submitted, side='left')
+            not_above = np.searchsorted(database, submitted, side='right')
+            percentiles = (below + not_above) * (50.0 / n)
+
+            # The k closest values lie among the k below and the k from the insertion point up
+            nearest_k = min(k, n)
+            candidates = below[:, None] + np.arange(-nearest_k, nearest_k)
+            positions = np.clip(candidates, 0, n - 1)
+            distances = np.abs(database[positions] - submitted[:, None])
+            distances[(candidates < 0) | (candidates >= n)] = np.inf
+            closest = np.argsort(distances, axis=1, kind='stable')[:, :nearest_k]
+            nearest = np.take_along_axis(positions, closest, axis=1)
+
+            ids = self.sorted_ids[j]
+            for row, value, percentile, picks in zip(rows.tolist(), submitted.tolist(), percentiles.tolist(), nearest):
+                ranked[row][indicator] = {
+                    'value': value,
+                    'percentile': percentile,
+                    'count': n,
+                    'nearest': [{'id': ids[p], 'value': database[p].item()} for p in picks.tolist()]
+                }
+        return ranked
+
+
 def getUserProtocolFeatures(file_path, causal_candidates):
     """
     Extract features from a protocol PDF file.
-    Uses the cache to avoid reprocessing.
+    Results are cached by file content in cmportal_extraction.ExtractionCache.
     
     Args:
         file_path: String path to the PDF file or file object
@@ -167,21 +362,7 @@ def getUserProtocolFeatures(file_path, causal_candidates):
     Returns:
         List of selected feature labels
     """
-    import os
-    
-    # Create a cache key based on path or filename
-    if hasattr(file_path, 'filename'):
-        # For file objects (like those from request.files)
-        cache_key = f"{file_path.filename}_{hash(tuple(causal_candidates))}"
-    else:
-        # For string paths
-        cache_key = f"{os.path.basename(file_path)}_{hash(tuple(causal_candidates))}"
-    
-    if cache_key in _protocol_features_cache:
-        return _protocol_features_cache[cache_key]
-    
-    reader = PdfReader(file_path)
-    fields = reader.get_fields()
+    fields = read_form_fields(file_path)
 
     binary_list = []
     for field in fields.values():
@@ -194,9 +375,6 @@ def getUserProtocolFeatures(file_path, causal_candidates):
         raise ValueError(f"Mismatch: {len(causal_candidates)} labels vs {len(binary_list)} fields")
 
     selected_labels = [label for label, is_true in zip(causal_candidates, binary_list) if is_true]
-    
-    # Store in cache
-    _protocol_features_cache[cache_key] = selected_labels
     return selected_labels
 
 
@@ -237,8 +415,7 @@ def getUserData(pdf_path):
     ]
     
     try:
-        reader = PdfReader(pdf_path)
-        fields = reader.get_fields()
+        fields = read_form_fields(pdf_path)
         
         if not fields:
             print("WARNING: No form fields found in the PDF.")
@@ -347,6 +524,91 @@ def ScoreProtocol(protocol_features: list, FeaturesByQuantile: dict) -> pd.Serie
     return result_series
 
 
+class MaturityModel:
+    """
+    The feature-based quantile prediction of process_maturity_indicators,
+    compiled once from target_feature_dict.
+    
+    For an indicator with quantile feature lists F_q (from GetQuantileFeatures),
+    ScoreProtocol scores candidate quantile s as sum_q w_s(q) * |F_q & protocol|
+    with w_s(q) = 1 - |q - s|. Folding the weights into the feature lists gives an
+    (indicator x quantile) x feature weight matrix, so the scores of every
+    indicator are one matrix-vector product with the protocol's feature vector.
+    Ties are averaged exactly as in ScoreProtocol ("Q2.5").
+    """
+    def __init__(self, target_feature_dict, indicators=MATURITY_INDICATORS):
+        AllQuantileFeatures = [label for label in target_feature_dict.keys() if "Quantiles" in label]
+        
+        self.feature_index = {}
+        self.blocks = {}      # indicator -> (first weight row, quantile numbers)
+        self.fallback = {}    # indicator -> FeaturesByQuantile scored with ScoreProtocol
+        rows = []
+        for indicator in indicators:
+            FeaturesByQuantile = GetQuantileFeatures(indicator, target_feature_dict, AllQuantileFeatures)
+            if not FeaturesByQuantile:
+                continue
+            quantiles = sorted(FeaturesByQuantile.keys(), key=lambda x: int(x[1:]))
+            numbers = [int(q[1:]) for q in quantiles]
+            if numbers != list(range(1, len(numbers) + 1)):
+                # get_scoring_weights only knows Q1..Qn; keep ScoreProtocol's behaviour for gaps
+                self.fallback[indicator] = FeaturesByQuantile
+                continue
+            
+            self.blocks[indicator] = (len(rows), numbers)
+            for selected_quantile in quantiles:
+                weights = get_scoring_weights(len(quantiles), selected_quantile)
+                row = defaultdict(int)
+                for quantile, features in FeaturesByQuantile.items():
+                    for feature in features:
+                        row[self.feature_index.setdefault(feature, len(self.feature_index))] += weights[quantile]
+                rows.append(row)
+        
+        self.weights = np.zeros((len(rows), len(self.feature_index)), dtype=np.int64)
+        for i, row in enumerate(rows):
+            for col, weight in row.items():
+                self.weights[i, col] = weight
+
+    def feature_vector(self, protocol_features):
+        vector = np.zeros(len(self.feature_index), dtype=np.int64)
+        for feature in protocol_features:
+            col = self.feature_index.get(feature)
+            if col is not None:
+                vector[col] = 1
+        return vector
+
+    def predict(self, protocol_features):
+        """
+        Predicted quantile per indicator for one protocol.
+        
+        Returns:
+            dict: indicator -> quantile string; indicators without quantile features are absent
+        """
+        scores = self.weights @ self.feature_vector(protocol_features)
+        predictions = {}
+        for indicator, (start, numbers) in self.blocks.items():
+            block = scores[start:start + len(numbers)]
+            best = [n for n, score in zip(numbers, block) if score == block.max()]
+            if len(best) == 1:
+                predictions[indicator] = f"Q{best[0]}"
+            else:
+                predictions[indicator] = f"Q{sum(best) / len(best):.1f}"
+        for indicator, FeaturesByQuantile in self.fallback.items():
+            predictions[indicator] = ScoreProtocol(protocol_features, FeaturesByQuantile).get('Reference Quantile(s)', 'Q3')
+        return predictions
+
+
+_maturity_model = (None, None)
+
+def get_maturity_model(target_feature_dict):
+    """Compiled MaturityModel for target_feature_dict, rebuilt only when a different dict is passed"""
+    global _maturity_model
+    source, model = _maturity_model
+    if source is not target_feature_dict:
+        model = MaturityModel(target_feature_dict)
+        _maturity_model = (target_feature_dict, model)
+    return model
+
+
 def process_maturity_indicators(user_data, protocol_features, target_feature_dict):
     """
     Process maturity indicators by combining experimental data with protocol features.
@@ -363,24 +625,8 @@ def process_maturity_indicators(user_data, protocol_features, target_feature_dic
     # Initialize the results dictionary
     ResultsDict = {}
     
-    # Define expected indicators for clear reference
-    expected_indicators = [
-        'Sarcomere Length (um)', 'Cell Area (um2)', 'T-tubule Structure (Found)',
-        'Contractile Force (mN)', 'Contractile Stress (mN/mm2)',
-        'Contraction Upstroke Velocity (um/s)', 'Calcium Flux Amplitude (F/F0)',
-        'Time to Calcium Flux Peak (ms)', 'Time from Calcium Peak to Relaxation (ms)',
-        'Conduction Velocity from Calcium Imaging (cm/s)',
-        'Action Potential Conduction Velocity (cm/s)', 'Action Potential Amplitude (mV)',
-        'Resting Membrane Potential (mV)', 'Beat Rate (bpm)',
-        'Max Capture Rate of Paced CMs (Hz)', 'MYH7 Percentage (MYH6)',
-        'MYL2 Percentage (MYL7)', 'TNNI3 Percentage (TNNI1)'
-    ]
-    
-    # Get all quantile features
-    FeaturesByAllLabels = target_feature_dict
-
-    # Get list of all quantile features - use generator for memory efficiency
-    AllQuantileFeatures = [label for label in FeaturesByAllLabels.keys() if "Quantiles" in label]
+    # Feature-based predictions for all indicators come from one product, computed on first use
+    predictions = None
 
     # Process each maturity indicator
     Name = "Unnamed Protocol"
@@ -393,117 +639,359 @@ def process_maturity_indicators(user_data, protocol_features, target_feature_dic
                 # Convert value to float
                 float_value = float(value)
                 
-                # Check if value is within any quantile range
-                quantile = None
-                flag = 1  # Default to normal experimental data
-                
-                if indicator_id in MATURITY_QUANTILES:
-                    ranges = MATURITY_QUANTILES[indicator_id]
-                    
-                    # Get the best and worst bounds for this indicator
-                    best_low, best_high = ranges[0]
-                    worst_low, worst_high = ranges[-1]
-                    
-                    # Special cases for Beat Rate, Time, and Resting Membrane Potential where direction is reversed
-                    reversed_metrics = ["Beat Rate", "Time", "Resting"]
-                    is_reversed = any(term in indicator_id for term in reversed_metrics)
-                    
-                    if is_reversed:
-                        # For reversed metrics (Beat Rate, Time, Resting Membrane)
-                        # Check if value is better than the best range (lower is better)
-                        if float_value < best_low:
-                            quantile = 'Q1'
-                            flag = 3  # Better than best
-                        # Check if value is worse than worst range (higher is worse)
-                        elif float_value > worst_high:
-                            quantile = f'Q{len(ranges)}'
-                            flag = 4  # Worse than worst
-                        else:
-                            # Value is within ranges, find which quantile
-                            for i, (low, high) in enumerate(ranges):
-                                if low <= float_value <= high:
-                                    quantile = f'Q{i+1}'
-                                    flag = 1
-                                    break
-                    else:
-                        # For normal metrics (higher is better)
-                        # Check if value is better than the best range (higher is better)
-                        if float_value > best_high:
-                            quantile = 'Q1'
-                            flag = 3  # Better than best
-                        # Check if value is worse than worst range (lower is worse)
-                        elif float_value < worst_low:
-                            quantile = f'Q{len(ranges)}'
-                            flag = 4  # Worse than worst
-                        else:
-                            # Value is within ranges, find which quantile
-                            for i, (low, high) in enumerate(ranges):
-                                if low <= float_value <= high:
-                                    quantile = f'Q{i+1}'
-                                    flag = 1
-                                    break
-                    
+                # Find the quantile from the compiled range edges
+                if indicator_id in QUANTILE_BINS:
+                    quantile, flag = QUANTILE_BINS[indicator_id].classify_value(float_value)
                     if quantile:
-                        ResultsDict[indicator_id] = (quantile, flag)
+                        ResultsDict[indicator_id] = (f'Q{quantile}', flag)
                         
             except (ValueError, TypeError) as e:
                 print(f"Could not process value for {indicator_id}: {value} - {str(e)}")
                 continue
         
         # For missing values: predict quantile based on protocol features
-        if indicator_id not in ResultsDict and indicator_id in expected_indicators:
-            # Get quantile features for this indicator
-            FeaturesByQuantile = GetQuantileFeatures(indicator_id, FeaturesByAllLabels, AllQuantileFeatures)
-            
-            if FeaturesByQuantile:
-                # Score the protocol and get predicted quantile
-                scored = ScoreProtocol(protocol_features, FeaturesByQuantile)
-                predicted_quantile = scored.get('Reference Quantile(s)', 'Q3')
-                ResultsDict[indicator_id] = (predicted_quantile, 0)  # Flag 0 for predicted
-            else:
-                # If no quantile features available, default to Q3
-                ResultsDict[indicator_id] = ('Q3', 0)
+        if indicator_id not in ResultsDict and indicator_id in MATURITY_INDICATORS:
+            if predictions is None:
+                predictions = get_maturity_model(target_feature_dict).predict(protocol_features)
+            # Flag 0 for predicted; default to Q3 if no quantile features are available
+            ResultsDict[indicator_id] = (predictions.get(indicator_id, 'Q3'), 0)
     
     return Name, ResultsDict
 
 
-def add_and_sort_by_matches(BinaryFeature_df, selected_columns, categories_dict, filter_features, filter_categories):
+# Per-byte popcount lookup for NumPy builds without np.bitwise_count
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class PackedFeatureMatrix:
+    """
+    Bit-packed protocol x feature matrix built once from the binary features table.
+
+    Each protocol row is stored as a run of uint64 words with one bit per feature,
+    so ranking and filtering reduce to XOR/AND plus popcount over a few words per row
+    instead of boolean DataFrame comparisons.
+    """
+    def __init__(self, words, feature_index, index):
+        self.words = words                  # (n_protocols, n_words) uint64
+        self.feature_index = feature_index  # feature name -> column position
+        self.index = index                  # row labels of the source dataframe
+        self.n_features = len(feature_index)
+
+    @classmethod
+    def from_dataframe(cls, BinaryFeature_df):
+        bits = BinaryFeature_df.to_numpy(dtype=bool)
+        packed = np.packbits(bits, axis=1)
+        pad = (-packed.shape[1]) % 8
+        if pad:
+            packed = np.pad(packed, ((0, 0), (0, pad)))
+        words = np.ascontiguousarray(packed).view(np.uint64)
+        feature_index = {col: i for i, col in enumerate(BinaryFeature_df.columns)}
+        return cls(words, feature_index, BinaryFeature_df.index)
+
+    def mask(self, features):
+        """Pack a list of feature names into a single row of words (unknown names are ignored)."""
+        bits = np.zeros(self.words.shape[1] * 64, dtype=bool)
+        for feature in features:
+            col = self.feature_index.get(feature)
+            if col is not None:
+                bits[col] = True
+        return np.packbits(bits).view(np.uint64)
+
+    @staticmethod
+    def popcount(words):
+        """Count set bits per row of a 2D uint64 array."""
+        if hasattr(np, 'bitwise_count'):
+            return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+        return _POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+    def any_set(self, mask):
+        """Rows sharing at least one set bit with mask"""
+        return (self.words & mask).any(axis=1)
+
+    def all_set(self, mask):
+        """Rows that have every bit of mask set"""
+        return ((self.words & mask) == mask).all(axis=1)
+
+    def dense(self, dtype=np.float32):
+        """Unpacked (n_protocols, n_features) 0/1 matrix, for matrix-product scoring"""
+        bits = np.unpackbits(self.words.view(np.uint8), axis=1)[:, :self.n_features]
+        return bits.astype(dtype)
+
+    def indicator(self, features, dtype=np.float32):
+        """0/1 vector over features for a list of feature names (unknown names are ignored)"""
+        vector = np.zeros(self.n_features, dtype=dtype)
+        for feature in features:
+            col = self.feature_index.get(feature)
+            if col is not None:
+                vector[col] = 1
+        return vector
+
+
+def _score_matches(packed_matrix, selected_columns, categories_dict, filter_features, filter_categories):
+    """
+    Match ranks, category flags and the filter mask shared by the search rankers.
+    
+    Returns:
+        tuple: (additional columns dict, boolean keep mask over packed_matrix rows)
+    """
+    # 1) Match score = number of features where the protocol agrees with the query
+    query_mask = packed_matrix.mask(selected_columns)
+    mismatches = packed_matrix.popcount(packed_matrix.words ^ query_mask)
+    matches = pd.Series(packed_matrix.n_features - mismatches, index=packed_matrix.index)
+    
+    additional = {
+        'Protocol Similarity Rank': matches.rank(method='min', ascending=False).astype(int).to_numpy()
+    }
+    
+    # 2) Per-category "Feature Found" flags
+    selected_set = set(selected_columns)
+    for category, category_features in categories_dict.items():
+        sel_feats = selected_set.intersection(category_features)
+        if sel_feats:
+            additional[f'{category} Feature Found'] = packed_matrix.any_set(packed_matrix.mask(sel_feats))
+        else:
+            additional[f'{category} Feature Found'] = np.zeros(len(packed_matrix.index), dtype=bool)
+    
+    keep = np.ones(len(packed_matrix.index), dtype=bool)
+    
+    # 3) Filter by features: keep rows where *all* listed features are True
+    if filter_features:
+        valid_feature_filters = [f for f in filter_features if f in packed_matrix.feature_index]
+        if valid_feature_filters:
+            keep &= packed_matrix.all_set(packed_matrix.mask(valid_feature_filters))
+    
+    # 4) Filter by categories: keep rows where all corresponding category flags are True
+    if filter_categories:
+        for category in filter_categories:
+            flag_col = f'{category} Feature Found'
+            if flag_col in additional:
+                keep &= additional[flag_col]
+    
+    return additional, keep
+
+
+def _match_keys(ranks, rows, n_protocols):
+    """Unique composite sort keys for the given rows: rank first, then database position"""
+    return np.asarray(ranks)[rows].astype(np.int64) * n_protocols + rows
+
+
+def _match_order(ranks, keep):
+    """
+    Row positions of the kept protocols in result order: by Protocol Similarity Rank,
+    ties broken by database position. SearchRanking orders by the same keys, so pages
+    are slices of this order.
+    """
+    rows = np.flatnonzero(keep)
+    return rows[np.argsort(_match_keys(ranks, rows, len(keep)))]
+
+
+def add_and_sort_by_matches(packed_matrix, selected_columns, categories_dict, filter_features, filter_categories):
     """
     Rank and filter protocols based on feature matching.
-    Preserves the exact behavior of the original implementation.
+    Produces the same ranking, ordering and flags as the original DataFrame
+    implementation, computed over a PackedFeatureMatrix.
     
     Args:
-        BinaryFeature_df: DataFrame with binary features
+        packed_matrix: PackedFeatureMatrix built from the binary features dataframe
         selected_columns: List of column names to match
-        categories_dict: Dictionary mapping features to categories
+        categories_dict: Dictionary mapping categories to their features
         filter_features: List of features to filter by
         filter_categories: List of categories to filter by
     
     Returns:
-        Filtered and sorted DataFrame
+        tuple: (sorted_indices, additional_columns_df)
     """
-    # Calculate match count for each row
-    BinaryFeature_df['Matches'] = BinaryFeature_df[selected_columns].sum(axis=1)
+    additional, keep = _score_matches(
+        packed_matrix, selected_columns, categories_dict, filter_features, filter_categories
+    )
+    additional_df = pd.DataFrame(additional, index=packed_matrix.index)
     
-    # Sort by matches in descending order
-    sorted_df = BinaryFeature_df.sort_values(by='Matches', ascending=False)
+    sorted_df = additional_df.iloc[_match_order(additional['Protocol Similarity Rank'], keep)]
+    return sorted_df.index, sorted_df
+
+
+def batch_sort_by_matches(packed_matrix, queries, categories_dict):
+    """
+    add_and_sort_by_matches for many queries at once. Queries are encoded as a
+    query x feature matrix and scored against the protocol x feature matrix with
+    matrix products instead of one XOR/popcount pass per query.
     
-    # Filter based on categories if specified
-    if filter_categories:
-        category_mask = pd.Series([False] * len(sorted_df), index=sorted_df.index)
-        for feature in selected_columns:
-            if feature in categories_dict:
-                feature_category = categories_dict[feature]
-                if feature_category in filter_categories:
-                    category_mask |= (sorted_df[feature] == True)
-        sorted_df = sorted_df[category_mask]
-    
-    # Filter based on specific features if specified
-    if filter_features:
-        feature_mask = pd.Series([True] * len(sorted_df), index=sorted_df.index)
-        for feature in filter_features:
-            if feature in sorted_df.columns:
-                feature_mask &= (sorted_df[feature] == True)
-        sorted_df = sorted_df[feature_mask]
+    For 0/1 vectors, agreements = n - |protocol| - |query| + 2 * (protocol . query),
+    so one product gives every match score; filter and category flag tests are
+    further products against per-query feature indicator matrices.
+    
+    Args:
+        packed_matrix: PackedFeatureMatrix built from the binary features dataframe
+        queries: List of (selected_columns, filter_features, filter_categories) tuples
+        categories_dict: Dictionary mapping categories to their features
     
-    return sorted_df
+    Returns:
+        list: (sorted_indices, additional_columns_df) per query, as add_and_sort_by_matches
+    """
+    if not queries:
+        return []
+    
+    protocols = packed_matrix.dense()
+    n_protocols = protocols.shape[0]
+    selected = np.stack([packed_matrix.indicator(q[0]) for q in queries])
+    
+    # 1) All match scores in one product: (n_protocols, n_queries)
+    products = protocols @ selected.T
+    matches = (packed_matrix.n_features - protocols.sum(axis=1)[:, None] - selected.sum(axis=1)[None, :]
+               + 2 * products).astype(np.int64)
+    ranks = pd.DataFrame(matches).rank(method='min', ascending=False, axis=0).astype(int).to_numpy()
+    
+    # 2) Category flags: protocol shares a selected feature of that category
+    flags = {}
+    for category, category_features in categories_dict.items():
+        category_selected = selected * packed_matrix.indicator(category_features)
+        flags[category] = (protocols @ category_selected.T) > 0
+    
+    # 3) Feature filters: protocol has every (known) filter feature
+    keep = np.ones((n_protocols, len(queries)), dtype=bool)
+    filters = np.stack([packed_matrix.indicator(q[1]) for q in queries])
+    needed = filters.sum(axis=1)
+    if needed.any():
+        keep &= ((protocols @ filters.T) == needed[None, :]) | (needed[None, :] == 0)
+    
+    results = []
+    for j, (_, _, filter_categories) in enumerate(queries):
+        query_keep = keep[:, j].copy()
+        for category in filter_categories or []:
+            if category in flags:
+                query_keep &= flags[category][:, j]
+        
+        additional = {'Protocol Similarity Rank': ranks[:, j]}
+        for category in categories_dict:
+            additional[f'{category} Feature Found'] = flags[category][:, j]
+        additional_df = pd.DataFrame(additional, index=packed_matrix.index)
+        
+        sorted_df = additional_df.iloc[_match_order(additional['Protocol Similarity Rank'], query_keep)]
+        results.append((sorted_df.index, sorted_df))
+    return results
+
+
+def smallest_k(keys, k):
+    """
+    Positions of the k smallest keys in ascending order, ties broken by position.
+    Selection is O(n) (np.partition) and only the k winners are sorted.
+    """
+    n = len(keys)
+    if k >= n:
+        return np.lexsort((np.arange(n), keys))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    kth = np.partition(keys, k - 1)[k - 1]
+    better = np.flatnonzero(keys < kth)
+    tied = np.flatnonzero(keys == kth)[:k - len(better)]
+    chosen = np.concatenate([better, tied])
+    return chosen[np.lexsort((chosen, keys[chosen]))]
+
+
+class ProtocolSimilarityIndex:
+    """
+    Exact k-nearest-neighbour search over protocol feature bitsets.
+    
+    Works directly on the PackedFeatureMatrix words: Hamming distance is
+    popcount(a ^ b) and Jaccard similarity popcount(a & b) / popcount(a | b),
+    with per-protocol popcounts precomputed. A query is one pass over
+    n_protocols x n_words uint64s plus an O(n) selection of the k best, so it
+    stays interactive far beyond the current database size without an
+    approximate tree index (which would not help at ~500 binary dimensions).
+    """
+    METRICS = ('jaccard', 'hamming')
+
+    def __init__(self, packed_matrix, protocol_ids):
+        self.packed = packed_matrix
+        self.protocol_ids = list(protocol_ids)
+        self.row_of = {pid: row for row, pid in enumerate(self.protocol_ids)}
+        self.row_counts = packed_matrix.popcount(packed_matrix.words)
+
+    def query(self, mask, k=10, metric='jaccard', scope=None, exclude_row=None):
+        """
+        The k protocols most similar to a packed feature mask.
+        
+        Args:
+            mask: Query feature row (PackedFeatureMatrix.mask)
+            k: Number of neighbours
+            metric: 'jaccard' (higher is closer) or 'hamming' (lower is closer)
+            scope: Optional packed mask restricting the comparison to some features
+            exclude_row: Row to leave out (the query protocol itself)
+        
+        Returns:
+            tuple: (rows, scores, shared feature counts), closest first
+        """
+        if metric not in self.METRICS:
+            raise ValueError(f'Unknown metric: {metric}')
+        
+        words = self.packed.words
+        counts = self.row_counts
+        if scope is not None:
+            words = words & scope
+            mask = mask & scope
+            counts = self.packed.popcount(words)
+        
+        shared = self.packed.popcount(words & mask)
+        if metric == 'hamming':
+            scores = self.packed.popcount(words ^ mask)
+            keys = scores.astype(np.float64)
+        else:
+            union = counts + self.packed.popcount(mask[None, :]) - shared
+            scores = np.divide(shared, union, out=np.ones(len(shared)), where=union > 0)
+            keys = -scores
+        
+        if exclude_row is not None:
+            keys = keys.copy()
+            keys[exclude_row] = np.inf
+            k = min(k, len(keys) - 1)
+        rows = smallest_k(keys, k)
+        return rows, scores[rows], shared[rows]
+
+
+class SearchRanking:
+    """
+    Ranked protocols for one search, sorted only as far as has been asked for.
+    
+    Protocols are ordered by the same composite key as _match_order (rank first,
+    then database position), so every page and top-k cut is a slice of the unpaged
+    /api/submit_features table. top(k) selects the k best with np.argpartition and
+    sorts just those, so the work grows with k rather than with the number of
+    protocols; the sorted prefix is kept for later pages.
+    """
+    def __init__(self, additional, keep, index):
+        self.rows = np.flatnonzero(keep)
+        self.total = len(self.rows)
+        self.index = index
+        self.additional = {col: values[self.rows] for col, values in additional.items()}
+        self._keys = _match_keys(additional['Protocol Similarity Rank'], self.rows, len(index))
+        self._prefix = np.empty(0, dtype=np.int64)
+
+    def top(self, k):
+        """Positions (into self.rows) of the k best protocols, best first"""
+        k = max(0, min(k, self.total))
+        prefix = self._prefix
+        if k > len(prefix):
+            if k < self.total:
+                candidates = np.argpartition(self._keys, k - 1)[:k]
+            else:
+                candidates = np.arange(self.total)
+            prefix = candidates[np.argsort(self._keys[candidates])]
+            self._prefix = prefix
+        return prefix[:k]
+
+    def page(self, offset, limit):
+        """Index labels and additional columns for ranked positions offset..offset+limit"""
+        positions = self.top(offset + limit)[offset:]
+        labels = self.index[self.rows[positions]]
+        return labels, pd.DataFrame({col: values[positions] for col, values in self.additional.items()}, index=labels)
+
+
+def rank_by_matches(packed_matrix, selected_columns, categories_dict, filter_features, filter_categories):
+    """
+    Same scoring and filtering as add_and_sort_by_matches, returned as a SearchRanking
+    for top-k and paginated access.
+    """
+    additional, keep = _score_matches(
+        packed_matrix, selected_columns, categories_dict, filter_features, filter_categories
+    )
+    return SearchRanking(additional, keep, packed_matrix.index)
@@ -19,6 +19,26 @@ CMPortal.initTabs = function() {
     });
 };
 
+// Large tables can be requested column-wise: {columns: [...], values: [[...], ...]}
+CMPortal.COLUMNAR_JSON = 'application/vnd.cmportal.columnar+json';
+
+// Rebuild row objects from a columnar table (row arrays pass through unchanged)
+CMPortal.decodeTable = function(table) {
+    if (!table || Array.isArray(table)) return table;
+    const columns = table.columns;
+    const values = table.values;
+    const nRows = values.length ? values[0].length : 0;
+    const rows = new Array(nRows);
+    for (let i = 0; i < nRows; i++) {
+        const row = {};
+        for (let j = 0; j < columns.length; j++) {
+            row[columns[j]] = values[j][i];
+        }
+        rows[i] = row;
+    }
+    return rows;
+};
+
 // Initialize the application
 $(document).ready(function() {
     // Initialize tabs
@@ -777,17 +777,8 @@ CMPortal.benchmark.submitAndDisplayResults = function() {
         formData.append('selected_protocol_ids[]', id);
     });
     
-    // Make the API request
-    fetch('/api/submit_benchmark', {
-        method: 'POST',
-        body: formData
-    })
-    .then(response => {
-        if (!response.ok) {
-            throw new Error(`Server responded with ${response.status}: ${response.statusText}`);
-        }
-        return response.json();
-    })
+    // Queue the benchmark and wait for its results
+    CMPortal.benchmark.runBenchmarkJob(formData)
     .then(data => {
         // Re-enable submit button
         submitBtn.disabled = false;
@@ -852,6 +843,66 @@ CMPortal.benchmark.submitAndDisplayResults = function() {
     });
 };
 
+// Submit a benchmark job and resolve with its results (same shape as /api/submit_benchmark)
+CMPortal.benchmark.runBenchmarkJob = function(formData) {
+    return fetch('/api/benchmark_jobs', {
+        method: 'POST',
+        body: formData
+    })
+    .then(response => response.json().catch(() => {
+        throw new Error(`Server responded with ${response.status}: ${response.statusText}`);
+    }))
+    .then(job => {
+        if (job.status === 'error') return job;
+        return CMPortal.benchmark.waitForJob(job);
+    });
+};
+
+// Follow a job's progress events (polling when EventSource is unavailable) until it finishes
+CMPortal.benchmark.waitForJob = function(job) {
+    return new Promise((resolve, reject) => {
+        const showProgress = progress => {
+            CMPortal.benchmark.showStatusMessage(`⏳ ${progress.message} (${progress.step}/${progress.steps})`, true);
+        };
+        
+        const poll = () => {
+            fetch(job.status_url)
+            .then(response => response.json())
+            .then(data => {
+                if (data.status === 'error') {
+                    resolve(data);
+                } else if (data.job.state === 'done') {
+                    resolve(data.result);
+                } else if (data.job.state === 'error') {
+                    resolve({status: 'error', message: `Error processing benchmark: ${data.job.error}`});
+                } else {
+                    const progress = data.job.progress;
+                    if (progress.length > 0) showProgress(progress[progress.length - 1]);
+                    setTimeout(poll, 1000);
+                }
+            })
+            .catch(reject);
+        };
+        
+        if (typeof EventSource === 'undefined') {
+            poll();
+            return;
+        }
+        
+        const events = new EventSource(job.events_url);
+        events.addEventListener('progress', e => showProgress(JSON.parse(e.data)));
+        events.addEventListener('done', () => {
+            events.close();
+            poll();
+        });
+        events.addEventListener('error', () => {
+            // Stream failed or the job ended in an error: the status endpoint has the details
+            events.close();
+            poll();
+        });
+    });
+};
+
 // Format the results for the radar chart
 CMPortal.benchmark.formatResultsForRadar = function(data) {
     // Check if we have valid data
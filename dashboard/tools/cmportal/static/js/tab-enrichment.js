@@ -240,10 +240,11 @@
       tableEl.innerHTML = '';
     }
 
-    fetch(url)
+    fetch(url, { headers: { Accept: CMPortal.COLUMNAR_JSON } })
       .then(res => res.json())
       .then(json => {
         if (json.error) throw new Error(json.error);
+        json.data = CMPortal.decodeTable(json.data);
 
         if (submissionResult) {
           const filterMsg = isFiltered ? ` (${json.filtered_count} protocol variables)` : '';
@@ -552,7 +552,10 @@ CMPortal.search = {};
 
       fetch('/api/submit_features', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8' },
+        headers: {
+          'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8',
+          'Accept': CMPortal.COLUMNAR_JSON
+        },
         body: payload.toString()
       })
       .then(res => {
@@ -560,6 +563,9 @@ CMPortal.search = {};
         return res.json();
       })
       .then(data => {
+        if (data.search_results) {
+          data.search_results.data = CMPortal.decodeTable(data.search_results.data);
+        }
         submitBtn.disabled = false;
         submitBtn.textContent = 'Search Protocols';
         resultDisplay.classList.remove('search-ui-hidden');
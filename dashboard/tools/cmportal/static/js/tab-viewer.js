@@ -16,21 +16,18 @@ CMPortal.viewer.categoryRow = null;
 CMPortal.viewer.init = function() {
     if (CMPortal.viewer.initialized) return;
     
-    // Load data from API
+    // Load column names and categories only; rows are fetched page by page
     $.ajax({
         url: '/api/viewer',
         type: 'GET',
         dataType: 'json',
+        data: { limit: 0 },
         success: function(response) {
-            if (response.data && response.data.length > 0) {
-                // Extract the category row (first row)
-                CMPortal.viewer.categoryRow = response.data[0];
+            if (response.columns && response.columns.length > 0 && response.total > 0) {
+                // Category of each column (first row of the database)
+                CMPortal.viewer.categoryRow = response.categories;
                 
-                // Create data without the category row
-                const dataWithoutCategory = [...response.data];
-                dataWithoutCategory.splice(0, 1);
-                
-                CMPortal.viewer.initializeTable(dataWithoutCategory, response.columns);
+                CMPortal.viewer.initializeTable(response.columns);
                 $('#loading-indicator').addClass('d-none');
                 $('#table-container').removeClass('d-none');
             } else {
@@ -45,8 +42,81 @@ CMPortal.viewer.init = function() {
     CMPortal.viewer.initialized = true;
 };
 
+// Map a DataTables server-side request onto /api/viewer query parameters
+CMPortal.viewer.buildQuery = function(dtParams) {
+    return {
+        offset: dtParams.start,
+        limit: dtParams.length,
+        q: dtParams.search ? dtParams.search.value : '',
+        'sort[]': (dtParams.order || []).map(function(o) {
+            return dtParams.columns[o.column].data + ':' + o.dir;
+        })
+    };
+};
+
+// DataTables ajax source: fetch one filtered, sorted page from the server
+CMPortal.viewer.fetchPage = function(dtParams, callback) {
+    $.ajax({
+        url: '/api/viewer',
+        type: 'GET',
+        dataType: 'json',
+        traditional: true,
+        headers: { Accept: CMPortal.COLUMNAR_JSON },
+        data: CMPortal.viewer.buildQuery(dtParams),
+        success: function(response) {
+            callback({
+                draw: dtParams.draw,
+                recordsTotal: response.total,
+                recordsFiltered: response.filtered,
+                data: CMPortal.decodeTable(response.data)
+            });
+        },
+        error: function(xhr, status, error) {
+            CMPortal.viewer.showError('Error loading data: ' + error);
+        }
+    });
+};
+
+// Download every filtered row (visible columns only) as CSV
+CMPortal.viewer.exportCsv = function(dt) {
+    const visibleColumns = dt.columns(':visible').dataSrc().toArray();
+    const titles = dt.columns(':visible').header().toArray().map(th => $(th).text());
+    const query = CMPortal.viewer.buildQuery(dt.ajax.params());
+    query.offset = 0;
+    query.limit = dt.page.info().recordsDisplay;
+    query['columns[]'] = visibleColumns;
+    
+    $.ajax({
+        url: '/api/viewer',
+        type: 'GET',
+        dataType: 'json',
+        traditional: true,
+        headers: { Accept: CMPortal.COLUMNAR_JSON },
+        data: query,
+        success: function(response) {
+            const escape = value => '"' + String(value).replace(/"/g, '""') + '"';
+            const lines = [titles.map(escape).join(',')];
+            CMPortal.decodeTable(response.data).forEach(row => {
+                lines.push(visibleColumns.map(col => escape(row[col])).join(','));
+            });
+            
+            const blob = new Blob([lines.join('\n')], { type: 'text/csv;charset=utf-8;' });
+            const link = document.createElement('a');
+            link.href = URL.createObjectURL(blob);
+            link.download = 'CMPortal_Database.csv';
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+            URL.revokeObjectURL(link.href);
+        },
+        error: function(xhr, status, error) {
+            CMPortal.viewer.showError('Error exporting data: ' + error);
+        }
+    });
+};
+
 // Initialize the DataTable
-CMPortal.viewer.initializeTable = function(data, columnNames) {
+CMPortal.viewer.initializeTable = function(columnNames) {
     // Group columns by category with a defined order
     const columnsByCategory = {};
     
@@ -152,9 +222,11 @@ CMPortal.viewer.initializeTable = function(data, columnNames) {
     // Prepare DataTable buttons array
     const buttons = [
         {
-            extend: 'csv',
             className: 'btn btn-sm btn-secondary mr-2',
-            text: 'Install'
+            text: 'Install',
+            action: function(e, dt) {
+                CMPortal.viewer.exportCsv(dt);
+            }
         }
     ];
     
@@ -191,7 +263,10 @@ CMPortal.viewer.initializeTable = function(data, columnNames) {
     
     // Initialize DataTable with the flattened columns
     const table = $('#data-table').DataTable({
-        data: data,
+        serverSide: true,
+        processing: true,
+        searchDelay: 300,
+        ajax: CMPortal.viewer.fetchPage,
         columns: flattenedColumns,
         scrollX: true,
         scrollY: '60vh',